@@ -0,0 +1,93 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares two suite.py result files and flags regressions.
+Usage: python benchmarks/compare.py base.json new.json [-t 0.1]
+Exits with status 1 if any scenario got slower than the threshold.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import sys
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Compares the median times of two result sets.
+    Returns a list of (name, base median, new median, change, verdict) -
+        tuples; change is the relative change in time per operation.
+    Required arguments:
+    * base - Baseline results, as loaded from suite.py's JSON.
+    * new - Results to check.
+    Optional arguments:
+    * threshold=0.1 - Relative change that counts as a regression -
+        or an improvement.
+    """
+    rows = []
+    base = base['benchmarks']
+    new = new['benchmarks']
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            rows.append((name, base.get(name, {}).get('median'), \
+                         new.get(name, {}).get('median'), None, 'missing'))
+            continue
+        before = base[name]['median']
+        after = new[name]['median']
+        change = after / before - 1
+        if change > threshold:
+            verdict = 'REGRESSION'
+        elif change < -threshold:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        rows.append((name, before, after, change, verdict))
+    return rows
+
+
+def _format(seconds):
+    if seconds is None:
+        return '-'
+    return '%.2f us' % (seconds * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare benchmark results.')
+    parser.add_argument('base', help='baseline results')
+    parser.add_argument('new', help='results to check')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, \
+                        help='relative slowdown that counts as a regression')
+    args = parser.parse_args()
+    with open(args.base) as base:
+        base = json.load(base)
+    with open(args.new) as new:
+        new = json.load(new)
+    rows = compare(base, new, args.threshold)
+    print('%-20s %14s %14s %8s' % ('scenario', 'base', 'new', 'change'))
+    for name, before, after, change, verdict in rows:
+        if change is None:
+            change = '-'
+        else:
+            change = '%+.1f%%' % (change * 100)
+        print('%-20s %14s %14s %8s %s' % (name, _format(before), \
+                                          _format(after), change, verdict))
+    if [row for row in rows if row[4] == 'REGRESSION']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
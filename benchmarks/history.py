@@ -0,0 +1,83 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks HistoryStore inserts and seen/history queries.
+Usage: python benchmarks/history.py [rows]
+"""
+
+from __future__ import print_function
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lurklib.history import HistoryStore
+
+NICKS = 20000
+CHANNELS = 200
+BATCH = 10000
+
+
+def main(rows=1000000):
+    directory = tempfile.mkdtemp()
+    try:
+        store = HistoryStore(os.path.join(directory, 'history.db'))
+        rand = random.Random(1)
+        start = timeit.default_timer()
+        for number in range(rows):
+            store.add('User%d' % rand.randrange(NICKS), 'PRIVMSG', \
+                      '#channel%d' % rand.randrange(CHANNELS), \
+                      'message number %d' % number, 'ident@host', \
+                      1.3e9 + number)
+            if number % BATCH == BATCH - 1:
+                store.flush()
+        store.flush()
+        elapsed = timeit.default_timer() - start
+        print('insert   %8.0f rows/s (%d rows)' % (rows / elapsed, rows))
+
+        nicks = ['USER%d' % rand.randrange(NICKS) for number in range(1000)]
+        elapsed = timeit.timeit(lambda: [store.seen(nick) \
+                                         for nick in nicks], number=1)
+        print('seen     %8.3f ms' % (elapsed / len(nicks) * 1000))
+        channels = ['#Channel%d' % rand.randrange(CHANNELS) \
+                    for number in range(1000)]
+        elapsed = timeit.timeit(lambda: [store.history(channel) \
+                                         for channel in channels], number=1)
+        print('history  %8.3f ms (latest 100)' % \
+              (elapsed / len(channels) * 1000))
+        since = 1.3e9 + rows // 2
+        elapsed = timeit.timeit(lambda: [store.history(channel, since, 50) \
+                                         for channel in channels], number=1)
+        print('history  %8.3f ms (50 since a time)' % \
+              (elapsed / len(channels) * 1000))
+        elapsed = timeit.timeit(lambda: [store.history(channel, nick=nick) \
+                                         for channel, nick in \
+                                         zip(channels, nicks)], number=1)
+        print('history  %8.3f ms (one nick)' % \
+              (elapsed / len(channels) * 1000))
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,103 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks ChannelLogger at 5k lines/sec over 20 channels against -
+    appending each line to its file from the handler.
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lurklib.logsink import ChannelLogger
+
+RATE = 5000
+SECONDS = 3
+CHANNELS = 20
+
+
+class _Client(object):
+    channels = {}
+    current_nick = 'bench'
+
+
+def events(count):
+    return [(('user%d' % (number % 300), 'ident', 'host'), \
+             '#channel%d' % (number % CHANNELS), \
+             'a line of channel chat, number %d' % number) \
+            for number in range(count)]
+
+
+def paced(handle, messages):
+    """
+    Calls handle for each message at RATE messages per second.
+    Returns the seconds spent inside handle.
+    """
+    busy = 0
+    start = time.time()
+    for number, args in enumerate(messages):
+        delay = start + number / float(RATE) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        before = timeit.default_timer()
+        handle(args)
+        busy += timeit.default_timer() - before
+    return busy
+
+
+def main():
+    messages = events(RATE * SECONDS)
+    directory = tempfile.mkdtemp()
+    try:
+        client = _Client()
+        logger = ChannelLogger(os.path.join(directory, 'sink'))
+        busy = paced(lambda args: logger.event(client, 'on_chanmsg', args), \
+                     messages)
+        logger.close()
+        assert logger.lines == len(messages)
+        print('ChannelLogger   %6.2f us/line in the handler thread' % \
+              (busy / len(messages) * 1e6))
+
+        naive_dir = os.path.join(directory, 'naive')
+        os.mkdir(naive_dir)
+
+        def naive(args):
+            with open(os.path.join(naive_dir, args[1] + '.log'), 'a') as log:
+                log.write('[%s] <%s> %s\n' % (time.strftime('%H:%M:%S'), \
+                                              args[0][0], args[2]))
+        busy = paced(naive, messages)
+        print('open/write/close %5.2f us/line in the handler thread' % \
+              (busy / len(messages) * 1e6))
+
+        burst = events(100000)
+        logger = ChannelLogger(os.path.join(directory, 'burst'))
+        elapsed = timeit.timeit(lambda: [logger.event(client, \
+                                         'on_chanmsg', args) \
+                                         for args in burst], number=1)
+        logger.close()
+        print('ChannelLogger   %6.0f lines/s unpaced' % \
+              (len(burst) / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Benchmarks MaskIndex against an fnmatch loop with 10k masks. """
+
+from __future__ import print_function
+import os
+import sys
+import random
+import timeit
+from fnmatch import fnmatchcase
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lurklib.masks import MaskIndex
+
+MASKS = 10000
+
+
+def make_masks(count, seed=1):
+    """ Returns a mix of host, domain, nick and free-form masks. """
+    rand = random.Random(seed)
+    masks = []
+    for number in range(count):
+        kind = rand.random()
+        if kind < 0.5:
+            masks.append('*!*@10.%d.%d.%d' % (number // 65536 % 256, \
+                                              number // 256 % 256, \
+                                              number % 256))
+        elif kind < 0.8:
+            masks.append('*!*@*.isp%d.example.net' % number)
+        elif kind < 0.95:
+            masks.append('spammer%d!*@*' % number)
+        else:
+            masks.append('*bot%d*!*ident%d@*' % (number, number))
+    return masks
+
+
+def make_hostmasks(count, seed=2):
+    rand = random.Random(seed)
+    return ['user%d!~ident@host%d.isp%d.example.net' % (number, number, \
+                                            rand.randrange(MASKS * 2)) \
+            for number in range(count)]
+
+
+def main():
+    masks = make_masks(MASKS)
+    hostmasks = make_hostmasks(1000)
+    start = timeit.default_timer()
+    index = MaskIndex(masks)
+    print('index build    %8.1f ms' % \
+          ((timeit.default_timer() - start) * 1000))
+    elapsed = timeit.timeit(lambda: [index.match(hostmask) \
+                                     for hostmask in hostmasks], number=5)
+    per_match = elapsed / 5 / len(hostmasks)
+    print('MaskIndex      %8.1f us/match' % (per_match * 1e6))
+    lowered = [mask.lower() for mask in masks]
+    sample = hostmasks[:50]
+    elapsed = timeit.timeit(lambda: [[mask for mask in lowered \
+                                      if fnmatchcase(hostmask, mask)] \
+                                     for hostmask in sample], number=1)
+    per_scan = elapsed / len(sample)
+    print('fnmatch loop   %8.1f us/match (%.0fx)' % (per_scan * 1e6, \
+                                                    per_scan / per_match))
+    for hostmask in sample:
+        expected = sorted(mask for mask in lowered \
+                          if fnmatchcase(hostmask, mask))
+        assert sorted(index.match(hostmask)) == expected, hostmask
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Benchmarks splitting large pastes into IRC lines. """
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lurklib.sending import split_message
+
+BUDGET = 440
+PASTES = {
+    'ascii': ('The quick brown fox jumps over the lazy dog. ' * 2000) \
+                .encode('UTF-8'),
+    'utf-8': (u'\u043f\u0440\u0438\u0432\u0435\u0442 \u4e16\u754c! ' * 8000) \
+                .encode('UTF-8'),
+    'no spaces': (u'\u00e9' * 50000).encode('UTF-8'),
+    }
+
+
+def main(number=20):
+    for name, data in sorted(PASTES.items()):
+        parts = len(split_message(data, BUDGET))
+        elapsed = timeit.timeit(lambda: split_message(data, BUDGET), \
+                                number=number) / number
+        print('%-10s %8d bytes %5d lines %9.3f ms %8.1f MB/s' % \
+              (name, len(data), parts, elapsed * 1000, \
+               len(data) / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks the receive, parse, dispatch, state and send hot paths.
+Usage: python benchmarks/suite.py [-o results.json] [-r repeat] [name ...]
+Every scenario reports the time per operation; the JSON results -
+    can be compared with compare.py.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+import lurklib
+from offline import offline_client
+from lurklib.sending import split_message
+from lurklib.masks import MaskIndex
+from lurklib.triggers import Triggers
+
+SCENARIOS = []
+
+
+def scenario(name, loops):
+    """
+    Registers a scenario: a function that runs loops operations -
+        and returns the seconds they took, without its setup.
+    Required arguments:
+    * name - Scenario name.
+    * loops - Operations per run.
+    """
+    def register(function):
+        SCENARIOS.append((name, loops, function))
+        return function
+    return register
+
+
+def bench_client(channels=('#c',), users=0):
+    """
+    Returns a registered client on a MemorySocket, -
+        in channels with users members each.
+    """
+    client = offline_client(nick='bench')
+    client.version['PREFIX'] = '(ov)@+'
+    client.version['CHANMODES'] = 'beI,k,l,imnpst'
+    for channel in channels:
+        client.channels[channel] = {'USERS': dict( \
+            ('user%d' % number, ['', '', '', '', '']) \
+            for number in range(users))}
+    return client
+
+
+def privmsgs(count):
+    return [':user%d!ident@host.example.net PRIVMSG #c :message number %d' \
+            % (number % 100, number) for number in range(count)]
+
+
+def _recv_lines(client, lines):
+    client._socket.feed(*lines)
+    start = timeit.default_timer()
+    for line in lines:
+        client.recv()
+    return timeit.default_timer() - start
+
+
+@scenario('framing', 10000)
+def bench_framing(loops):
+    client = bench_client()
+    client._socket.feed(*privmsgs(loops))
+    start = timeit.default_timer()
+    while client._socket.pending():
+        client._mcon()
+    return timeit.default_timer() - start
+
+
+@scenario('recv_privmsg', 10000)
+def bench_recv_privmsg(loops):
+    return _recv_lines(bench_client(), privmsgs(loops))
+
+
+@scenario('recv_join', 10000)
+def bench_recv_join(loops):
+    return _recv_lines(bench_client(), \
+                       [':joiner%d!ident@host JOIN :#c' % number \
+                        for number in range(loops)])
+
+
+@scenario('recv_quit', 10000)
+def bench_recv_quit(loops):
+    return _recv_lines(bench_client(users=loops), \
+                       [':user%d!ident@host QUIT :bye' % number \
+                        for number in range(loops)])
+
+
+@scenario('recv_numeric', 10000)
+def bench_recv_numeric(loops):
+    return _recv_lines(bench_client(), \
+                       [':irc.example.net 372 bench :- message of the day' \
+                        for number in range(loops)])
+
+
+@scenario('process_once', 10000)
+def bench_process_once(loops):
+    client = bench_client()
+    client._socket.feed(*privmsgs(loops))
+    start = timeit.default_timer()
+    for number in range(loops):
+        client.process_once(0)
+    return timeit.default_timer() - start
+
+
+@scenario('parse_cmode_string', 10000)
+def bench_parse_cmode_string(loops):
+    client = bench_client(users=10)
+    client.channels['#c']['LISTS'] = {'b': {}}
+    start = timeit.default_timer()
+    for number in range(loops):
+        client.parse_cmode_string('+ovb-v user1 user2 *!*@bad%d user3' % \
+                                  number, '#c', 'op!op@host')
+    return timeit.default_timer() - start
+
+
+@scenario('names_50k', 1)
+def bench_names_50k(loops):
+    elapsed = 0
+    for number in range(loops):
+        client = bench_client(channels=())
+        names = ['user%d' % user for user in range(50000)]
+        lines = [':bench!ident@host JOIN :#big']
+        for start in range(0, len(names), 40):
+            lines.append(':irc.example.net 353 bench = #big :%s' % \
+                         ' '.join(names[start:start + 40]))
+        lines.append(':irc.example.net 366 bench #big :End of /NAMES list.')
+        client._socket.feed(*lines)
+        start = timeit.default_timer()
+        client.join_('#big')
+        elapsed += timeit.default_timer() - start
+        assert len(client.channels['#big']['USERS']) == 50000
+    return elapsed
+
+
+@scenario('quit_2k_channels', 50)
+def bench_quit_2k_channels(loops):
+    client = bench_client(['#c%d' % number for number in range(2000)], \
+                            users=20)
+    elapsed = 0
+    for number in range(loops):
+        for channel in client.channels.values():
+            channel['USERS']['user0'] = ['', '', '', '', '']
+        client._socket.feed(':user0!ident@host QUIT :bye')
+        start = timeit.default_timer()
+        client.recv()
+        elapsed += timeit.default_timer() - start
+    return elapsed
+
+
+@scenario('send', 10000)
+def bench_send(loops):
+    client = bench_client()
+    message = 'PRIVMSG #c :' + 'a fairly ordinary line of chat ' * 4
+    start = timeit.default_timer()
+    for number in range(loops):
+        client.send(message)
+    return timeit.default_timer() - start
+
+
+@scenario('split_message', 20)
+def bench_split_message(loops):
+    data = ('The quick brown fox jumps over the lazy dog. ' * 2000) \
+           .encode('UTF-8')
+    return timeit.timeit(lambda: split_message(data, 440), number=loops)
+
+
+@scenario('mask_match_10k', 1000)
+def bench_mask_match(loops):
+    from masks import make_masks, make_hostmasks
+    index = MaskIndex(make_masks(10000))
+    hostmasks = make_hostmasks(loops)
+    start = timeit.default_timer()
+    for hostmask in hostmasks:
+        index.match(hostmask)
+    return timeit.default_timer() - start
+
+
+@scenario('triggers_match', 1000)
+def bench_triggers(loops):
+    from triggers import make_data
+    keywords, regexes, messages = make_data(loops)
+    triggers = Triggers()
+    for number, keyword in enumerate(keywords):
+        triggers.add_keyword('k%d' % number, keyword, whole_word=False)
+    for number, pattern in enumerate(regexes):
+        triggers.add_regex('r%d' % number, pattern)
+    triggers.match('')
+    start = timeit.default_timer()
+    for message in messages:
+        triggers.match(message)
+    return timeit.default_timer() - start
+
+
+_WHOIS = []
+
+
+def _close_whois():
+    """ Disconnects the whois_loopback client and stops its server. """
+    if _WHOIS:
+        server, client = _WHOIS.pop()
+        client.quit()
+        server.stop()
+
+
+@scenario('whois_loopback', 200)
+def bench_whois(loops):
+    if not _WHOIS:
+        from fakeserver import FakeServer
+        server = FakeServer(latency=0)
+        server.add_channel('#c', users=10)
+        host, port = server.start()
+        _WHOIS.append((server, lurklib.Client(host, port, nick='bench', \
+                                              tls=False)))
+    client = _WHOIS[0][1]
+    start = timeit.default_timer()
+    for number in range(loops):
+        client.whois('user%d' % (number % 10))
+    return timeit.default_timer() - start
+
+
+def run(names=None, repeat=5):
+    """
+    Runs the scenarios, each once to warm up and then repeat times.
+    Returns the results as a dictionary for JSON output.
+    Optional arguments:
+    * names=None - Scenarios to run; None runs all of them.
+    * repeat=5 - Runs per scenario.
+    """
+    results = {}
+    try:
+        for name, loops, function in SCENARIOS:
+            if names and name not in names:
+                continue
+            try:
+                function(loops)
+                runs = [function(loops) / loops for number in range(repeat)]
+            except (ImportError, SyntaxError) as exception:
+                print('%-20s skipped: %s' % (name, exception))
+                continue
+            runs.sort()
+            results[name] = {'loops': loops, 'runs': runs, \
+                             'best': runs[0], 'median': runs[len(runs) // 2]}
+            print('%-20s %12.2f us/op (best %.2f)' % \
+                  (name, runs[len(runs) // 2] * 1e6, runs[0] * 1e6))
+    finally:
+        _close_whois()
+    return {'python': platform.python_version(), \
+            'implementation': platform.python_implementation(), \
+            'lurklib': lurklib.__version__, 'benchmarks': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lurklib benchmarks.')
+    parser.add_argument('names', nargs='*', help='scenarios to run')
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('-r', '--repeat', type=int, default=5, \
+                        help='runs per scenario')
+    parser.add_argument('-l', '--list', action='store_true', \
+                        help='list the scenarios')
+    args = parser.parse_args()
+    if args.list:
+        for name, loops, function in SCENARIOS:
+            print(name)
+        return
+    results = run(args.names, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
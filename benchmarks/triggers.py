@@ -0,0 +1,80 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Benchmarks Triggers against testing each trigger in turn. """
+
+from __future__ import print_function
+import os
+import re
+import sys
+import random
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from lurklib.triggers import Triggers
+
+KEYWORDS = 500
+REGEXES = 100
+MESSAGES = 2000
+
+
+def make_words(rand, count):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rand.choice(letters) for _ in range(rand.randint(4, 9))) \
+            for _ in range(count)]
+
+
+def make_data(messages=MESSAGES, seed=1):
+    """ Returns the keywords, regexes and messages to match. """
+    rand = random.Random(seed)
+    keywords = make_words(rand, KEYWORDS)
+    regexes = [r'\b%s\d+\b' % word for word in make_words(rand, REGEXES)]
+    vocabulary = make_words(rand, 3000) + keywords[:20]
+    messages = [' '.join(rand.choice(vocabulary) for _ in \
+                         range(rand.randint(5, 40))) for _ in range(messages)]
+    return keywords, regexes, messages
+
+
+def main():
+    keywords, regexes, messages = make_data()
+
+    triggers = Triggers()
+    for number, keyword in enumerate(keywords):
+        triggers.add_keyword('k%d' % number, keyword, whole_word=False)
+    for number, pattern in enumerate(regexes):
+        triggers.add_regex('r%d' % number, pattern)
+    triggers.match('')
+
+    compiled = [re.compile(pattern, re.IGNORECASE) for pattern in regexes]
+
+    def naive(text):
+        lowered = text.lower()
+        return [keyword for keyword in keywords if keyword in lowered] + \
+               [regex for regex in compiled if regex.search(text)]
+
+    size = sum(len(message) for message in messages)
+    for name, function in (('Triggers', triggers.match), \
+                           ('naive loop', naive)):
+        elapsed = timeit.timeit(lambda: [function(message) \
+                                         for message in messages], number=3)
+        elapsed /= 3
+        print('%-10s %7.1f us/message %7.2f MB/s' % \
+              (name, elapsed / MESSAGES * 1e6, size / elapsed / 1e6))
+    for message in messages:
+        assert len(triggers.match(message)) == len(naive(message))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,13 +17,33 @@
 """ High level abstraction Lurklib file. """
 
 from __future__ import with_statement
-from . import core
+from . import core, executor
+from .metrics import HandlerStats
+from .executor import KeyedExecutor, cpu_bound
+from .commands import CommandRouter
+from .triggers import Triggers
+from .recorder import Recorder
 
 __version__ = '1.0.1'
 
 
 class Client(core._Core):
     """ High level IRC abstraction class """
+    _channel_hooks = frozenset(('on_join', 'on_part', 'on_chanmsg', \
+                                'on_channotice', 'on_chanctcp', 'on_cmode', \
+                                'on_kick', 'on_topic'))
+    _private_hooks = frozenset(('on_privmsg', 'on_privnotice', \
+                                'on_privctcp', 'on_ctcp_reply', 'on_invite'))
+    # Commands that only trigger handlers and don't change the IRC state.
+    _command_hooks = {'PRIVMSG': ('on_chanmsg', 'on_privmsg', \
+                                  'on_chanctcp', 'on_privctcp'),
+                      'NOTICE': ('on_channotice', 'on_privnotice', \
+                                 'on_ctcp_reply'),
+                      'INVITE': ('on_invite',),
+                      'UNKNOWN': ('on_unknown',)}
+    _message_hooks = frozenset(('on_chanmsg', 'on_privmsg', \
+                                'on_channotice', 'on_privnotice'))
+
     def process_once(self, timeout=0.01):
         """
         Handles an event and calls it's handler
@@ -31,70 +51,353 @@ class Client(core._Core):
         * timeout=0.01 - Wait for an event until the timeout is reached.
         """
         try:
-            event = self.recv(timeout)
+            if self.raw_mode:
+                message = self.recv_raw(timeout)
+                if message:
+                    self._dispatch('on_raw', (message,), message)
+                return
+            event = self.recv(timeout, self._skipped_commands())
             if event:
-                event_t = event[0]
-                event_c = event[1]
-
-                if event_t == 'JOIN':
-                    self.on_join(event_c[0], event_c[1])
-                elif event_t == 'PART':
-                    self.on_part(event_c[0], event_c[1], event_c[2])
-                elif event_t == 'PRIVMSG':
-                    if event_c[1] in self.channels.keys():
-                        self.on_chanmsg(event_c[0], event_c[1], event_c[2])
-                    else:
-                        self.on_privmsg(event_c[0], event_c[2])
-                elif event_t == 'NOTICE':
-                    if event_c[1] in self.channels.keys():
-                        self.on_channotice(event_c[0], event_c[1], event_c[2])
-                    else:
-                        self.on_privnotice(event_c[0], event_c[2])
-                elif event_t == 'CTCP':
-                    if event_c[1] in self.channels.keys():
-                        self.on_chanctcp(event_c[0], event_c[1], event_c[2])
-                    else:
-                        self.on_privctcp(event_c[0], event_c[2])
-                elif event_t == 'CTCP_REPLY':
-                    self.on_ctcp_reply(event_c[0], event_c[2])
-                elif event_t == 'MODE':
-                    if event_c[0][0] == self.current_nick:
-                        self.on_umode(event_c[1])
-                    else:
-                        self.on_cmode(event_c[0], event_c[1], event_c[2])
-                elif event_t == 'KICK':
-                    self.on_kick(event_c[0], event_c[1], event_c[2], \
-                    event_c[3])
-                elif event_t == 'INVITE':
-                    self.on_invite(event_c[0], event_c[2])
-                elif event_t == 'NICK':
-                    self.on_nick(event_c[0], event_c[1])
-                elif event_t == 'TOPIC':
-                    self.on_topic(event_c[0], event_c[1], event_c[2])
-                elif event_t == 'QUIT':
-                    self.on_quit(event_c[0], event_c[1])
-                elif event_t == 'LUSERS':
-                    self.on_lusers(event_c)
-                elif event_t == 'ERROR':
-                    self.on_error(event_c[0])
-                elif event_t == 'UNKNOWN':
-                    self.on_unknown(event_c[0])
+                hook, args = self._event_hook(event[0], event[1])
+                if hook and self.sinks:
+                    for sink in self.sinks:
+                        sink.event(self, hook, args)
+                if hook and self.executor is not None:
+                    self.executor.submit(self._event_key(hook, args), \
+                                         self._call_handler, hook, args, event)
+                elif hook:
+                    self._dispatch(hook, args, event)
+
+        except self.LurklibError as exception:
+            self.on_exception(exception)
+
+    def _skipped_commands(self):
+        """
+        Returns the commands that no handler listens to, so recv -
+            can drop them without parsing them.
+        Commands that change the IRC state are never skipped.
+        Computed once per class from the overridden on_* methods;
+            handlers assigned on the instance turn skipping off.
+        """
+        cls = type(self)
+        skip = cls.__dict__.get('_skip_cache')
+        if skip is None:
+            skip = set()
+            for command, hooks in self._command_hooks.items():
+                for hook in hooks:
+                    handler = getattr(cls, hook)
+                    default = getattr(Client, hook)
+                    if getattr(handler, '__func__', handler) is not \
+                       getattr(default, '__func__', default):
+                        break
+                else:
+                    skip.add(command)
+            skip = frozenset(skip)
+            setattr(cls, '_skip_cache', skip)
+        if skip and (self.sinks or self._instance_hooks()):
+            return None
+        if self.triggers is not None:
+            return skip.difference(('PRIVMSG', 'NOTICE'))
+        if self.router is not None and 'PRIVMSG' in skip:
+            return skip.difference(('PRIVMSG',))
+        return skip
+
+    def _instance_hooks(self):
+        """ Checks whether handlers were assigned on the instance. """
+        for hooks in self._command_hooks.values():
+            for hook in hooks:
+                if hook in self.__dict__:
+                    return True
+        return False
+
+    def _event_hook(self, event_t, event_c):
+        """
+        Maps an event onto the name of its handler and its arguments.
+        Returns a tuple of the handler name and the arguments,
+            the handler name is None for events without a handler.
+        Required arguments:
+        * event_t - Event type.
+        * event_c - Event content.
+        """
+        if event_t == 'JOIN':
+            return 'on_join', (event_c[0], event_c[1])
+        elif event_t == 'PART':
+            return 'on_part', (event_c[0], event_c[1], event_c[2])
+        elif event_t == 'PRIVMSG':
+            if event_c[1] in self.channels:
+                return 'on_chanmsg', (event_c[0], event_c[1], event_c[2])
+            return 'on_privmsg', (event_c[0], event_c[2])
+        elif event_t == 'NOTICE':
+            if event_c[1] in self.channels:
+                return 'on_channotice', (event_c[0], event_c[1], event_c[2])
+            return 'on_privnotice', (event_c[0], event_c[2])
+        elif event_t == 'CTCP':
+            if event_c[1] in self.channels:
+                return 'on_chanctcp', (event_c[0], event_c[1], event_c[2])
+            return 'on_privctcp', (event_c[0], event_c[2])
+        elif event_t == 'CTCP_REPLY':
+            return 'on_ctcp_reply', (event_c[0], event_c[2])
+        elif event_t == 'MODE':
+            if event_c[0][0] == self.current_nick:
+                return 'on_umode', (event_c[1],)
+            return 'on_cmode', (event_c[0], event_c[1], event_c[2])
+        elif event_t == 'KICK':
+            return 'on_kick', (event_c[0], event_c[1], event_c[2], \
+                               event_c[3])
+        elif event_t == 'INVITE':
+            return 'on_invite', (event_c[0], event_c[2])
+        elif event_t == 'NICK':
+            return 'on_nick', (event_c[0], event_c[1])
+        elif event_t == 'TOPIC':
+            return 'on_topic', (event_c[0], event_c[1], event_c[2])
+        elif event_t == 'QUIT':
+            return 'on_quit', (event_c[0], event_c[1])
+        elif event_t == 'LUSERS':
+            return 'on_lusers', (event_c,)
+        elif event_t == 'BATCH':
+            return 'on_batch', (event_c[0], event_c[2])
+        elif event_t == 'ERROR':
+            return 'on_error', (event_c[0],)
+        elif event_t == 'UNKNOWN':
+            return 'on_unknown', (event_c[0],)
+        return None, ()
+
+    def _event_key(self, hook, args):
+        """
+        Returns the key that orders handler calls in executor mode:
+            the channel for channel events, the sender's nick -
+            for private events and None for everything else.
+        Required arguments:
+        * hook - Handler name.
+        * args - Handler arguments.
+        """
+        if hook in self._channel_hooks:
+            return args[1].lower()
+        elif hook in self._private_hooks:
+            return args[0][0].lower()
+        return None
+
+    def _call_handler(self, hook, args, event):
+        """
+        Calls an event handler from an executor worker thread.
+        Required arguments:
+        * hook - Name of the handler.
+        * args - Arguments to call the handler with.
+        * event - The event that triggered the handler.
+        """
+        try:
+            self._dispatch(hook, args, event)
+        except self.LurklibError as exception:
+            self.on_exception(exception)
+
+    def _dispatch(self, hook, args, event):
+        """
+        Calls an event handler, timing it if handler timing or -
+            metrics are enabled.
+        Required arguments:
+        * hook - Name of the handler, e.g. 'on_chanmsg'.
+        * args - Arguments to call the handler with.
+        * event - The event that triggered the handler.
+        """
+        handler = getattr(self, hook)
+        if self.triggers is not None and hook in self._message_hooks:
+            if len(args) == 3:
+                self.triggers.dispatch(self, args[0], args[1], args[2])
+            else:
+                self.triggers.dispatch(self, args[0], args[0][0], args[1])
+        if self.router is not None and hook in ('on_chanmsg', 'on_privmsg'):
+            if hook == 'on_chanmsg':
+                command = self.router.lookup(self, args[0], args[1], args[2])
+            else:
+                command = self.router.lookup(self, args[0], None, args[1])
+            if command is not None:
+                handler, args = command, ()
+        if self.process_pool is not None and \
+           getattr(handler, 'cpu_bound', False):
+            return self._offload(handler, args)
+        if self.handler_stats is None and self.metrics is None:
+            return handler(*args)
+        start = self._m_time.time()
+        try:
+            return handler(*args)
+        finally:
+            elapsed = self._m_time.time() - start
+            if self.handler_stats is not None:
+                self.handler_stats.record(hook, elapsed, event)
+            if self.metrics is not None:
+                self.metrics.observe('handler_seconds', elapsed, hook)
 
+    def _offload(self, handler, args):
+        """
+        Runs a CPU-bound handler in the process pool and -
+            applies its recorded actions once it's done.
+        Required arguments:
+        * handler - Bound handler method.
+        * args - Handler arguments.
+        """
+        function = getattr(handler, '__func__', handler)
+        state = {'current_nick': self.current_nick, 'server': self.server, \
+                 'encoding': self.encoding}
+        future = self.process_pool.submit(executor.run_recorded, function, \
+                                          state, args)
+        future.add_done_callback(self._apply_actions)
+        return future
+
+    def _apply_actions(self, future):
+        """
+        Applies the actions recorded by an offloaded handler.
+        Required arguments:
+        * future - Future of the offloaded handler call.
+        """
+        try:
+            for name, args, kwargs in future.result():
+                getattr(self, name)(*args, **kwargs)
         except self.LurklibError as exception:
             self.on_exception(exception)
 
+    def use_process_pool(self, max_workers=None):
+        """
+        Runs handlers marked with the lurklib.cpu_bound decorator -
+            in a pool of worker processes.
+        Returns the ProcessPoolExecutor.
+        Optional arguments:
+        * max_workers=None - Amount of worker processes,
+            defaults to the amount of CPUs.
+        """
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+        self.process_pool = executor.ProcessPoolExecutor(max_workers)
+        return self.process_pool
+
+    def use_router(self, router=None):
+        """
+        Routes bot commands in channel and private messages -
+            to the commands registered on a CommandRouter; -
+            other messages still go to on_chanmsg/on_privmsg.
+        Returns the CommandRouter.
+        Optional arguments:
+        * router=None - CommandRouter to use, defaults to a new one -
+            with the '!' prefix.
+        """
+        if router is None:
+            router = CommandRouter()
+        self.router = router
+        return router
+
+    def use_triggers(self, triggers=None):
+        """
+        Matches every channel/private message and notice against -
+            a set of keyword and regex triggers, calling the handlers -
+            of the ones that match before the usual handler.
+        Returns the Triggers object.
+        Optional arguments:
+        * triggers=None - Triggers to use, defaults to a new, empty set.
+        """
+        if triggers is None:
+            triggers = Triggers()
+        self.triggers = triggers
+        return triggers
+
+    def add_sink(self, sink):
+        """
+        Adds an event sink, e.g. a logsink.ChannelLogger.
+        Sinks get every event before its handler runs, in the order -
+            they arrive, through their event(client, hook, args) method; -
+            hook is the handler name and args its arguments.
+        Returns the sink.
+        Required arguments:
+        * sink - Sink to add.
+        """
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        """
+        Removes an event sink.
+        Required arguments:
+        * sink - Sink to remove.
+        """
+        self.sinks.remove(sink)
+
+    def record_traffic(self, path=None):
+        """
+        Starts/stops recording every raw line sent and received, -
+            with timestamps, to a file; see recorder.Replayer -
+            for replaying it.
+        Returns the Recorder, or None if recording was stopped.
+        Optional arguments:
+        * path=None - File to append the recording to; -
+            if None, the current recording is stopped.
+        """
+        recorder = self.recorder
+        self.recorder = None
+        if recorder is not None:
+            recorder.close()
+        if path is not None:
+            self.recorder = Recorder(path)
+        return self.recorder
+
+    def time_handlers(self, threshold=0.5, enable=True):
+        """
+        Enables/disables timing of every event handler call.
+        Handlers that take longer than the threshold are logged -
+            to the 'lurklib' logger together with their event.
+        Returns the HandlerStats object, see its report method -
+            for the slowest handlers.
+        Optional arguments:
+        * threshold=0.5 - Slow handler threshold, in seconds.
+        * enable=True - If False, timing is turned off again.
+        """
+        if not enable:
+            self.handler_stats = None
+        else:
+            self.handler_stats = HandlerStats(threshold)
+        return self.handler_stats
+
+    def use_executor(self, max_workers=4, max_pending=1000, \
+                     overflow='block'):
+        """
+        Runs the event handlers on a thread pool instead of -
+            the thread running mainloop.
+        The IRC state is still updated by the reading thread.
+        Handler calls for the same channel (or the same sender, -
+            for private events) keep their order, other channels -
+            are handled in parallel.
+        Returns the KeyedExecutor.
+        Optional arguments:
+        * max_workers=4 - Amount of worker threads.
+        * max_pending=1000 - Maximum amount of queued handler calls -
+            per channel/sender.
+        * overflow='block' - What to do when a queue is full;
+            'block', 'drop', 'drop_oldest' or 'raise'.
+            NOTE: 'block' stalls the reading thread, so handlers -
+            shouldn't wait for replies from the server while it's used.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.executor = KeyedExecutor(max_workers, max_pending, overflow)
+        return self.executor
+
     def mainloop(self):
         """
         Handles events and calls their handler for infinity.
+        Waits in a single select() on the connection until the server -
+            sends something, a queued message or timer is due or -
+            wakeup() is called; the lock isn't held while waiting.
         """
         while self.keep_going:
-            with self.lock:
-                if self.on_connect and not self.readable(2):
+            timeout = self._next_timeout()
+            if self.on_connect and not self._wait(0):
+                with self.lock:
                     self.on_connect()
                     self.on_connect = None
-                if not self.keep_going:
-                    break
-                self.process_once()
+                continue
+            if not self.keep_going:
+                break
+            if self._wait(timeout):
+                with self.lock:
+                    if self.keep_going and self.connected:
+                        self.process_once(0)
 
     def on_connect(self):
         pass
@@ -150,11 +453,17 @@ class Client(core._Core):
     def on_lusers(self, data):
         pass
 
+    def on_batch(self, batch_type, events):
+        pass
+
     def on_error(self, message):
         pass
 
     def on_unknown(self, message):
         pass
 
+    def on_raw(self, message):
+        pass
+
     def on_exception(self, exception):
         pass
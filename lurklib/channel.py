@@ -17,10 +17,14 @@
 """ Channel-related interaction file. """
 
 from __future__ import with_statement
+from .metrics import timed_query
 
 
 class _Channel(object):
     """ Channel-related interaction class. """
+    _list_replies = {'b': ('367', '368'), 'e': ('348', '349'), \
+                     'I': ('346', '347')}
+
     def is_in_channel(self, channel, should_be=True):
         """
         Find out if you are in a channel.
@@ -39,6 +43,7 @@ class _Channel(object):
             if should_be:
                 raise self.NotInChannel('LurklibError: NotInChannel')
 
+    @timed_query
     def join_(self, channel, key=None, process_only=False):
         """
         Joins a channel.
@@ -91,33 +96,225 @@ class _Channel(object):
                         self.stepback(append=True)
                 elif msg[0] == '366':
                     break
-            self.channels[channel] = {}
-            self.channels[channel]['USERS'] = {}
-            for user in users:
-                prefix = ''
-                if user[0] in self.priv_types:
-                    prefix = user[0]
-                    user = user[1:]
-                if prefix == '~':
-                    self.channels[channel]['USERS'][user] = \
-                    ['~', '', '', '', '']
-                elif prefix == '&':
-                    self.channels[channel]['USERS'][user] = \
-                    ['', '&', '', '', '']
-                elif prefix == '@':
-                    self.channels[channel]['USERS'][user] = \
-                    ['', '', '@', '', '']
-                elif prefix == '%':
-                    self.channels[channel]['USERS'][user] = \
-                    ['', '', '', '%', '']
-                elif prefix == '+':
-                    self.channels[channel]['USERS'][user] = \
-                    ['', '', '', '', '+']
-                else:
-                    self.channels[channel]['USERS'][user] = \
-                    ['', '', '', '', '']
+            self._set_channel_users(channel, users)
+        return users, topic, set_by, time_set
+
+    def join_many(self, channels, keys=None, callback=None, timeout=30):
+        """
+        Joins many channels at once.
+        Channels are packed into as few JOIN lines as possible, -
+            keyed channels first, and queued with enqueue.
+        Channels you're already in are skipped and channels over -
+            the server's CHANLIMIT aren't requested.
+        Returns a dictionary mapping each channel to the same tuple -
+            join_ returns, or to the (not raised) LurklibError -
+            that joining it failed with.
+        Channels the server didn't answer for within the timeout -
+            are left out.
+        Required arguments:
+        * channels - Channels to join.
+        Optional arguments:
+        * keys=None - Dictionary of channel keys, or a list of keys -
+            in the same order as channels.
+        * callback=None - Called with the channel, its information -
+            tuple (or None) and the error (or None) as soon as -
+            joining that channel completed.
+        * timeout=30 - Maximum time to wait for the server's replies.
+        """
+        if keys is None:
+            keys = {}
+        elif not isinstance(keys, dict):
+            keys = dict(zip(channels, keys))
+        results = {}
+
+        def report(channel, info, error):
+            results[channel] = info or error
+            if callback is not None:
+                callback(channel, info, error)
+
+        with self.lock:
+            joined = set(channel.lower() for channel in self.channels)
+            wanted = []
+            for channel in channels:
+                if channel.lower() not in joined:
+                    joined.add(channel.lower())
+                    wanted.append(channel)
+            wanted, refused = self._chanlimit_split(wanted)
+            for channel in refused:
+                report(channel, None, self.TooManyChannels( \
+                    'TooManyChannels: %s :CHANLIMIT reached' % channel))
+            wanted.sort(key=lambda channel: not keys.get(channel))
+            for line in self._join_lines(wanted, keys):
+                self.enqueue(line)
+
+            pending = {}
+            for channel in wanted:
+                pending[channel.lower()] = [channel, [], '', '', '']
+            deferred = []
+            deadline = self._m_time.time() + timeout
+            try:
+                while pending:
+                    wait = deadline - self._m_time.time()
+                    if wait <= 0:
+                        break
+                    delay = self._flush_outbox()
+                    if delay is not None:
+                        wait = min(wait, delay)
+                    if not self.readable(wait):
+                        continue
+                    data = self._raw_recv()
+                    tags = self._msg_tags
+                    segments = data.split(None, 3)
+                    command = segments[1]
+                    if command == 'JOIN':
+                        state = pending.get(segments[2].lstrip(':').lower())
+                        if state is not None and self.compare( \
+                           self._from_(segments[0][1:])[0], self.current_nick):
+                            self._track_userhost(segments)
+                            if self.hide_called_events:
+                                continue
+                    elif len(segments) > 3 and command in ('332', '333', \
+                                                         '353', '366'):
+                        params = segments[3].split(None, 2)
+                        if command == '353':
+                            state = pending.get(params[1].lower())
+                        else:
+                            state = pending.get(params[0].lower())
+                        if state is not None:
+                            if command == '332':
+                                state[2] = segments[3].split(None, 1)[1] \
+                                                      .replace(':', '', 1)
+                            elif command == '333':
+                                state[3], state[4] = params[1:3]
+                            elif command == '353':
+                                state[1].extend(params[2][1:].split())
+                            else:
+                                del pending[params[0].lower()]
+                                report(state[0], \
+                                       self._joined(*state), None)
+                            continue
+                    elif command in self.error_dictionary and \
+                         len(segments) > 3:
+                        target = segments[3].split(None, 1)[0].lower()
+                        state = pending.pop(target, None)
+                        if state is not None:
+                            error = self.error_dictionary[command]
+                            report(state[0], None, getattr(self, error)( \
+                                   '%s: %s' % (error, segments[3])))
+                            continue
+                    deferred.append((data, tags))
+            finally:
+                self._requeue(deferred)
+        return results
+
+    def _chanlimit_split(self, channels):
+        """
+        Splits channels into the ones CHANLIMIT leaves room for -
+            and the ones over it.
+        Required arguments:
+        * channels - Channels to check.
+        """
+        chanlimit = self.version.get('CHANLIMIT')
+        if not chanlimit or chanlimit is True:
+            return list(channels), []
+        room = {}
+        for entry in chanlimit.split(','):
+            prefixes, sep, limit = entry.partition(':')
+            if not limit:
+                continue
+            left = [int(limit) - len([channel for channel in self.channels \
+                                      if channel[:1] in prefixes])]
+            for prefix in prefixes:
+                room[prefix] = left
+        allowed = []
+        refused = []
+        for channel in channels:
+            left = room.get(channel[:1])
+            if left is None:
+                allowed.append(channel)
+            elif left[0] > 0:
+                left[0] -= 1
+                allowed.append(channel)
+            else:
+                refused.append(channel)
+        return allowed, refused
+
+    def _join_lines(self, channels, keys):
+        """
+        Packs channels into JOIN lines of at most 512 encoded bytes -
+            and TARGMAX channels; a TARGMAX without a JOIN entry -
+            sets no limit.
+        Keyed channels have to come first.
+        Required arguments:
+        * channels - Channels to join.
+        * keys - Dictionary of channel keys.
+        """
+        limit = None
+        if 'TARGMAX' in self.version:
+            limit = self._target_limit('JOIN', None)
+        lines = []
+        names = []
+        secrets = []
+        size = 0
+        for channel in channels:
+            key = keys.get(channel)
+            extra = self._encoded_len(channel) + 1
+            if key:
+                extra += self._encoded_len(key) + 1
+            if names and (size + extra > 512 - len(self._crlf) or \
+                          len(names) == limit):
+                lines.append(('JOIN %s %s' % (','.join(names), \
+                                              ','.join(secrets))).rstrip())
+                names = []
+                secrets = []
+            if not names:
+                size = len('JOIN ')
+            names.append(channel)
+            if key:
+                secrets.append(key)
+            size += extra
+        if names:
+            lines.append(('JOIN %s %s' % (','.join(names), \
+                                          ','.join(secrets))).rstrip())
+        return lines
+
+    def _joined(self, channel, users, topic, set_by, time_set):
+        """
+        Records a completed join and returns its information tuple, -
+            like join_ does.
+        Required arguments:
+        * channel - Channel that was joined.
+        * users - Nicks from /NAMES.
+        * topic - Channel topic.
+        * set_by - Who set the topic.
+        * time_set - UNIX timestamp of when the topic was set.
+        """
+        if set_by:
+            set_by = self._from_(set_by)
+        if time_set:
+            if not self.UTC:
+                time_set = self._m_time.localtime(int(time_set))
+            else:
+                time_set = self._m_time.gmtime(int(time_set))
+        self._set_channel_users(channel, users)
         return users, topic, set_by, time_set
 
+    def _set_channel_users(self, channel, users):
+        """
+        Sets the users of a channel from /NAMES nicks.
+        Required arguments:
+        * channel - Channel to set the users of.
+        * users - Nicks, with their prefix.
+        """
+        self.channels[channel] = {}
+        self.channels[channel]['USERS'] = {}
+        for user in users:
+            modes = ['', '', '', '', '']
+            if user[0] in self.priv_types:
+                modes[self.priv_types.index(user[0])] = user[0]
+                user = user[1:]
+            self.channels[channel]['USERS'][user] = modes
+
     def part(self, channel, reason=''):
         """
         Part a channel.
@@ -169,80 +366,238 @@ class _Channel(object):
                                          ignore_unexpected_replies=True)
                     if msg[0]:
                         mode = msg[2]
-                        self.parse_cmode_string(mode, msg[1])
+                        self.parse_cmode_string(mode, msg[1], \
+                                                self.current_nick)
                         if not self.hide_called_events:
                             self.stepback()
 
-    def banlist(self, channel):
+    def mode_batch(self, channel, changes):
+        """
+        Applies many channel mode changes, e.g. a mass voice, -
+            in as few MODE lines as possible.
+        Duplicate changes are dropped and opposing ones cancel out.
+        Lines carry at most MODES parameters (any amount if MODES -
+            has no value) and fit in 512 encoded bytes; -
+            they are queued with enqueue, without waiting for the echoes; -
+            the cached ban/except/invite lists are updated -
+            as the echoes are received.
+        Returns the amount of lines queued.
+        Required arguments:
+        * channel - Channel to change the modes of.
+        * changes - (sign, mode, argument) tuples, e.g. ('+', 'v', 'nick');
+            the argument is None for modes without one.
+        Raises ValueError, before anything is queued, -
+            if a change lacks an argument its mode needs.
+        """
+        types = self._chanmode_types()
+        merged = []
+        positions = {}
+        for sign, mode, arg in changes:
+            if arg is None and (types.get(mode) in ('A', 'P', 'B') or \
+                                types.get(mode) == 'C' and sign == '+'):
+                raise ValueError('Mode %s%s needs an argument' % (sign, mode))
+            if types.get(mode) in ('A', 'P'):
+                key = mode, (arg or '').lower()
+            else:
+                key = mode
+            position = positions.pop(key, None)
+            if position is not None:
+                previous = merged[position]
+                merged[position] = None
+                if previous[0] != sign:
+                    continue
+            positions[key] = len(merged)
+            merged.append((sign, mode, arg))
+
+        limit = self.version.get('MODES', 3)
+        if limit is True or limit == '':
+            limit = None
+        elif limit is not None:
+            limit = int(limit)
+        budget = self._message_budget('MODE %s ' % channel)
+        lines = []
+        modes = args = None
+        for change in merged:
+            if change is None:
+                continue
+            sign, mode, arg = change
+            extra = len(mode)
+            if arg is not None:
+                extra += self._encoded_len(arg) + 1
+            if modes and (size + extra + (sign != last) > budget or \
+                          arg is not None and len(args) == limit):
+                lines.append(' '.join(['MODE', channel, ''.join(modes)] + \
+                                      args))
+                modes = None
+            if not modes:
+                modes = []
+                args = []
+                size = 0
+                last = None
+            if sign != last:
+                modes.append(sign)
+                size += 1
+                last = sign
+            modes.append(mode)
+            if arg is not None:
+                args.append(arg)
+            size += extra
+        if modes:
+            lines.append(' '.join(['MODE', channel, ''.join(modes)] + args))
+        for line in lines:
+            self.enqueue(line)
+        return len(lines)
+
+    def _chanmode_types(self):
+        """
+        Returns a dictionary mapping channel modes to their type, -
+            following ISUPPORT CHANMODES and PREFIX:
+        * A - List mode, always has an argument (e.g. b).
+        * B - Setting, always has an argument (e.g. k).
+        * C - Setting, has an argument only when set (e.g. l).
+        * D - Flag, never has an argument (e.g. m).
+        * P - Nick prefix mode, always has an argument (e.g. o).
+        """
+        chanmodes = self.version.get('CHANMODES')
+        prefix = self.version.get('PREFIX')
+        if self._mode_types[0] == (chanmodes, prefix):
+            return self._mode_types[1]
+        key = chanmodes, prefix
+        if not chanmodes or chanmodes is True:
+            chanmodes = 'beI,k,l,imnpst'
+        if not prefix or prefix is True:
+            prefix = '(ov)@+'
+        types = {}
+        for type_, modes in zip('ABCD', chanmodes.split(',')):
+            for mode in modes:
+                types[mode] = type_
+        modes, symbols = prefix[1:].split(')', 1)
+        for mode in modes:
+            types[mode] = 'P'
+        self._mode_types = key, types, dict(zip(modes, symbols))
+        return types
+
+    def _prefix_symbols(self):
+        """
+        Returns a dictionary mapping the PREFIX modes -
+            to their nick prefix, e.g. 'o' to '@'.
+        """
+        self._chanmode_types()
+        return self._mode_types[2]
+
+    def _channel_key(self, channel):
+        """
+        Returns the name a channel has in self.channels, -
+            compared case-insensitively, or None if you aren't in it.
+        Required arguments:
+        * channel - Channel name.
+        """
+        if channel in self.channels:
+            return channel
+        for name in self.channels:
+            if self.compare(name, channel):
+                return name
+        return None
+
+    @timed_query
+    def banlist(self, channel, refresh=False):
         """
         Get the channel banlist.
+        The list is queried once and then kept current from MODE events.
         Required arguments:
         * channel - Channel of which to get the banlist for.
+        Optional arguments:
+        * refresh=False - Query the server again.
         """
-        with self.lock:
-            self.is_in_channel(channel)
-
-            self.send('MODE %s b' % channel)
-            bans = []
-
-            while self.readable():
-                msg = self._recv(expected_replies=('367', '368'))
-                if msg[0] == '367':
-                    banmask, who, timestamp = msg[2].split()[1:]
-                    bans.append((self._from_(banmask), who, \
-                                 self._m_time.localtime(int(timestamp))))
-                elif msg[0] == '368':
-                    break
-            return bans
+        return self._mode_list(channel, 'b', refresh)
 
-    def exceptlist(self, channel):
+    @timed_query
+    def exceptlist(self, channel, refresh=False):
         """
         Get the channel exceptlist.
+        The list is queried once and then kept current from MODE events.
         Required arguments:
         * channel - Channel of which to get the exceptlist for.
+        Optional arguments:
+        * refresh=False - Query the server again.
         """
-        with self.lock:
-            self.is_in_channel(channel)
+        return self._mode_list(channel, 'e', refresh)
 
-            self.send('MODE %s e' % channel)
-            excepts = []
-
-            while self.readable():
-                msg = self._recv(expected_replies=('348', '349'))
-
-                if msg[0] == '348':
-                    exceptmask, who, timestamp = msg[2].split()[1:]
-                    excepts.append((self._from_(exceptmask), who, \
-                                    self._m_time.localtime(int(timestamp))))
-                elif msg[0] == '349':
-                    break
-
-            return excepts
-
-    def invitelist(self, channel):
+    @timed_query
+    def invitelist(self, channel, refresh=False):
         """
         Get the channel invitelist.
+        The list is queried once and then kept current from MODE events.
         Required arguments:
         * channel - Channel of which to get the invitelist for.
+        Optional arguments:
+        * refresh=False - Query the server again.
+        """
+        return self._mode_list(channel, 'I', refresh)
+
+    def is_listed(self, channel, mask, mode='b'):
+        """
+        Checks whether a mask is on a channel's ban/except/invite list.
+        The list is queried the first time, later checks use the cache.
+        Required arguments:
+        * channel - Channel to check.
+        * mask - Mask to look for, e.g. '*!*@host'.
+        Optional arguments:
+        * mode='b' - 'b' for bans, 'e' for excepts, 'I' for invites.
         """
+        with self.lock:
+            lists = self.channels.get(self._channel_key(channel), {}) \
+                                 .get('LISTS', {})
+            if mode not in lists:
+                self._mode_list(channel, mode)
+                lists = self.channels[self._channel_key(channel)]['LISTS']
+            return mask.lower() in lists[mode]
+
+    def _mode_list(self, channel, mode, refresh=False):
+        """
+        Returns a cached list mode's entries, -
+            querying the server if they aren't cached yet.
+        Each entry is a tuple of the mask (split by _from_), -
+            who set it and a time object of when it was set.
+        Required arguments:
+        * channel - Channel of the list.
+        * mode - 'b', 'e' or 'I'.
+        Optional arguments:
+        * refresh=False - Query the server even if the list is cached.
+        """
+        item_reply, end_reply = self._list_replies[mode]
         with self.lock:
             self.is_in_channel(channel)
+            lists = self.channels[self._channel_key(channel)] \
+                                 .setdefault('LISTS', {})
+            if mode in lists and not refresh:
+                return list(lists[mode].values())
 
-            self.send('MODE %s i' % channel)
-            invites = []
+            self.send('MODE %s %s' % (channel, mode))
+            entries = {}
 
             while self.readable():
-                msg = self._recv(expected_replies=('346', '347'))
-
-                if msg[0] == '346':
-                    invitemask, who, timestamp = msg[2].split()[1:]
-                    invites.append((self._from_(invitemask), who, \
-                                    self._m_time.localtime(int(timestamp))))
-                elif msg[0] == '347':
+                msg = self._recv(expected_replies=(item_reply, end_reply))
+                if msg[0] == item_reply:
+                    info = msg[2].split()[1:4]
+                    who = ''
+                    set_time = None
+                    if len(info) > 1:
+                        who = info[1]
+                    if len(info) > 2:
+                        if not self.UTC:
+                            set_time = self._m_time.localtime(int(info[2]))
+                        else:
+                            set_time = self._m_time.gmtime(int(info[2]))
+                    entries[info[0].lower()] = (self._from_(info[0]), who, \
+                                                set_time)
+                elif msg[0] == end_reply:
                     break
 
-            return invites
+            lists[mode] = entries
+            return list(entries.values())
 
+    @timed_query
     def topic(self, channel, topic=None):
         """
         Sets/gets the channel topic.
@@ -286,6 +641,7 @@ class _Channel(object):
 
                 return topic, set_by, time_set
 
+    @timed_query
     def names(self, channel):
         """
         Get a list of users in the channel.
@@ -334,6 +690,7 @@ class _Channel(object):
                     ['', '', '', '', '']
             return names
 
+    @timed_query
     def list_(self):
         """ Gets a list of channels on the server. """
         with self.lock:
@@ -356,6 +713,7 @@ class _Channel(object):
 
             return list_
 
+    @timed_query
     def invite(self, channel, nick):
         """
         Invite someone to a channel.
@@ -402,44 +760,60 @@ class _Channel(object):
             if self.compare(self.current_nick, nick):
                 del self.channels[channel]
 
-    def parse_cmode_string(self, mode_string, channel):
+    def parse_cmode_string(self, mode_string, channel, setter=''):
         """
-        Parse a channel mode string and update the IRC.channels dictionary.
+        Parse a channel mode string and update the IRC.channels dictionary -
+            (user prefixes and cached ban/except/invite lists).
         Required arguments:
-        * mode_string - Mode string to parse.
+        * mode_string - Mode string to parse, e.g. '+ov-b nick nick mask'.
         * channel - Channel of which the modes were set.
+        Optional arguments:
+        * setter='' - Who set the modes.
         """
         with self.lock:
-            modes = mode_string.split()
-            targets = modes[1:]
-            modes = modes[0][1:].split()
-
-            if mode_string[0] == '+':
-                plus_mode = True
+            channel = self._channel_key(channel)
+            if channel is None:
+                return
+            types = self._chanmode_types()
+            symbols = self._prefix_symbols()
+            users = self.channels[channel].get('USERS', {})
+            lists = self.channels[channel].get('LISTS', {})
+            if mode_string[:1] == ':':
+                mode_string = mode_string[1:]
+            mode_string, trailing, last = mode_string.partition(' :')
+            params = mode_string.split()
+            if trailing:
+                params.append(last)
+            args = iter(params[1:])
+            if not self.UTC:
+                now = self._m_time.localtime()
             else:
-                plus_mode = False
-            for mode in modes:
-                if mode in self.priv_types:
-                    target = targets[modes.index(mode)]
+                now = self._m_time.gmtime()
+            plus_mode = True
+            for mode in params[0]:
+                if mode == '+':
+                    plus_mode = True
+                    continue
+                elif mode == '-':
+                    plus_mode = False
+                    continue
+                type_ = types.get(mode, 'D')
+                if type_ == 'D' or type_ == 'C' and not plus_mode:
+                    continue
+                arg = next(args, None)
+                if arg is None:
+                    continue
+                if type_ == 'P':
+                    symbol = symbols[mode]
+                    if arg in users and symbol in self.priv_types:
+                        index = self.priv_types.index(symbol)
+                        if plus_mode:
+                            users[arg][index] = symbol
+                        else:
+                            users[arg][index] = ''
+                elif type_ == 'A' and mode in lists:
                     if plus_mode:
-                        if mode == 'q':
-                            self.channels[channel]['USERS'][target][0] = '~'
-                        elif mode == 'a':
-                            self.channels[channel]['USERS'][target][1] = '&'
-                        elif mode == 'o':
-                            self.channels[channel]['USERS'][target][2] = '@'
-                        elif mode == 'h':
-                            self.channels[channel]['USERS'][target][3] = '%'
-                        elif mode == 'v':
-                            self.channels[channel]['USERS'][target][4] = '+'
+                        lists[mode][arg.lower()] = (self._from_(arg), \
+                                                    setter, now)
                     else:
-                        if mode == 'q':
-                            self.channels[channel]['USERS'][target][0] = ''
-                        elif mode == 'a':
-                            self.channels[channel]['USERS'][target][1] = ''
-                        elif mode == 'o':
-                            self.channels[channel]['USERS'][target][2] = ''
-                        elif mode == 'h':
-                            self.channels[channel]['USERS'][target][3] = ''
-                        elif mode == 'v':
-                            self.channels[channel]['USERS'][target][4] = ''
+                        lists[mode].pop(arg.lower(), None)
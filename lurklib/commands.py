@@ -0,0 +1,229 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Bot command routing. """
+
+# Channel privileges in the order of Client.channels[...]['USERS'] lists,
+# mapped to permission levels.
+_PRIVILEGE_LEVELS = (5, 4, 3, 2, 1)
+
+
+class Command(object):
+    """ A registered bot command. """
+    __slots__ = ('name', 'handler', 'usage', 'level', 'required', \
+                 'optional', 'greedy')
+
+    def __init__(self, name, handler, usage='', level=0):
+        """
+        Required arguments:
+        * name - Command name, e.g. 'ban' or 'admin ban'.
+        * handler - Function to call.
+        Optional arguments:
+        * usage='' - Arguments spec, e.g. '<nick> [reason...]':
+            <arg> is required, [arg] optional and a trailing ... -
+            makes the last argument take the rest of the line.
+        * level=0 - Permission level needed to use the command.
+        """
+        self.name = name
+        self.handler = handler
+        self.usage = usage
+        self.level = level
+        self.required = 0
+        self.optional = 0
+        self.greedy = usage.rstrip(']>').endswith('...')
+        for arg in usage.split():
+            if arg[:1] == '<':
+                self.required += 1
+            else:
+                self.optional += 1
+
+    def parse(self, text):
+        """
+        Splits the text after the command into its arguments.
+        Returns None if the amount of arguments doesn't fit the spec.
+        Required arguments:
+        * text - Argument text.
+        """
+        most = self.required + self.optional
+        if self.greedy:
+            args = text.split(None, most - 1)
+        else:
+            args = text.split()
+        if len(args) < self.required or len(args) > most:
+            return None
+        return args
+
+
+class CommandRouter(object):
+    """
+    Routes bot commands, e.g. '!kick nick reason' or 'Bot: kick nick', -
+        from channel and private messages to their handlers.
+    Messages that can't be commands are rejected by looking -
+        at their first character only; commands are then found -
+        with one dictionary lookup per word of the command name.
+    """
+    def __init__(self, prefixes=('!',), highlight=True):
+        """
+        Optional arguments:
+        * prefixes=('!',) - Command prefixes.
+        * highlight=True - Also accept commands addressed to the bot, -
+            e.g. 'Bot: help' or 'Bot, help'.
+        """
+        self.prefixes = tuple(prefixes)
+        self.highlight = highlight
+        self._first = frozenset(prefix[:1] for prefix in self.prefixes)
+        self._trie = {}
+
+    def add(self, name, handler, usage='', level=0):
+        """
+        Registers a command.
+        The handler is called with the client, the sender -
+            (a nick, user, host tuple), where to reply to (the channel -
+            or, for private messages, the sender's nick) -
+            and the command's arguments.
+        Required arguments:
+        * name - Command name; words separated by spaces make -
+            subcommands, e.g. 'admin ban'.
+        * handler - Function to call.
+        Optional arguments:
+        * usage='' - Arguments spec, see Command.
+        * level=0 - Permission level needed, see level_of.
+        """
+        words = name.lower().split()
+        children = self._trie
+        for word in words[:-1]:
+            children = children.setdefault(word, [None, {}])[1]
+        children.setdefault(words[-1], [None, {}])[0] = \
+                                    Command(name, handler, usage, level)
+
+    def command(self, name, usage='', level=0):
+        """
+        Decorator version of add.
+        Required arguments:
+        * name - Command name.
+        Optional arguments:
+        * usage='' - Arguments spec.
+        * level=0 - Permission level needed.
+        """
+        def register(handler):
+            self.add(name, handler, usage, level)
+            return handler
+        return register
+
+    def remove(self, name):
+        """
+        Unregisters a command; its subcommands stay registered.
+        Required arguments:
+        * name - Command name.
+        """
+        node = [None, self._trie]
+        for word in name.lower().split():
+            node = node[1].get(word)
+            if node is None:
+                return
+        node[0] = None
+
+    def _strip(self, client, message):
+        """
+        Returns the message without its command prefix -
+            or None if it isn't a command.
+        Required arguments:
+        * client - Client the message was received by.
+        * message - Message text.
+        """
+        first = message[:1]
+        if first in self._first:
+            for prefix in self.prefixes:
+                if message.startswith(prefix):
+                    return message[len(prefix):]
+        if self.highlight:
+            nick = client.current_nick
+            if first.lower() == nick[:1].lower() and \
+               message[len(nick):len(nick) + 1] in (':', ',') and \
+               client.compare(message[:len(nick)], nick):
+                return message[len(nick) + 1:]
+        return None
+
+    def lookup(self, client, from_, channel, message):
+        """
+        Finds the command a message invokes.
+        Returns a function that runs it, or None -
+            if the message isn't a command.
+        Required arguments:
+        * client - Client the message was received by.
+        * from_ - Sender, as a (nick, user, host) tuple.
+        * channel - Channel, or None for private messages.
+        * message - Message text.
+        """
+        text = self._strip(client, message)
+        if text is None:
+            return None
+        children = self._trie
+        found = None
+        while True:
+            words = text.split(None, 1)
+            if not words or words[0].lower() not in children:
+                break
+            node = children[words[0].lower()]
+            children = node[1]
+            text = ''
+            if len(words) > 1:
+                text = words[1]
+            if node[0] is not None:
+                found = node[0], text
+        if found is None:
+            return None
+        command, rest = found
+        target = channel or from_[0]
+
+        def run():
+            if self.level_of(client, from_, channel) < command.level:
+                return self.on_denied(client, from_, target, command)
+            args = command.parse(rest)
+            if args is None:
+                return self.on_usage(client, from_, target, command)
+            return command.handler(client, from_, target, *args)
+        return run
+
+    def level_of(self, client, from_, channel):
+        """
+        Returns a user's permission level: -
+            5 for ~, 4 for &, 3 for @, 2 for % and 1 for + -
+            in the channel, 0 otherwise.
+        Override it to use e.g. account based levels.
+        Required arguments:
+        * client - Client the message was received by.
+        * from_ - Sender, as a (nick, user, host) tuple.
+        * channel - Channel, or None for private messages.
+        """
+        if channel is None:
+            return 0
+        privileges = client.channels.get(channel, {}).get('USERS', {}) \
+                                    .get(from_[0])
+        if privileges:
+            for level, privilege in zip(_PRIVILEGE_LEVELS, privileges):
+                if privilege:
+                    return level
+        return 0
+
+    def on_usage(self, client, from_, target, command):
+        """ Called when a command got the wrong amount of arguments. """
+        client.notice(from_[0], 'Usage: %s%s %s' % \
+                      (self.prefixes[0], command.name, command.usage))
+
+    def on_denied(self, client, from_, target, command):
+        """ Called when the sender's permission level is too low. """
+        pass
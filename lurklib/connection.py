@@ -88,6 +88,9 @@ class _Connection(object):
         with self.lock:
             if password:
                 self._password(password)
+            if self._request_caps:
+                self.cap_req(self._request_caps)
+                self.send('CAP END')
 
             self.nick(nick)
             self._user(user, real_name)
@@ -123,6 +126,10 @@ class _Connection(object):
                 a proxy username/password can be specified.
         """
         with self.lock:
+            self._connection_args = (server, nick, user, real_name, password, \
+                                     port, tls, tls_verify, proxy, \
+                                     proxy_type, proxy_server, proxy_port, \
+                                     proxy_username, proxy_password)
             self.current_nick = nick
             if tls:
                 if not port:
@@ -313,8 +320,7 @@ class _Connection(object):
         Optional arguments:
         * reason='' - Reason for quitting.
         """
-        with self.lock:
-            self.send('QUIT :%s' % reason)
+        self.send('QUIT :%s' % reason)
 
     def quit(self, reason=''):
         """
@@ -325,10 +331,44 @@ class _Connection(object):
         """
         with self.lock:
             self.keep_going = False
+            self.wakeup()
             self._quit(reason)
+            self.connected = False
             self._socket.shutdown(self._m_socket.SHUT_RDWR)
             self._socket.close()
 
+    def reconnect(self):
+        """
+        Drops the current connection, connects and registers again -
+            and rejoins the channels you were in.
+        If connecting fails, the channels are remembered for -
+            the next attempt.
+        """
+        with self.lock:
+            if self.channels:
+                self._rejoin = list(self.channels)
+            try:
+                self._socket.shutdown(self._m_socket.SHUT_RDWR)
+                self._socket.close()
+            except self._m_socket.error:
+                pass
+            self._socket = self._m_socket.socket()
+            self._resetbuffer()
+            self._rbuf = bytearray()
+            self.channels = {}
+            self._own_userhost = None
+            self._batches = {}
+            self._ping_tokens = {}
+            self.missed_pongs = 0
+            self._last_recv = self._m_time.time()
+            self.connected = False
+            self.motd = []
+            self.con_msg = []
+            self._init(*self._connection_args)
+            channels, self._rejoin = self._rejoin, []
+            if channels:
+                self.join_many(channels)
+
     def __enter__(self):
         return self
 
@@ -353,14 +393,3 @@ class _Connection(object):
                 if msg[0] == 'SQUIT':
                     if not self.hide_called_events:
                         self.stepback()
-
-    def latency(self):
-        """ Checks the connection latency. """
-        with self.lock:
-            self.send('PING %s' % self.server)
-            ctime = self._m_time.time()
-
-            msg = self._recv(expected_replies=('PONG',))
-            if msg[0] == 'PONG':
-                latency = self._m_time.time() - ctime
-                return latency
@@ -17,15 +17,25 @@
 """ Lurklib's Core file. """
 
 from __future__ import with_statement
-from . import variables, exceptions, channel
-from . import connection, optional, sending, squeries, uqueries
+from . import variables, exceptions, channel, ircv3
+from . import connection, optional, sending, squeries, uqueries, keepalive
+from . import scheduler, rawmode
+from .metrics import Metrics, TimedLock
+from .recorder import Recorder
 
 
 class _Core(variables._Variables, exceptions._Exceptions,
            connection._Connection, channel._Channel,
            sending._Sending, uqueries._UserQueries,
-           squeries._ServerQueries, optional._Optional):
+           squeries._ServerQueries, optional._Optional, ircv3._IRCv3,
+           keepalive._Keepalive, scheduler._Scheduler, rawmode._RawMode):
     """ Core IRC-interaction class. """
+    _parsed_commands = frozenset(('JOIN', 'PART', 'PRIVMSG', 'NOTICE', \
+                                  'MODE', 'KICK', 'INVITE', 'NICK', 'TOPIC', \
+                                  'QUIT', 'BATCH', '250', '251', '252', \
+                                  '253', '254', '255', '265', '266', \
+                                  '396'))
+
     def __init__(self, server, port=None, nick='Lurklib',
                   user='Lurklib',
                   real_name='The Lurk Internet Relay Chat Library',
@@ -33,7 +43,9 @@ class _Core(variables._Variables, exceptions._Exceptions,
                   hide_called_events=True, UTC=False,
                   proxy=False, proxy_type='SOCKS5',
                   proxy_server=None, proxy_port=None,
-                  proxy_username=None, proxy_password=None):
+                  proxy_username=None, proxy_password=None, caps=(),
+                  keepalive=None, keepalive_misses=3, metrics=False,
+                  decode_fallback='latin-1', record=None):
         """
         Initializes Lurklib and connects to the IRC server.
         Required arguments:
@@ -68,13 +80,39 @@ class _Core(variables._Variables, exceptions._Exceptions,
                 a proxy username/password can be specified.
         * proxy_password=None - If SOCKS5 is used
                 a proxy username/password can be specified.
+        * caps=() - IRCv3 capabilities to request while registering,
+                e.g. ('message-tags', 'server-time').
+        * keepalive=None - PING the server after this many seconds -
+                without incoming traffic; None disables keepalive PINGs.
+        * keepalive_misses=3 - Reconnect after this many PINGs -
+                in a row went unanswered for keepalive seconds.
+        * metrics=False - Collect metrics in self.metrics?
+                A Metrics object can be passed to share one registry.
+        * decode_fallback='latin-1' - Encoding for received lines that -
+                don't decode with the server's encoding.
+                Channels can override it in self.channel_encodings, -
+                keyed by lowercase channel name.
+        * record=None - File to record the raw traffic to, -
+                registration included; see Client.record_traffic.
         """
         variables._Variables.__init__(self)
+        self._request_caps = tuple(caps)
+        self.keepalive = keepalive
+        self.keepalive_misses = keepalive_misses
+        if metrics:
+            if not isinstance(metrics, Metrics):
+                metrics = Metrics()
+            self.metrics = metrics
+            self.lock = TimedLock(self.lock, metrics)
+            self._send_lock = TimedLock(self._send_lock, metrics, 'send')
 
         self.hide_called_events = hide_called_events
         self.UTC = UTC
         self.fallback_encoding = encoding
         self.encoding = encoding
+        self.decode_fallback = decode_fallback
+        if record is not None:
+            self.recorder = Recorder(record)
 
         self._init(server, nick, user, real_name, password, port, tls, \
                    tls_verify, proxy, proxy_type, \
@@ -103,63 +141,149 @@ class _Core(variables._Variables, exceptions._Exceptions,
     def send(self, msg, error_check=False):
         """
         Send a raw string with the CR-LF appended to it.
+        Only the write lock is held while sending, so sending -
+            doesn't wait for threads that are reading from the server.
         Required arguments:
         * msg - Message to send.
         Optional arguments:
         * error_check=False - Check for errors.
         If an error is found the relevant exception will be raised.
         """
-        with self.lock:
-            msg = msg.replace('\r', '\\r').replace('\n', '\\n') + self._crlf
-            try:
-                data = msg.encode(self.encoding)
-            except UnicodeEncodeError:
-                data = msg.encode(self.fallback_encoding)
-            if len(data) > 512:
-                raise self.MessageTooLong("LurklibError: MessageTooLong")
-            self._socket.send(data)
-            if error_check and self.readable():
-                self._recv()
-                self.stepback()
+        self._write(self._encode_line(msg))
+        if error_check:
+            with self.lock:
+                if self.readable():
+                    self._recv()
+                    self.stepback()
+
+    def _encode_line(self, msg):
+        """
+        Encodes a line for sending, escaping CR and LF.
+        Required arguments:
+        * msg - Line, without the CR-LF.
+        """
+        msg = msg.replace('\r', '\\r').replace('\n', '\\n')
+        try:
+            return msg.encode(self.encoding)
+        except UnicodeEncodeError:
+            return msg.encode(self.fallback_encoding)
+
+    def _write(self, data):
+        """
+        Sends an encoded line with the CR-LF appended to it.
+        Required arguments:
+        * data - Encoded line, without the CR-LF.
+        """
+        line = data + self._crlf.encode('ascii')
+        if len(line) > 512:
+            raise self.MessageTooLong("LurklibError: MessageTooLong")
+        with self._send_lock:
+            self._socket.sendall(line)
+            if self.recorder is not None:
+                self.recorder.record(b'O', [data])
+        if self.metrics is not None:
+            command = data.split(b' ', 1)[0].upper().decode('ascii', \
+                                                            'replace')
+            self.metrics.inc('lines_sent_total', command)
+            self.metrics.inc('bytes_sent_total', command, len(line))
+
+    def _read_lines(self):
+        """
+        Reads from the socket into the receive buffer.
+        Returns the complete lines received as bytes, without the CR-LF.
+        """
+        chunk = self._socket.recv(4096)
+        if not chunk:
+            raise self._m_socket.error('Connection closed')
+        self._last_recv = self._m_time.time()
+        if self.metrics is not None:
+            self.metrics.inc('recv_calls_total')
+            self.metrics.inc('bytes_received_total', None, len(chunk))
+        rbuf = self._rbuf
+        rbuf += chunk
+        end = rbuf.rfind(b'\n')
+        if end == -1:
+            return []
+        lines = bytes(rbuf[:end]).replace(b'\r', b'').split(b'\n')
+        del rbuf[:end + 1]
+        if self.recorder is not None:
+            self.recorder.record(b'I', lines)
+        if self.metrics is not None:
+            self.metrics.inc('lines_received_total', None, len(lines))
+        return [line for line in lines if line]
+
+    def _decode(self, line):
+        """
+        Decodes a received line with self.encoding; pure ASCII lines -
+            take the decoder's fast path.
+        Lines that don't decode are decoded with the channel's -
+            entry in channel_encodings, or else with decode_fallback, -
+            and counted in decode_fallbacks.
+        Required arguments:
+        * line - IRC line as bytes.
+        """
+        try:
+            return line.decode(self.encoding)
+        except (UnicodeDecodeError, LookupError):
+            pass
+        encoding = self.decode_fallback
+        if self.channel_encodings:
+            encoding = self.channel_encodings.get( \
+                                self._line_channel(line), encoding)
+        self.decode_fallbacks += 1
+        if self.metrics is not None:
+            self.metrics.inc('decode_fallbacks_total', encoding)
+        return line.decode(encoding, 'replace')
+
+    def _line_channel(self, line):
+        """
+        Returns the first channel name among a line's middle parameters, -
+            lowercased, or None.
+        Required arguments:
+        * line - IRC line as bytes.
+        """
+        for param in line.split(b' :', 1)[0].split()[1:]:
+            if param[:1] in (b'#', b'&', b'!', b'+'):
+                return param.decode('ascii', 'replace').lower()
+        return None
 
     def _mcon(self):
         """ Buffer IRC data and handle PING/PONG. """
         with self.lock:
-            sdata = ' '
-            while sdata[-1] != self._crlf[-1]:
-                if sdata == ' ':
-                    sdata = ''
-                try:
-                    sdata = sdata + \
-                    self._socket.recv(4096).decode(self.encoding)
-                except UnicodeDecodeError:
-                    sdata = sdata + \
-                    self._socket.recv(4096).decode(self.fallback_encoding)
+            lines = self._read_lines()
+            while not lines:
+                lines = self._read_lines()
 
-            lines = sdata.split(self._crlf)
             for line in lines:
+                line = self._decode(line)
+                tags = None
+                if line[:1] == '@':
+                    tags, sep, line = line[1:].partition(' ')
                 if line.find('PING :') == 0:
                     self.send(line.replace('PING', 'PONG'))
+                    continue
+                elif self._ping_tokens and line.find(' PONG ') != -1:
+                    token = line.rsplit(None, 1)[-1].replace(':', '', 1)
+                    if token in self._ping_tokens:
+                        self._pong(token)
+                        continue
                 if line != '':
+                    if tags is not None:
+                        self._tag_buffer[len(self._buffer)] = tags
                     self._buffer.append(line)
 
     def _raw_recv(self):
         """ Return the next available IRC message in the buffer. """
         with self.lock:
             if self._index >= len(self._buffer):
-                self._mcon()
-            if self._index >= 199:
                 self._resetbuffer()
-                self._mcon()
-            msg = self._buffer[self._index]
-            while self.find(msg, 'PING :'):
-                self._index += 1
-                try:
-                    msg = self._buffer[self._index]
-                except IndexError:
+                while not self._buffer:
                     self._mcon()
-                    self.stepback(append=False)
-
+            msg = self._buffer[self._index]
+            if self._tag_buffer:
+                self._msg_tags = self._tag_buffer.get(self._index)
+            else:
+                self._msg_tags = None
             self._index += 1
             return msg
 
@@ -171,7 +295,7 @@ class _Core(variables._Variables, exceptions._Exceptions,
             for timeout amount of time.
         """
         with self.lock:
-            if len(self._buffer) > self._index:
+            if self._pending():
                 return True
             else:
                 if self._select([self._socket], [], [], timeout)[0] == []:
@@ -183,6 +307,7 @@ class _Core(variables._Variables, exceptions._Exceptions,
         """ Resets the IRC buffer. """
         with self.lock:
             self._index, self._buffer = 0, []
+            self._tag_buffer = {}
 
     def stepback(self, append=False):
         """
@@ -193,10 +318,34 @@ class _Core(variables._Variables, exceptions._Exceptions,
         """
         if append:
             data = self._buffer[self._index - 1]
+            if self._msg_tags:
+                self._tag_buffer[len(self._buffer)] = self._msg_tags
             self._buffer.append(data)
         else:
             self._index -= 1
 
+    def _requeue(self, lines):
+        """
+        Puts lines that were read ahead back on the buffer, -
+            in order, so they're the next ones _raw_recv returns.
+        Required arguments:
+        * lines - List of (line, tags) tuples.
+        """
+        if not lines:
+            return
+        with self.lock:
+            index, count = self._index, len(lines)
+            self._buffer[index:index] = [line for line, tags in lines]
+            tag_buffer = {}
+            for position, tags in self._tag_buffer.items():
+                if position >= index:
+                    position += count
+                tag_buffer[position] = tags
+            for position, (line, tags) in enumerate(lines):
+                if tags:
+                    tag_buffer[index + position] = tags
+            self._tag_buffer = tag_buffer
+
     def _from_(self, who):
         """
         Processes nick!user@host data.
@@ -258,6 +407,8 @@ class _Core(variables._Variables, exceptions._Exceptions,
 
         msg = msg.split(None, 3)
 
+        if msg[1] == 'JOIN' or msg[1] == '396':
+            self._track_userhost(msg)
         if msg[1] in self.error_dictionary:
             self.exception(msg[1])
         if rm_colon:
@@ -283,18 +434,73 @@ class _Core(variables._Variables, exceptions._Exceptions,
             return msg[1:]
         return msg
 
-    def recv(self, timeout=None):
+    def recv(self, timeout=None, skip=None):
         """
         High-level IRC buffering system and processor.
+        Messages inside an IRCv3 BATCH are collected and returned -
+            as a single BATCH event once the batch is closed.
         Optional arguments:
         * timeout=None - Time to wait before returning None.
             Defaults to waiting forever.
+        * skip=None - Commands to drop without parsing them,
+            None is returned for them instead of an event.
+            If 'UNKNOWN' is in it, commands that would -
+            become UNKNOWN events are dropped too.
         """
         with self.lock:
             if timeout != None:
                 if self.readable(timeout) == False:
                     return None
-            data = self._raw_recv()
+            while True:
+                data = self._raw_recv()
+                tags = self._msg_tags
+                ref = None
+                if tags and self._batches:
+                    ref = self.tags.get('batch')
+                    if ref not in self._batches:
+                        ref = None
+                if skip and ref is None and data[0] == ':':
+                    command = data.split(None, 2)[1]
+                    if command in skip or ('UNKNOWN' in skip and \
+                        command not in self._parsed_commands and \
+                        command not in self.error_dictionary):
+                        return None
+                if self.metrics is not None:
+                    start = self._m_time.time()
+                if ref and self._batches[ref][0] in self.history_batches:
+                    event = self._parse_history(data)
+                else:
+                    event = self._parse_event(data)
+                if self.metrics is not None:
+                    self.metrics.inc('events_total', event[0])
+                    self.metrics.observe('parse_seconds', \
+                                    self._m_time.time() - start, event[0])
+
+                if event[0] == 'BATCH_START':
+                    batch_ref, batch_type, params = event[1]
+                    self._batches[batch_ref] = batch_type, params, [], ref
+                    continue
+                elif event[0] == 'BATCH_END':
+                    if event[1] not in self._batches:
+                        continue
+                    batch_type, params, events, ref = \
+                                        self._batches.pop(event[1])
+                    event = 'BATCH', (batch_type, params, events)
+
+                if ref in self._batches:
+                    self._batches[ref][2].append((event[0], event[1], \
+                                                ircv3.MessageTags(tags)))
+                    continue
+                return event
+
+    def _parse_event(self, data):
+        """
+        Processes an IRC message and updates the IRC state.
+        Returns a tuple of the event type and its content.
+        Required arguments:
+        * data - IRC message to process.
+        """
+        with self.lock:
             segments = data.split()
 
             if segments[1] == 'JOIN':
@@ -304,8 +510,8 @@ class _Core(variables._Variables, exceptions._Exceptions,
                     self.stepback(append=False)
                     return 'JOIN', self.join_(channel, process_only=True)
                 else:
-                    self.channels[channel]['USERS'][who[0]] = \
-                    ['', '', '', '', '']
+                    self.channels[channel]['USERS'].setdefault(who[0], \
+                    ['', '', '', '', ''])
                 return 'JOIN', (who, channel)
 
             elif segments[1] == 'PART':
@@ -343,7 +549,7 @@ class _Core(variables._Variables, exceptions._Exceptions,
                 who = self._from_(segments[0][1:])
                 target = segments[2]
                 if target != self.current_nick:
-                    self.parse_cmode_string(mode, target)
+                    self.parse_cmode_string(mode, target, segments[0][1:])
                     return 'MODE', (who, segments[2], mode)
                 else:
                     return 'MODE', (who, mode.replace(':', '', 1))
@@ -427,6 +633,13 @@ class _Core(variables._Variables, exceptions._Exceptions,
                 self.lusers['GLOBALMAX'] = segments[8]
                 return 'LUSERS', self.lusers
 
+            elif segments[1] == 'BATCH':
+                ref = segments[2]
+                if ref[0] == '+':
+                    return 'BATCH_START', (ref[1:], ' '.join(segments[3:4]), \
+                                           tuple(segments[4:]))
+                return 'BATCH_END', ref[1:]
+
             elif segments[0] == 'ERROR':
                 self.quit()
                 return 'ERROR', ' '.join(segments[1:]).replace(':', '', 1)
@@ -434,6 +647,28 @@ class _Core(variables._Variables, exceptions._Exceptions,
                 self.stepback(append=False)
                 return 'UNKNOWN', self._recv(rm_first=False)
 
+    def _parse_history(self, data):
+        """
+        Processes a replayed IRC message without touching the IRC state.
+        Returns a tuple of the command and a tuple of -
+            the sender, the target and the trailing text.
+        Required arguments:
+        * data - IRC message to process.
+        """
+        segments = data.split(None, 3)
+        if segments[0][0] != ':':
+            segments.insert(0, '')
+        who = self._from_(segments[0][1:])
+        target = ''
+        text = ''
+        if len(segments) > 2:
+            target = segments[2].replace(':', '', 1)
+        if len(segments) > 3:
+            text = segments[3].replace(':', '', 1)
+        if segments[1] == 'PRIVMSG' and text.find('\001') == 0:
+            return 'CTCP', (who, target, self.ctcp_decode(text))
+        return segments[1], (who, target, text)
+
     def compare(self, first, second):
         """
         Case in-sensitive comparison of two strings.
@@ -0,0 +1,185 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Runs event handlers on thread/process pools. """
+
+from __future__ import with_statement
+import logging
+import threading
+from collections import deque
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:
+    pass
+
+
+def cpu_bound(handler):
+    """
+    Decorator marking an on_* handler as CPU-bound.
+    If the client has a process pool (Client.use_process_pool), -
+        the handler runs in a worker process: it gets an ActionRecorder -
+        instead of the client as self and the actions it takes -
+        (privmsg, notice, kick, cmode...) are applied by the client -
+        once it returns.
+    The handler must be picklable, i.e. defined at the top level of -
+        an importable module.
+    """
+    handler.cpu_bound = True
+    return handler
+
+
+class ActionRecorder(object):
+    """
+    Stands in for the client in a worker process.
+    Records the calls of action methods and exposes a snapshot -
+        of the client's state as attributes.
+    """
+    actions = ('privmsg', 'notice', 'kick', 'cmode', 'umode', 'topic', \
+               'invite', 'part', 'join_', 'send')
+
+    def __init__(self, state):
+        """
+        Required arguments:
+        * state - Dictionary of the client attributes to expose.
+        """
+        self.__dict__.update(state)
+        self.recorded = []
+
+    def __getattr__(self, name):
+        if name not in self.actions:
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.recorded.append((name, args, kwargs))
+        return record
+
+    def ctcp_encode(self, msg):
+        return '\001%s\001' % msg
+
+
+def run_recorded(handler, state, args):
+    """
+    Runs a handler against an ActionRecorder.
+    Returns the recorded actions.
+    Required arguments:
+    * handler - The handler's function.
+    * state - Client state for the ActionRecorder.
+    * args - Handler arguments.
+    """
+    recorder = ActionRecorder(state)
+    handler(recorder, *args)
+    return recorder.recorded
+
+
+class QueueFull(Exception):
+    """ Raised by KeyedExecutor.submit with the 'raise' overflow policy. """
+    pass
+
+
+class KeyedExecutor(object):
+    """
+    Runs calls on a thread pool, while calls submitted with the same key -
+        run one at a time and in the order they were submitted.
+    Calls with different keys run in parallel.
+    """
+    overflow_policies = ('block', 'drop', 'drop_oldest', 'raise')
+
+    def __init__(self, max_workers=4, max_pending=1000, overflow='block'):
+        """
+        Optional arguments:
+        * max_workers=4 - Amount of worker threads.
+        * max_pending=1000 - Maximum amount of queued calls per key.
+        * overflow='block' - What to do when a key's queue is full:
+            'block' - Wait until there's room.
+            'drop' - Discard the new call.
+            'drop_oldest' - Discard the oldest queued call.
+            'raise' - Raise QueueFull.
+        """
+        if overflow not in self.overflow_policies:
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.dropped = 0
+        self._pool = ThreadPoolExecutor(max_workers)
+        self._queues = {}
+        self._running = set()
+        self._condition = threading.Condition()
+        self.log = logging.getLogger('lurklib')
+
+    def submit(self, key, function, *args):
+        """
+        Queues a call.
+        Returns False if the call was dropped, True otherwise.
+        Required arguments:
+        * key - Ordering key, e.g. a channel name.
+        * function - Function to call.
+        * args - Arguments to call the function with.
+        """
+        with self._condition:
+            queue = self._queues.setdefault(key, deque())
+            while len(queue) >= self.max_pending:
+                if self.overflow == 'block':
+                    self._condition.wait()
+                    # The queue may have been drained and removed
+                    # while we were waiting.
+                    queue = self._queues.setdefault(key, deque())
+                elif self.overflow == 'drop':
+                    self.dropped += 1
+                    return False
+                elif self.overflow == 'drop_oldest':
+                    queue.popleft()
+                    self.dropped += 1
+                else:
+                    raise QueueFull('Queue for %r is full' % (key,))
+            queue.append((function, args))
+            if key not in self._running:
+                self._running.add(key)
+                self._pool.submit(self._drain, key)
+        return True
+
+    def _drain(self, key):
+        """
+        Runs the queued calls of a key until its queue is empty.
+        Required arguments:
+        * key - Key to run the calls of.
+        """
+        while True:
+            with self._condition:
+                queue = self._queues.get(key)
+                if not queue:
+                    self._running.discard(key)
+                    self._queues.pop(key, None)
+                    return
+                function, args = queue.popleft()
+                self._condition.notify_all()
+            try:
+                function(*args)
+            except Exception:
+                self.log.exception('Exception in handler call %r%r', \
+                                   function, args)
+
+    def pending(self):
+        """ Returns the amount of queued calls. """
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker threads.
+        Optional arguments:
+        * wait=True - Wait for the queued calls to finish.
+        """
+        self._pool.shutdown(wait)
@@ -0,0 +1,261 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" SQLite message history, for "last seen" and "what did X say" queries. """
+
+from __future__ import with_statement
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from .masks import irc_lower
+
+Message = namedtuple('Message', 'time channel nick userhost kind text')
+
+_SCHEMA = ( \
+    'CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, '
+    'time REAL NOT NULL, channel TEXT, nick TEXT NOT NULL, '
+    'nick_key TEXT NOT NULL, userhost TEXT, kind TEXT NOT NULL, text TEXT)',
+    'CREATE INDEX IF NOT EXISTS messages_channel_time '
+    'ON messages (channel, time)',
+    'CREATE INDEX IF NOT EXISTS messages_nick_time '
+    'ON messages (nick_key, time)',
+    'CREATE INDEX IF NOT EXISTS messages_channel_nick_time '
+    'ON messages (channel, nick_key, time)',
+    )
+
+_INSERT = 'INSERT INTO messages (time, channel, nick, nick_key, userhost, ' \
+          'kind, text) VALUES (?, ?, ?, ?, ?, ?, ?)'
+_COLUMNS = 'time, channel, nick, userhost, kind, text'
+
+# Handler name: (kind, index of the channel argument or None,
+#                index of the text argument or None)
+_EVENTS = { \
+    'on_chanmsg': ('PRIVMSG', 1, 2),
+    'on_channotice': ('NOTICE', 1, 2),
+    'on_join': ('JOIN', 1, None),
+    'on_part': ('PART', 1, 2),
+    'on_kick': ('KICK', 1, 3),
+    'on_topic': ('TOPIC', 1, 2),
+    'on_nick': ('NICK', None, 1),
+    'on_quit': ('QUIT', None, 1),
+    }
+
+
+class HistoryStore(object):
+    """
+    An event sink (see Client.add_sink) that stores channel messages, -
+        joins, parts, kicks, topics, nick changes and quits in SQLite.
+    A kick is stored twice: a KICK row for the kicker and a KICKED row -
+        for the kicked user, both with the reason as text.
+    Rows are queued in memory and inserted by a background thread -
+        in one executemany per flush_interval; the database runs -
+        in WAL mode, so queries don't wait for the writer.
+    Indexed by channel and time and by case-folded nick and time, -
+        so seen and history stay fast on tens of millions of rows.
+    Queued rows only show up in queries after the next write; -
+        call flush to write them right away.
+    If a write fails, the error is logged and the rows are kept -
+        for the next one.
+    """
+    def __init__(self, path, flush_interval=0.1, casemapping='rfc1459'):
+        """
+        Required arguments:
+        * path - SQLite database file.
+        Optional arguments:
+        * flush_interval=0.1 - Seconds between batched inserts.
+        * casemapping='rfc1459' - CASEMAPPING for folding nicks -
+            and channel names.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.casemapping = casemapping
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = []
+        self._closed = False
+        self.log = logging.getLogger('lurklib')
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _key(self, name):
+        return irc_lower(name, self.casemapping)
+
+    def event(self, client, hook, args):
+        """
+        Stores an event; called by Client for every event.
+        Required arguments:
+        * client - Client the event was received by.
+        * hook - Handler name, e.g. 'on_chanmsg'.
+        * args - Handler arguments.
+        """
+        if hook == 'on_chanctcp':
+            if args[2][:7] != 'ACTION ':
+                return
+            kind, channel, text = 'ACTION', args[1], args[2][7:]
+        elif hook in _EVENTS:
+            kind, channel, text = _EVENTS[hook]
+            if channel is not None:
+                channel = args[channel]
+            if text is not None:
+                text = args[text]
+        else:
+            return
+        who = args[0]
+        if not isinstance(who, tuple):
+            who = who, '', ''
+        self.add(who[0], kind, channel, text, '%s@%s' % (who[1], who[2]))
+        if kind == 'KICK':
+            self.add(args[2], 'KICKED', channel, text)
+
+    def add(self, nick, kind, channel=None, text=None, userhost=None, \
+            when=None):
+        """
+        Queues a row.
+        Required arguments:
+        * nick - Nick of the user.
+        * kind - e.g. 'PRIVMSG', 'ACTION', 'JOIN', 'KICKED' or 'QUIT'.
+        Optional arguments:
+        * channel=None - Channel, None for nick changes and quits.
+        * text=None - Message text, reason or new nick.
+        * userhost=None - user@host of the user.
+        * when=None - UNIX time; defaults to now.
+        """
+        if when is None:
+            when = time.time()
+        if channel is not None:
+            channel = self._key(channel)
+        row = when, channel, nick, self._key(nick), userhost, kind, text
+        with self._lock:
+            self._queue.append(row)
+
+    def flush(self):
+        """
+        Inserts the queued rows now.
+        If that fails, the rows are queued again and the -
+            sqlite3.Error is raised.
+        """
+        with self._write_lock:
+            with self._lock:
+                rows = self._queue
+                self._queue = []
+            if not rows:
+                return
+            try:
+                self._db.executemany(_INSERT, rows)
+                self._db.commit()
+            except sqlite3.Error:
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+                with self._lock:
+                    self._queue[:0] = rows
+                raise
+
+    def close(self):
+        """
+        Inserts the queued rows and closes the database -
+            and the connections opened for queries.
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self._db.close()
+        with self._lock:
+            readers = self._readers
+            self._readers = []
+        for db in readers:
+            db.close()
+
+    def _run(self):
+        """ Background writer loop. """
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except sqlite3.Error:
+                self.log.exception('Writing %d rows to %s failed', \
+                                   len(self._queue), self.path)
+            if closed:
+                return
+
+    def _reader(self):
+        """ Returns this thread's connection for queries. """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, \
+                                                  check_same_thread=False)
+            with self._lock:
+                self._readers.append(db)
+        return db
+
+    def seen(self, nick):
+        """
+        Returns the last row of a nick, as a Message, or None.
+        Required arguments:
+        * nick - Nick to look up.
+        """
+        row = self._reader().execute('SELECT %s FROM messages WHERE ' \
+                                     'nick_key = ? ORDER BY time DESC ' \
+                                     'LIMIT 1' % _COLUMNS, \
+                                     (self._key(nick),)).fetchone()
+        if row is None:
+            return None
+        return Message(*row)
+
+    def history(self, channel, since=None, limit=100, nick=None):
+        """
+        Returns a channel's rows, oldest first, as a list of Messages.
+        Required arguments:
+        * channel - Channel name.
+        Optional arguments:
+        * since=None - UNIX time to start at; if None, -
+            the latest rows are returned.
+        * limit=100 - Maximum amount of rows.
+        * nick=None - Only return the rows of this nick.
+        """
+        query = 'SELECT %s FROM messages WHERE channel = ?' % _COLUMNS
+        params = [self._key(channel)]
+        if nick is not None:
+            query += ' AND nick_key = ?'
+            params.append(self._key(nick))
+        if since is not None:
+            query += ' AND time >= ? ORDER BY time LIMIT ?'
+            params.extend((since, limit))
+            return [Message(*row) for row in \
+                    self._reader().execute(query, params)]
+        query += ' ORDER BY time DESC LIMIT ?'
+        params.append(limit)
+        rows = [Message(*row) for row in \
+                self._reader().execute(query, params)]
+        rows.reverse()
+        return rows
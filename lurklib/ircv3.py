@@ -0,0 +1,269 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" IRCv3 capabilities, message-tags and server-time. """
+
+from __future__ import with_statement
+import calendar
+
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def unescape_tag_value(value):
+    """
+    Unescapes an IRCv3 message-tag value.
+    Required arguments:
+    * value - Escaped tag value.
+    """
+    if '\\' not in value:
+        return value
+    unescaped = []
+    escaped = False
+    for char in value:
+        if escaped:
+            unescaped.append(_TAG_ESCAPES.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            unescaped.append(char)
+    return ''.join(unescaped)
+
+
+def parse_server_time(value):
+    """
+    Converts a server-time value into a float UNIX timestamp.
+    Returns None if the value is malformed.
+    Required arguments:
+    * value - Timestamp in the form of YYYY-MM-DDThh:mm:ss.sssZ.
+    """
+    try:
+        timestamp = calendar.timegm((int(value[0:4]), int(value[5:7]),
+                                     int(value[8:10]), int(value[11:13]),
+                                     int(value[14:16]), int(value[17:19]),
+                                     0, 0, 0))
+    except ValueError:
+        return None
+    if value[19:20] == '.':
+        fraction = value[20:].rstrip('Z')
+        if fraction.isdigit():
+            timestamp += int(fraction) / (10.0 ** len(fraction))
+    return float(timestamp)
+
+
+class MessageTags(object):
+    """
+    Lazily decoded IRCv3 message-tags.
+    The raw tag section is only split and unescaped -
+        the first time a tag is looked up.
+    """
+    __slots__ = ('raw', '_tags')
+
+    def __init__(self, raw=None):
+        """
+        Required arguments:
+        * raw - Raw tag section without the leading '@', or None.
+        """
+        self.raw = raw
+        self._tags = None
+
+    def _decode(self):
+        """ Splits and unescapes the raw tag section. """
+        tags = {}
+        if self.raw:
+            for tag in self.raw.split(';'):
+                if not tag:
+                    continue
+                name, sep, value = tag.partition('=')
+                tags[name] = unescape_tag_value(value) if sep else True
+        self._tags = tags
+        return tags
+
+    def _lookup(self):
+        tags = self._tags
+        if tags is None:
+            tags = self._decode()
+        return tags
+
+    def __getitem__(self, name):
+        return self._lookup()[name]
+
+    def __contains__(self, name):
+        return name in self._lookup()
+
+    def __iter__(self):
+        return iter(self._lookup())
+
+    def __len__(self):
+        return len(self._lookup())
+
+    def __bool__(self):
+        return bool(self.raw)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'MessageTags(%r)' % self.raw
+
+    def get(self, name, default=None):
+        return self._lookup().get(name, default)
+
+    def items(self):
+        return self._lookup().items()
+
+    def as_dict(self):
+        """ Returns a copy of the decoded tags. """
+        return dict(self._lookup())
+
+    @property
+    def time(self):
+        """
+        The server-time tag as a float UNIX timestamp,
+            or None if the server didn't send one.
+        Only the time tag is looked at, the other tags stay undecoded.
+        """
+        raw = self.raw
+        if not raw:
+            return None
+        if raw.startswith('time='):
+            start = 5
+        else:
+            start = raw.find(';time=')
+            if start == -1:
+                return None
+            start += 6
+        end = raw.find(';', start)
+        if end == -1:
+            end = len(raw)
+        return parse_server_time(raw[start:end])
+
+
+class _IRCv3(object):
+    """ Defines IRCv3 capability negotiation and message-tag access. """
+    @property
+    def tags(self):
+        """
+        The message-tags of the last received IRC message.
+        Decoding only happens when a tag is actually looked up.
+        """
+        raw = self._msg_tags
+        cached = self._msg_tags_obj
+        if cached is None or cached.raw is not raw:
+            cached = self._msg_tags_obj = MessageTags(raw)
+        return cached
+
+    @property
+    def server_time(self):
+        """
+        The server-time of the last received IRC message,
+            as a float UNIX timestamp, or None if there was none.
+        """
+        if not self._msg_tags:
+            return None
+        return self.tags.time
+
+    def cap_req(self, capabilities):
+        """
+        Requests IRCv3 capabilities.
+        Returns a tuple of the acknowledged capabilities.
+        Required arguments:
+        * capabilities - A list/tuple of capabilities to request.
+        """
+        with self.lock:
+            self.send('CAP REQ :%s' % ' '.join(capabilities))
+            acked = ()
+            while self.readable(4):
+                msg = self._recv(expected_replies=('CAP',))
+                if msg[0] == 'CAP':
+                    segments = msg[2].split(None, 1)
+                    if segments[0] == 'ACK':
+                        acked = tuple(segments[1].replace(':', '', 1).split())
+                        for cap in acked:
+                            if cap[0] == '-':
+                                self.caps.discard(cap[1:])
+                            else:
+                                self.caps.add(cap)
+                    break
+            return acked
+
+    def chathistory(self, target, subcommand='LATEST', reference='*',
+                    limit=100, end=None):
+        """
+        Requests message history from the server (draft/chathistory).
+        Returns a list of the historical messages, oldest first, -
+            each as a tuple of the command, -
+            a (who, target, message) tuple and its MessageTags.
+        Required arguments:
+        * target - Channel or nick to get the history of.
+        Optional arguments:
+        * subcommand='LATEST' - LATEST, BEFORE, AFTER, AROUND or BETWEEN.
+        * reference='*' - Where to start; a msgid=/timestamp= reference,
+            '*', or a UNIX timestamp.
+        * limit=100 - Maximum amount of messages to return.
+        * end=None - End reference for BETWEEN.
+        """
+        reference = self._history_reference(reference)
+        with self.lock:
+            if end is not None:
+                self.send('CHATHISTORY %s %s %s %s %s' % (subcommand, \
+                          target, reference, \
+                          self._history_reference(end), limit))
+            else:
+                self.send('CHATHISTORY %s %s %s %s' % (subcommand, target, \
+                                                       reference, limit))
+            ref = None
+            messages = []
+            deferred = []
+            try:
+                while self.readable(4):
+                    data = self._raw_recv()
+                    tags = self._msg_tags
+                    segments = data.split(None, 3)
+                    if segments[1] == 'BATCH':
+                        if ref is None and segments[2][0] == '+' and \
+                           segments[3].split()[0] in self.history_batches:
+                            ref = segments[2][1:]
+                            continue
+                        elif ref and segments[2] == '-' + ref:
+                            break
+                    elif ref and tags and self.tags.get('batch') == ref:
+                        event = self._parse_history(data)
+                        messages.append((event[0], event[1], \
+                                         MessageTags(tags)))
+                        continue
+                    elif segments[:2] == ['FAIL', 'CHATHISTORY'] or \
+                         segments[1:3] == ['FAIL', 'CHATHISTORY']:
+                        break
+                    elif segments[1] in self.error_dictionary:
+                        self.exception(segments[1])
+                    deferred.append((data, tags))
+            finally:
+                self._requeue(deferred)
+            return messages
+
+    def _history_reference(self, reference):
+        """
+        Turns a UNIX timestamp into a chathistory timestamp= reference.
+        Other references are returned as is.
+        Required arguments:
+        * reference - Reference to convert.
+        """
+        if isinstance(reference, (int, float)):
+            return 'timestamp=%s.%03dZ' % ( \
+                self._m_time.strftime('%Y-%m-%dT%H:%M:%S', \
+                                      self._m_time.gmtime(reference)), \
+                int(reference * 1000) % 1000)
+        return reference
@@ -0,0 +1,134 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Keepalive PINGs, latency tracking and dead-peer detection. """
+
+from __future__ import with_statement
+
+
+class _Keepalive(object):
+    """ Defines the keepalive scheduler and latency statistics. """
+    reconnect_delay = 1.0
+    reconnect_delay_max = 300.0
+
+    def _send_ping(self):
+        """
+        Sends a tokenised PING and returns its token.
+        The matching PONG is picked up by _mcon.
+        """
+        with self.lock:
+            self._ping_count += 1
+            token = 'lurklib-%d' % self._ping_count
+            self._ping_tokens[token] = self._m_time.time()
+            self.send('PING :%s' % token)
+            return token
+
+    def _pong(self, token):
+        """
+        Records the round-trip time of an answered PING.
+        Required arguments:
+        * token - Token of the PING.
+        """
+        sent = self._ping_tokens.pop(token)
+        self._rtts.append(self._m_time.time() - sent)
+        self.missed_pongs = 0
+
+    def _keepalive(self):
+        """
+        Sends a PING when the connection has been idle for -
+            keepalive seconds and counts the PINGs left unanswered.
+        Reconnects once keepalive_misses PINGs went unanswered.
+        """
+        if not self.keepalive:
+            return
+        with self.lock:
+            now = self._m_time.time()
+            if self._reconnect_at is not None:
+                if now >= self._reconnect_at:
+                    self._try_reconnect()
+                return
+            for token, sent in list(self._ping_tokens.items()):
+                if now - sent > self.keepalive:
+                    del self._ping_tokens[token]
+                    self.missed_pongs += 1
+            if self.missed_pongs >= self.keepalive_misses:
+                self._try_reconnect()
+            elif not self._ping_tokens and \
+                 now - self._last_recv >= self.keepalive:
+                self._send_ping()
+
+    def _try_reconnect(self):
+        """
+        Reconnects; if that fails, schedules another attempt -
+            after reconnect_delay seconds, doubling the delay -
+            up to reconnect_delay_max after every failure.
+        """
+        try:
+            self.reconnect()
+        except (self._m_socket.error, self.LurklibError):
+            if self._reconnect_at is None:
+                delay = self.reconnect_delay
+            else:
+                delay = min(self.reconnect_delay_max, \
+                            self._reconnect_delay * 2)
+            self._reconnect_delay = delay
+            self._reconnect_at = self._m_time.time() + delay
+        else:
+            self._reconnect_at = None
+
+    def latency(self, timeout=10):
+        """
+        Checks the connection latency.
+        PINGs the server and returns the round-trip time, or None -
+            if the PONG didn't arrive within the timeout.
+        Other messages received meanwhile are left on the buffer; -
+            latency_stats returns the last keepalive measurement -
+            without waiting.
+        Optional arguments:
+        * timeout=10 - Time to wait for the PONG.
+        """
+        with self.lock:
+            token = self._send_ping()
+            deadline = self._m_time.time() + timeout
+            while token in self._ping_tokens:
+                remaining = deadline - self._m_time.time()
+                if remaining <= 0:
+                    return None
+                if self._select([self._socket], [], [], remaining)[0]:
+                    self._mcon()
+            return self._rtts[-1]
+
+    def latency_stats(self):
+        """
+        Returns a dictionary of latency statistics -
+            of the recent round-trip times:
+        * COUNT - Amount of samples.
+        * LAST - The last round-trip time.
+        * MIN, MAX - The lowest and highest round-trip time.
+        * P50, P95, P99 - Round-trip time percentiles.
+        * MISSED - PINGs currently left unanswered in a row.
+        """
+        rtts = sorted(self._rtts)
+        stats = {'COUNT': len(rtts), 'MISSED': self.missed_pongs}
+        if rtts:
+            last = len(rtts) - 1
+            stats['LAST'] = self._rtts[-1]
+            stats['MIN'] = rtts[0]
+            stats['MAX'] = rtts[-1]
+            stats['P50'] = rtts[int(last * 0.50)]
+            stats['P95'] = rtts[int(last * 0.95)]
+            stats['P99'] = rtts[int(last * 0.99)]
+        return stats
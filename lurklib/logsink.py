@@ -0,0 +1,255 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Buffered, daily rotated channel logs, written by a background thread. """
+
+from __future__ import with_statement
+import gzip
+import os
+import shutil
+import threading
+import time
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ChannelLogger(object):
+    """
+    An event sink (see Client.add_sink) that logs channel events -
+        to one file per channel and day: directory/#channel/YYYY-MM-DD.log.
+    Events are formatted into per-channel buffers in memory; -
+        a background thread writes them out every flush_interval -
+        seconds, or sooner once a channel's buffer reaches buffer_size.
+    The files of past days are closed and optionally compressed.
+    QUITs are logged to the channels the logger has seen the user in.
+    """
+    _formats = { \
+        'on_chanmsg': '<%(nick)s> %(text)s',
+        'on_channotice': '-%(nick)s- %(text)s',
+        'on_join': '*** %(nick)s (%(user)s@%(host)s) has joined',
+        'on_part': '*** %(nick)s has left (%(text)s)',
+        'on_kick': '*** %(target)s was kicked by %(nick)s (%(text)s)',
+        'on_topic': '*** %(nick)s changed the topic to: %(text)s',
+        'on_cmode': '*** %(nick)s sets mode %(text)s',
+        'on_nick': '*** %(nick)s is now known as %(text)s',
+        'on_quit': '*** %(nick)s has quit (%(text)s)',
+        }
+
+    def __init__(self, directory, flush_interval=1.0, buffer_size=65536, \
+                 compress=None, UTC=False, encoding='UTF-8'):
+        """
+        Required arguments:
+        * directory - Directory to log to.
+        Optional arguments:
+        * flush_interval=1.0 - Seconds between writes.
+        * buffer_size=65536 - Bytes buffered per channel -
+            before a write is started early.
+        * compress=None - Compress past days' files: 'gzip', -
+            'zstd' (needs the zstandard module) or None.
+        * UTC=False - Use UTC for timestamps and rotation?
+        * encoding='UTF-8' - Log file encoding.
+        """
+        if compress not in (None, 'gzip', 'zstd'):
+            raise ValueError('Unknown compression: %s' % compress)
+        if compress == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard module')
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.compress = compress
+        self.encoding = encoding
+        self._localtime = time.localtime
+        if UTC:
+            self._localtime = time.gmtime
+        self._buffers = {}
+        self._sizes = {}
+        self._members = {}
+        self._files = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._stamp = None, None, None
+        self.lines = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def event(self, client, hook, args):
+        """
+        Logs an event; called by Client for every event.
+        Required arguments:
+        * client - Client the event was received by.
+        * hook - Handler name, e.g. 'on_chanmsg'.
+        * args - Handler arguments.
+        """
+        if hook == 'on_chanctcp':
+            if args[2][:7] != 'ACTION ':
+                return
+            self._channel_members(client, args[1])
+            return self.log(args[1], '* %s %s' % (args[0][0], args[2][7:]))
+        format_ = self._formats.get(hook)
+        if format_ is None:
+            return
+        who = args[0]
+        if not isinstance(who, tuple):
+            who = who, '', ''
+        if hook == 'on_nick' or hook == 'on_quit':
+            nick = who[0]
+            for channel, members in list(self._members.items()):
+                if nick in members:
+                    members.discard(nick)
+                    if hook == 'on_nick':
+                        members.add(args[1])
+                    self.log(channel, format_ % {'nick': nick, \
+                                                 'text': args[1]})
+            return
+        values = {'nick': who[0], 'user': who[1], 'host': who[2], \
+                  'text': args[-1]}
+        channel = args[1]
+        members = self._channel_members(client, channel)
+        if hook == 'on_join':
+            members.add(who[0])
+        elif hook == 'on_part':
+            members.discard(who[0])
+        elif hook == 'on_kick':
+            values['target'] = args[2]
+            members.discard(args[2])
+        self.log(channel, format_ % values)
+        if hook in ('on_part', 'on_kick') and \
+           values.get('target', who[0]) == client.current_nick:
+            del self._members[channel.lower()]
+
+    def _channel_members(self, client, channel):
+        """
+        Returns the nicks the logger tracks in a channel, -
+            taking them from the client the first time.
+        """
+        key = channel.lower()
+        members = self._members.get(key)
+        if members is None:
+            members = self._members[key] = \
+                set(client.channels.get(channel, {}).get('USERS', ()))
+        return members
+
+    def log(self, channel, text, when=None):
+        """
+        Adds a line to a channel's log.
+        Required arguments:
+        * channel - Channel name.
+        * text - Line to log, without a timestamp.
+        Optional arguments:
+        * when=None - UNIX time of the line; defaults to now.
+        """
+        if when is None:
+            when = time.time()
+        second = int(when)
+        if second != self._stamp[0]:
+            stamp = self._localtime(second)
+            self._stamp = second, '[%02d:%02d:%02d] ' % (stamp.tm_hour, \
+                          stamp.tm_min, stamp.tm_sec), '%04d-%02d-%02d' % \
+                          (stamp.tm_year, stamp.tm_mon, stamp.tm_mday)
+        second, prefix, day = self._stamp
+        line = prefix + text + '\n'
+        key = channel.lower(), day
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = []
+                self._sizes[key] = 0
+            buffer.append(line)
+            self._sizes[key] += len(line)
+            if self._sizes[key] >= self.buffer_size:
+                self._wakeup.notify()
+
+    def flush(self):
+        """ Writes out everything buffered so far. """
+        with self._write_lock:
+            with self._lock:
+                buffers = self._buffers
+                self._buffers = {}
+                self._sizes = {}
+            self._write(buffers)
+
+    def close(self):
+        """ Writes out the buffers, closes the files and stops the thread. """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        with self._write_lock:
+            for channel in list(self._files):
+                self._close(channel, False)
+
+    def _run(self):
+        """ Background writer loop. """
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def _path(self, channel, day):
+        channel = channel.replace(os.sep, '_').replace('\0', '_')
+        if channel in ('.', '..'):
+            channel = '_' + channel
+        return os.path.join(self.directory, channel, day + '.log')
+
+    def _write(self, buffers):
+        """ Appends buffered lines to their files and rotates old ones. """
+        for (channel, day), lines in sorted(buffers.items()):
+            opened = self._files.get(channel)
+            if opened is not None and opened[0] != day:
+                self._close(channel)
+                opened = None
+            if opened is None:
+                path = self._path(channel, day)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                opened = self._files[channel] = day, open(path, 'ab')
+            opened[1].write(''.join(lines).encode(self.encoding, 'replace'))
+            self.lines += len(lines)
+        stamp = self._localtime()
+        today = '%04d-%02d-%02d' % (stamp.tm_year, stamp.tm_mon, \
+                                    stamp.tm_mday)
+        for channel, (day, file_) in list(self._files.items()):
+            if day != today:
+                self._close(channel)
+            else:
+                file_.flush()
+
+    def _close(self, channel, compress=True):
+        """ Closes a channel's file, compressing it if asked to. """
+        day, file_ = self._files.pop(channel)
+        file_.close()
+        if compress and self.compress is not None:
+            self._compress(file_.name)
+
+    def _compress(self, path):
+        """ Compresses a closed log file, appending to an earlier archive. """
+        with open(path, 'rb') as source:
+            if self.compress == 'gzip':
+                with gzip.open(path + '.gz', 'ab') as target:
+                    shutil.copyfileobj(source, target)
+            else:
+                with open(path + '.zst', 'ab') as target:
+                    zstandard.ZstdCompressor().copy_stream(source, target)
+        os.remove(path)
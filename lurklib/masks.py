@@ -0,0 +1,202 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Indexed nick!user@host wildcard mask matching, for bans and ignores. """
+
+import re
+
+_CASEMAPPINGS = { \
+    'ascii': {},
+    'strict-rfc1459': {'[': '{', ']': '}', '\\': '|'},
+    'rfc1459': {'[': '{', ']': '}', '\\': '|', '~': '^'},
+    }
+
+
+def irc_lower(text, casemapping='rfc1459'):
+    """
+    Lowercases text following an IRC CASEMAPPING.
+    Required arguments:
+    * text - Text to lowercase.
+    Optional arguments:
+    * casemapping='rfc1459' - 'ascii', 'strict-rfc1459' or 'rfc1459'.
+    """
+    text = text.lower()
+    for upper, lower in _CASEMAPPINGS.get(casemapping, {}).items():
+        if upper in text:
+            text = text.replace(upper, lower)
+    return text
+
+
+def normalize_mask(mask):
+    """
+    Completes a mask to nick!user@host form, the way servers do:
+        'nick' becomes 'nick!*@*', 'user@host' becomes '*!user@host' -
+        and 'nick!user' becomes 'nick!user@*'.
+    Required arguments:
+    * mask - Mask to complete.
+    """
+    if '!' not in mask:
+        if '@' in mask:
+            return '*!' + mask
+        return mask + '!*@*'
+    if '@' not in mask:
+        return mask + '@*'
+    return mask
+
+
+def _literal(part):
+    """ Checks whether a mask part has no wildcards. """
+    return '*' not in part and '?' not in part
+
+
+def _pattern(mask):
+    """ Translates a normalized, lowercased mask into a regex. """
+    return ''.join(['.*' if char == '*' else '.' if char == '?' \
+                    else re.escape(char) for char in mask])
+
+
+class MaskIndex(object):
+    """
+    A set of wildcard masks that finds all masks matching -
+        a nick!user@host without trying each of them.
+    Masks are filed by their most selective literal part:
+    * an exact host in a hash,
+    * a *.suffix host in a hash of host suffixes, -
+        looked up once per suffix of the host being matched,
+    * an exact nick in a hash,
+    * anything else in a fallback group, prefiltered by one -
+        combined regex.
+    The candidates are then checked against the whole mask.
+    """
+    def __init__(self, masks=(), casemapping='rfc1459'):
+        """
+        Optional arguments:
+        * masks=() - Masks to add.
+        * casemapping='rfc1459' - Server CASEMAPPING, -
+            e.g. client.version.get('CASEMAPPING', 'rfc1459').
+        """
+        self.casemapping = casemapping
+        self._masks = {}
+        self._hosts = {}
+        self._suffixes = {}
+        self._nicks = {}
+        self._fallback = {}
+        self._fallback_regex = None
+        for mask in masks:
+            self.add(mask)
+
+    def __len__(self):
+        return len(self._masks)
+
+    def __contains__(self, mask):
+        return self._key(mask) in self._masks
+
+    def _key(self, mask):
+        """ Returns the normalized, lowercased form of a mask. """
+        return irc_lower(normalize_mask(mask), self.casemapping)
+
+    def _bucket(self, key):
+        """
+        Returns the index dictionary and the key a mask is filed under.
+        Required arguments:
+        * key - Normalized, lowercased mask.
+        """
+        nick, rest = key.split('!', 1)
+        host = rest.split('@', 1)[1]
+        if _literal(host):
+            return self._hosts, host
+        if host[:1] == '*' and _literal(host[1:]) and len(host) > 1:
+            return self._suffixes, host[1:]
+        if _literal(nick):
+            return self._nicks, nick
+        return self._fallback, key
+
+    def add(self, mask):
+        """
+        Adds a mask.
+        Required arguments:
+        * mask - Mask to add, e.g. '*!*@*.example.com'.
+        """
+        key = self._key(mask)
+        if key in self._masks:
+            return
+        index, name = self._bucket(key)
+        if key[:4] == '*!*@' and index is not self._nicks and \
+           index is not self._fallback:
+            # The host lookup already matched the whole mask.
+            regex = None
+        else:
+            regex = re.compile(_pattern(key) + '$', re.DOTALL)
+        self._masks[key] = mask, regex
+        if index is self._fallback:
+            self._fallback[key] = regex
+            self._fallback_regex = None
+        else:
+            index.setdefault(name, {})[key] = regex
+
+    def remove(self, mask):
+        """
+        Removes a mask; unknown masks are ignored.
+        Required arguments:
+        * mask - Mask to remove.
+        """
+        key = self._key(mask)
+        if self._masks.pop(key, None) is None:
+            return
+        index, name = self._bucket(key)
+        if index is self._fallback:
+            del self._fallback[key]
+            self._fallback_regex = None
+        else:
+            del index[name][key]
+            if not index[name]:
+                del index[name]
+
+    def masks(self):
+        """ Returns the masks, as they were added. """
+        return [mask for mask, regex in self._masks.values()]
+
+    def match(self, hostmask):
+        """
+        Returns all masks matching a hostmask.
+        Required arguments:
+        * hostmask - 'nick!user@host' or a (nick, user, host) tuple, -
+            as returned by _from_.
+        """
+        if isinstance(hostmask, (tuple, list)):
+            hostmask = '%s!%s@%s' % tuple(hostmask)
+        hostmask = irc_lower(hostmask, self.casemapping)
+        nick = hostmask.split('!', 1)[0]
+        host = hostmask.rsplit('@', 1)[-1]
+        candidates = []
+        if host in self._hosts:
+            candidates.extend(self._hosts[host].items())
+        if self._suffixes:
+            suffixes = self._suffixes
+            for start in range(len(host)):
+                if host[start:] in suffixes:
+                    candidates.extend(suffixes[host[start:]].items())
+        if nick in self._nicks:
+            candidates.extend(self._nicks[nick].items())
+        if self._fallback:
+            if self._fallback_regex is None:
+                self._fallback_regex = re.compile('(?:%s)$' % '|'.join( \
+                    [regex.pattern[:-1] for regex in \
+                     self._fallback.values()]), re.DOTALL)
+            if self._fallback_regex.match(hostmask):
+                candidates.extend(self._fallback.items())
+        return [self._masks[key][0] for key, regex in candidates \
+                if regex is None or regex.match(hostmask)]
@@ -0,0 +1,342 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Counters, histograms, handler timing and Prometheus exposition. """
+
+from __future__ import with_statement
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+_DEFAULT_METRICS = (
+    ('lines_sent_total', 'counter', 'IRC lines sent.', 'command'),
+    ('bytes_sent_total', 'counter', 'Bytes sent.', 'command'),
+    ('lines_received_total', 'counter', 'IRC lines received.', None),
+    ('bytes_received_total', 'counter', 'Bytes received.', None),
+    ('recv_calls_total', 'counter', 'Socket recv calls.', None),
+    ('decode_fallbacks_total', 'counter',
+     'Received lines decoded with a fallback encoding.', 'encoding'),
+    ('events_total', 'counter', 'Events processed by recv.', 'event'),
+    ('parse_seconds', 'histogram', 'Time spent parsing an event.', 'event'),
+    ('handler_seconds', 'histogram', 'Time spent in event handlers.',
+     'hook'),
+    ('query_seconds', 'histogram', 'Round-trip time of queries.', 'query'),
+    ('lock_contended_total', 'counter',
+     'Lock acquisitions that had to wait.', 'lock'),
+    ('lock_wait_seconds', 'histogram', 'Time spent waiting for a lock.',
+     'lock'),
+    )
+
+
+class Metrics(object):
+    """
+    A registry of labelled counters and histograms.
+    Every metric has at most one label, e.g. the IRC command.
+    """
+    buckets = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, namespace='lurklib'):
+        """
+        Optional arguments:
+        * namespace='lurklib' - Prefix of the exported metric names.
+        """
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._metrics = {}
+        for definition in _DEFAULT_METRICS:
+            self.register(*definition)
+
+    def register(self, name, type_, help_, label=None, buckets=None):
+        """
+        Registers a new metric.
+        Required arguments:
+        * name - Metric name.
+        * type_ - 'counter' or 'histogram'.
+        * help_ - Description of the metric.
+        Optional arguments:
+        * label=None - Name of the metric's label.
+        * buckets=None - Histogram bucket upper bounds,
+            defaults to Metrics.buckets.
+        """
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (type_, help_, label, \
+                                       tuple(buckets or self.buckets), {})
+
+    def inc(self, name, label=None, amount=1):
+        """
+        Increments a counter.
+        Required arguments:
+        * name - Counter name.
+        Optional arguments:
+        * label=None - Label value.
+        * amount=1 - Amount to increment by.
+        """
+        values = self._metrics[name][4]
+        with self._lock:
+            values[label] = values.get(label, 0) + amount
+
+    def observe(self, name, value, label=None):
+        """
+        Records a value in a histogram.
+        Required arguments:
+        * name - Histogram name.
+        * value - Value to record.
+        Optional arguments:
+        * label=None - Label value.
+        """
+        metric = self._metrics[name]
+        buckets = metric[3]
+        values = metric[4]
+        with self._lock:
+            histogram = values.get(label)
+            if histogram is None:
+                histogram = values[label] = [0] * (len(buckets) + 2)
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        """
+        Returns a dictionary of all metrics, keyed by metric name -
+            and then by label value.
+        Counters map to their value, histograms to a dictionary with -
+            cumulative 'buckets', 'count' and 'sum'.
+        """
+        snapshot = {}
+        with self._lock:
+            for name, (type_, help_, label, buckets, values) in \
+                                                self._metrics.items():
+                metric = snapshot[name] = {}
+                for label_value, value in values.items():
+                    if type_ == 'histogram':
+                        cumulative = []
+                        total = 0
+                        for count in value[:-1]:
+                            total += count
+                            cumulative.append(total)
+                        metric[label_value] = { \
+                            'buckets': dict(zip(buckets + ('+Inf',), \
+                                                cumulative)),
+                            'count': total, 'sum': value[-1]}
+                    else:
+                        metric[label_value] = value
+        return snapshot
+
+    def prometheus(self):
+        """ Returns all metrics in the Prometheus text exposition format. """
+        lines = []
+        snapshot = self.snapshot()
+        for name in sorted(snapshot):
+            type_, help_, label, buckets = self._metrics[name][:4]
+            full_name = '%s_%s' % (self.namespace, name)
+            lines.append('# HELP %s %s' % (full_name, help_))
+            lines.append('# TYPE %s %s' % (full_name, type_))
+            for label_value, value in sorted(snapshot[name].items(), \
+                                             key=lambda item: str(item[0])):
+                labels = []
+                if label and label_value is not None:
+                    labels.append('%s="%s"' % (label, \
+                                               _escape(label_value)))
+                if type_ == 'histogram':
+                    for bound in buckets + ('+Inf',):
+                        lines.append('%s_bucket{%s} %s' % (full_name, \
+                            ','.join(labels + ['le="%s"' % bound]), \
+                            value['buckets'][bound]))
+                    lines.append('%s_sum%s %r' % (full_name, \
+                                            _labels(labels), value['sum']))
+                    lines.append('%s_count%s %s' % (full_name, \
+                                            _labels(labels), value['count']))
+                else:
+                    lines.append('%s%s %s' % (full_name, _labels(labels), \
+                                              value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """
+        Serves the Prometheus text page over HTTP on a daemon thread.
+        Returns the HTTP server; call its shutdown() method to stop it.
+        Optional arguments:
+        * port=9100 - Port to listen on.
+        * host='127.0.0.1' - Address to listen on.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus().encode('UTF-8')
+                self.send_response(200)
+                self.send_header('Content-Type', \
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+class TimedLock(object):
+    """
+    Wraps a lock and records how often and how long -
+        acquiring it had to wait.
+    """
+    def __init__(self, lock, metrics, name='main'):
+        """
+        Required arguments:
+        * lock - Lock/RLock to wrap.
+        * metrics - Metrics registry to record into.
+        Optional arguments:
+        * name='main' - Label value for the lock metrics.
+        """
+        self._lock = lock
+        self._metrics = metrics
+        self.name = name
+
+    def acquire(self, blocking=True):
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.time()
+        self._lock.acquire()
+        self._metrics.inc('lock_contended_total', self.name)
+        self._metrics.observe('lock_wait_seconds', time.time() - start, \
+                              self.name)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+class HandlerStats(object):
+    """
+    Per-handler timing statistics and slow handler detection.
+    """
+    def __init__(self, threshold=0.5, samples=1024, slowest=20):
+        """
+        Optional arguments:
+        * threshold=0.5 - Handler calls taking longer than this -
+            many seconds are logged and remembered.
+        * samples=1024 - Amount of recent timings kept per handler -
+            for the percentiles.
+        * slowest=20 - Amount of slowest calls remembered.
+        """
+        self.threshold = threshold
+        self._samples = samples
+        self._max_slowest = slowest
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.slowest = []
+        self.log = logging.getLogger('lurklib')
+
+    def record(self, hook, elapsed, event=None):
+        """
+        Records a handler call.
+        Required arguments:
+        * hook - Handler name.
+        * elapsed - Time the call took, in seconds.
+        Optional arguments:
+        * event=None - Event that triggered the call.
+        """
+        with self._lock:
+            stats = self._stats.get(hook)
+            if stats is None:
+                stats = self._stats[hook] = \
+                                [0, 0.0, 0.0, deque(maxlen=self._samples)]
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+            stats[3].append(elapsed)
+            if elapsed < self.threshold:
+                return
+            self.slowest.append((elapsed, hook, event))
+            self.slowest.sort(key=lambda call: call[0], reverse=True)
+            del self.slowest[self._max_slowest:]
+        self.log.warning('Slow handler %s took %.3fs for event %r', \
+                         hook, elapsed, event)
+
+    def report(self, limit=10):
+        """
+        Returns the handlers with the highest total time as a list of -
+            (hook, calls, total, mean, max, p50, p95, p99) tuples.
+        Optional arguments:
+        * limit=10 - Maximum amount of handlers to return.
+        """
+        report = []
+        with self._lock:
+            for hook, (calls, total, max_, samples) in self._stats.items():
+                samples = sorted(samples)
+                last = len(samples) - 1
+                report.append((hook, calls, total, total / calls, max_, \
+                               samples[int(last * 0.50)], \
+                               samples[int(last * 0.95)], \
+                               samples[int(last * 0.99)]))
+        report.sort(key=lambda row: row[2], reverse=True)
+        return report[:limit]
+
+
+def timed_query(method):
+    """
+    Decorator recording a query's round-trip time -
+        in query_seconds, if the client has metrics enabled.
+    """
+    name = method.__name__
+
+    def timed(self, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, *args, **kwargs)
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.metrics.observe('query_seconds', time.time() - start, name)
+    timed.__name__ = name
+    timed.__doc__ = method.__doc__
+    return timed
+
+
+def _escape(value):
+    """ Escapes a Prometheus label value. """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                     .replace('\n', '\\n')
+
+
+def _labels(labels):
+    """ Formats a list of label pairs. """
+    if labels:
+        return '{%s}' % ','.join(labels)
+    return ''
@@ -17,6 +17,7 @@
 """ Defines optional IRC-things. """
 
 from __future__ import with_statement
+from .metrics import timed_query
 
 
 class _Optional(object):
@@ -69,8 +70,16 @@ class _Optional(object):
         """ Not implemented. """
         raise self.NotImplemented('LurklibError: NotImplemented')
 
-	def oper(self, name, password)
-		self.send('OPER :%s %s' % name, password, error_check=True)
+    def oper(self, name, password):
+        """
+        Authenticates as an IRC operator.
+        Required arguments:
+        * name - Operator name.
+        * password - Operator password.
+        """
+        with self.lock:
+            self.send('OPER %s %s' % (name, password), error_check=True)
+
     def users(self):
         """ Not implemented. """
         raise self.NotImplemented('LurklibError: NotImplemented')
@@ -83,6 +92,7 @@ class _Optional(object):
         """
         self.send('WALLOPS :%s' % msg, error_check=True)
 
+    @timed_query
     def userhost(self, nicks):
         """
         Runs a userhost on a nick.
@@ -98,6 +108,7 @@ class _Optional(object):
                     userhosts = msg[2].replace(':', '', 1).split()
             return userhosts
 
+    @timed_query
     def ison(self, nicks):
         """
         Checks if a nick is on or not.
@@ -0,0 +1,153 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Raw bytes mode, for relays and loggers that don't need str. """
+
+from __future__ import with_statement
+
+
+class RawMessage(object):
+    """
+    A minimally parsed IRC message.
+    line is the whole line as bytes (without the CR-LF), -
+        tags, prefix and command are memoryview slices of it -
+        (tags/prefix are None if absent) and params is a list of -
+        memoryview slices, the trailing parameter included.
+    """
+    __slots__ = ('line', 'tags', 'prefix', 'command', 'params')
+
+    def __init__(self, line, tags, prefix, command, params):
+        self.line = line
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+
+    def __repr__(self):
+        return 'RawMessage(%r)' % self.line
+
+
+def parse_raw(line):
+    """
+    Splits a raw IRC line into a RawMessage without copying or decoding.
+    Required arguments:
+    * line - IRC line as bytes, without the CR-LF.
+    """
+    view = memoryview(line)
+    end = len(line)
+    pos = 0
+    tags = prefix = None
+    if line[:1] == b'@':
+        space = line.find(b' ')
+        if space == -1:
+            space = end
+        tags = view[1:space]
+        pos = space + 1
+    if line[pos:pos + 1] == b':':
+        space = line.find(b' ', pos)
+        if space == -1:
+            space = end
+        prefix = view[pos + 1:space]
+        pos = space + 1
+    space = line.find(b' ', pos)
+    if space == -1:
+        space = end
+    command = view[pos:space]
+    pos = space + 1
+    params = []
+    while pos < end:
+        if line[pos:pos + 1] == b':':
+            params.append(view[pos + 1:end])
+            break
+        space = line.find(b' ', pos)
+        if space == -1:
+            space = end
+        if space > pos:
+            params.append(view[pos:space])
+        pos = space + 1
+    return RawMessage(line, tags, prefix, command, params)
+
+
+class _RawMode(object):
+    """ Defines the raw bytes receiving/sending path. """
+    def enable_raw_mode(self):
+        """
+        Switches the client to raw bytes mode:
+            lines are no longer decoded, parsed or tracked in the IRC state;
+            recv_raw returns them as RawMessage objects -
+            and Client calls on_raw for every line.
+        Lines that were already received are handed over as well.
+        """
+        with self.lock:
+            for index in range(self._index, len(self._buffer)):
+                line = self._buffer[index]
+                tags = self._tag_buffer.get(index)
+                if tags:
+                    line = '@%s %s' % (tags, line)
+                self._raw_lines.append(line.encode(self.encoding))
+            self._resetbuffer()
+            self.raw_mode = True
+
+    def _read_raw_lines(self):
+        """
+        Reads from the socket and frames complete lines as bytes.
+        PINGs are answered and keepalive PONGs consumed here.
+        """
+        for line in self._read_lines():
+            if line[:5] == b'PING ':
+                self.send_raw(b'PONG' + line[4:])
+                continue
+            if self._ping_tokens and b' PONG ' in line:
+                token = line.rsplit(None, 1)[-1].lstrip(b':')
+                token = token.decode('ascii', 'replace')
+                if token in self._ping_tokens:
+                    self._pong(token)
+                    continue
+            self._raw_lines.append(line)
+
+    def recv_raw(self, timeout=None):
+        """
+        Returns the next IRC message as a RawMessage, or None -
+            if none arrived within the timeout.
+        Optional arguments:
+        * timeout=None - Time to wait; defaults to waiting forever.
+        """
+        with self.lock:
+            while not self._raw_lines:
+                if timeout is not None and not self._pending() and not \
+                   self._select([self._socket], [], [], timeout)[0]:
+                    return None
+                self._read_raw_lines()
+            return parse_raw(self._raw_lines.popleft())
+
+    def send_raw(self, data):
+        """
+        Sends raw bytes as is; the CR-LF is appended if it's missing.
+        Required arguments:
+        * data - IRC line as bytes.
+        """
+        if data[-2:] != b'\r\n':
+            data = data + b'\r\n'
+        if len(data) > 512:
+            raise self.MessageTooLong('LurklibError: MessageTooLong')
+        with self._send_lock:
+            self._socket.sendall(data)
+            if self.recorder is not None:
+                self.recorder.record(b'O', [data[:-2]])
+        if self.metrics is not None:
+            command = data.split(b' ', 1)[0].decode('ascii', 'replace')
+            self.metrics.inc('lines_sent_total', command)
+            self.metrics.inc('bytes_sent_total', command, len(data))
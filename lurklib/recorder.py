@@ -0,0 +1,199 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Records a connection's raw traffic and replays it into a client.
+A recording has one line per IRC line: the seconds since the recording -
+    started, I (inbound) or O (outbound) and the raw line, -
+    e.g. b'12.034518 I :server PING :x'.
+"""
+
+from __future__ import with_statement
+import socket
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Recorder(object):
+    """ Appends the raw lines of a connection to a recording file. """
+    def __init__(self, path):
+        """
+        Required arguments:
+        * path - File to append to.
+        """
+        self.path = path
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        self._start = _clock()
+
+    def record(self, direction, lines):
+        """
+        Appends lines to the recording.
+        Required arguments:
+        * direction - b'I' for inbound or b'O' for outbound lines.
+        * lines - Raw lines as bytes, without the CR-LF.
+        """
+        stamp = ('%.6f ' % (_clock() - self._start)).encode('ascii') + \
+                direction + b' '
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(b''.join([stamp + line + b'\n' \
+                                       for line in lines]))
+
+    def close(self):
+        """ Flushes and closes the recording. """
+        with self._lock:
+            self._file.close()
+
+
+def load(path):
+    """
+    Yields the (time, direction, line) records of a recording; -
+        direction is b'I' or b'O'.
+    Required arguments:
+    * path - Recording file.
+    """
+    with open(path, 'rb') as recording:
+        for record in recording:
+            stamp, direction, line = record.rstrip(b'\n').split(b' ', 2)
+            yield float(stamp), direction, line
+
+
+class _ReplaySocket(object):
+    """
+    Stands in for the client's socket.
+    The client talks to one end of a socket pair, so select() works; -
+        the inbound lines of the recording are written to the other end -
+        on schedule and everything the client sends is read and dropped.
+    """
+    def __init__(self, replayer):
+        self._replayer = replayer
+        self._client, self._server = socket.socketpair()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def connect(self, address):
+        self._registered = threading.Event()
+        for target in (self._feed, self._drain):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _feed(self):
+        """
+        Writes the recorded inbound lines to the client, -
+            once it has started registering.
+        """
+        speed = self._replayer.speed
+        self._registered.wait()
+        start = self._replayer.started = _clock()
+        first = None
+        try:
+            for stamp, direction, line in load(self._replayer.path):
+                if direction != b'I':
+                    continue
+                if speed:
+                    if first is None:
+                        first = stamp
+                    delay = start + (stamp - first) / speed - _clock()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._server.sendall(line + b'\r\n')
+                self._replayer.lines += 1
+        finally:
+            self._replayer.finished = _clock()
+            self._server.shutdown(socket.SHUT_WR)
+
+    def _drain(self):
+        """ Reads and drops what the client sends. """
+        try:
+            if self._server.recv(65536):
+                self._registered.set()
+            while self._server.recv(65536):
+                pass
+        except socket.error:
+            pass
+
+
+class _ReplaySocketModule(object):
+    """ socket module replacement whose socket() is a _ReplaySocket. """
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+    def socket(self, *args):
+        return _ReplaySocket(self._replayer)
+
+
+class Replayer(object):
+    """
+    Replays a recording into a client, for benchmarking parsing, -
+        state tracking and handlers offline.
+    Only the inbound lines are replayed, on the recorded schedule -
+        divided by speed; what the client sends doesn't affect them.
+    Replaying starts once the client registers, which it does after -
+        waiting 2 seconds for messages from the server.
+    """
+    def __init__(self, path, speed=None):
+        """
+        Required arguments:
+        * path - Recording file.
+        Optional arguments:
+        * speed=None - 1 replays at the recorded speed, 10 ten times -
+            as fast and None as fast as the client can take it.
+        """
+        self.path = path
+        self.speed = speed
+        self.lines = 0
+        self.started = None
+        self.finished = None
+
+    def client(self, cls, **kwargs):
+        """
+        Creates a client of the given class connected to the replay; -
+            it registers from the recorded welcome lines.
+        Required arguments:
+        * cls - Client class, e.g. lurklib.Client or a bot subclass.
+        * kwargs - Arguments for the client, e.g. the recorded nick; -
+            tls is turned off.
+        """
+        replay_cls = type(cls.__name__, (cls,), \
+                          {'_m_socket': _ReplaySocketModule(self)})
+        kwargs['tls'] = False
+        kwargs.setdefault('server', 'replay')
+        return replay_cls(**kwargs)
+
+    def run(self, cls, **kwargs):
+        """
+        Replays the whole recording through a client's mainloop.
+        Returns the client and the time the replay took, in seconds, -
+            not counting the wait before registering.
+        Required arguments:
+        * cls - Client class.
+        * kwargs - Arguments for the client.
+        """
+        client = self.client(cls, **kwargs)
+        try:
+            client.mainloop()
+        except socket.error:
+            pass
+        return client, _clock() - self.started
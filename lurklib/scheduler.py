@@ -0,0 +1,168 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Outbound queue, timers and the main loop's wakeup channel. """
+
+from __future__ import with_statement
+import heapq
+
+
+class _Scheduler(object):
+    """ Defines queued sends, timers and waking up the main loop. """
+    flood_burst = 5
+    flood_interval = 1.0
+
+    def enqueue(self, msg):
+        """
+        Queues a raw message to be sent by the main loop, -
+            respecting the flood limits (flood_burst lines at once,
+            then one line every flood_interval seconds).
+        Lines are sent right away as long as the limits allow it.
+        Required arguments:
+        * msg - Message to send.
+        """
+        self._enqueue_data(self._encode_line(msg))
+
+    def _enqueue_data(self, data):
+        """
+        Queues an encoded line, like enqueue.
+        Required arguments:
+        * data - Encoded line, without the CR-LF.
+        """
+        self._outbox.append(data)
+        self._flush_outbox()
+        if self._outbox:
+            self.wakeup()
+
+    def _flush_outbox(self):
+        """
+        Sends as many queued messages as the flood limits allow.
+        Returns the time until the next message may be sent, -
+            or None if the queue is empty.
+        """
+        with self._schedule_lock:
+            now = self._m_time.time()
+            self._flood_tokens = min(self.flood_burst, self._flood_tokens + \
+                    (now - self._flood_time) / self.flood_interval)
+            self._flood_time = now
+            while self._outbox and self._flood_tokens >= 1:
+                self._write(self._outbox.popleft())
+                self._flood_tokens -= 1
+            if not self._outbox:
+                return None
+            return (1 - self._flood_tokens) * self.flood_interval
+
+    def call_later(self, delay, function, *args):
+        """
+        Calls a function from the main loop after a delay.
+        Required arguments:
+        * delay - Seconds to wait.
+        * function - Function to call.
+        * args - Arguments to call the function with.
+        """
+        with self._schedule_lock:
+            self._timer_count += 1
+            heapq.heappush(self._timers, (self._m_time.time() + delay, \
+                                          self._timer_count, function, args))
+        self.wakeup()
+
+    def _run_timers(self):
+        """
+        Calls the timers that are due.
+        Returns the time until the next timer, or None if there is none.
+        """
+        while self._timers:
+            with self._schedule_lock:
+                if not self._timers:
+                    return None
+                delay = self._timers[0][0] - self._m_time.time()
+                if delay > 0:
+                    return delay
+                function, args = heapq.heappop(self._timers)[2:]
+            function(*args)
+        return None
+
+    def wakeup(self):
+        """
+        Wakes up the main loop if it's waiting for the server.
+        Safe to call from any thread.
+        """
+        if self._wakeup_pair is None:
+            return
+        try:
+            self._wakeup_pair[1].send(b'\0')
+        except self._m_socket.error:
+            pass
+
+    def _wait(self, timeout=None):
+        """
+        Blocks until the server sent something, wakeup() was called -
+            or the timeout ran out.
+        Returns True if there is data from the server to process; -
+            while disconnected, only waits for wakeup() or the timeout.
+        Optional arguments:
+        * timeout=None - Maximum time to wait; None waits forever.
+        """
+        if self._pending():
+            return True
+        if self._wakeup_pair is None:
+            self._wakeup_pair = self._m_socket.socketpair()
+            self._wakeup_pair[0].setblocking(False)
+            self._wakeup_pair[1].setblocking(False)
+        waker = self._wakeup_pair[0]
+        sockets = [waker]
+        try:
+            if self.connected and self._socket.fileno() >= 0:
+                sockets.append(self._socket)
+        except self._m_socket.error:
+            pass
+        try:
+            readable = self._select(sockets, [], [], timeout)[0]
+        except (ValueError, self._m_socket.error):
+            return False
+        if waker in readable:
+            try:
+                while waker.recv(4096):
+                    pass
+            except self._m_socket.error:
+                pass
+        return self._socket in readable
+
+    def _pending(self):
+        """
+        Checks whether there's already received data waiting, -
+            either on the buffer or decrypted by TLS.
+        """
+        if len(self._buffer) > self._index or self._raw_lines:
+            return True
+        pending = getattr(self._socket, 'pending', None)
+        return bool(pending and pending())
+
+    def _next_timeout(self):
+        """
+        Runs the due timers/keepalive and flushes the outbound queue.
+        Returns how long the main loop may block, None meaning forever.
+        """
+        timeouts = [self._run_timers(), self._flush_outbox()]
+        if self.keepalive:
+            self._keepalive()
+            timeouts.append(self.keepalive / 2.0)
+            if self._reconnect_at is not None:
+                timeouts.append(self._reconnect_at - self._m_time.time())
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        if timeouts:
+            return max(0, min(timeouts))
+        return None
@@ -17,34 +17,270 @@
 """ File for sending-related things. """
 
 from __future__ import with_statement
+import codecs
+
+
+def split_message(data, budget, encoding='UTF-8'):
+    """
+    Splits an encoded message into parts of at most budget bytes.
+    Parts are cut after the last space that leaves them at least -
+        half full, or else at the budget, moved back to the start -
+        of a character.
+    Returns a list of bytes parts.
+    Required arguments:
+    * data - Encoded message.
+    * budget - Maximum size of a part, in bytes.
+    Optional arguments:
+    * encoding='UTF-8' - Encoding of the message.
+    """
+    if len(data) <= budget:
+        return [data]
+    utf8 = codecs.lookup(encoding).name == 'utf-8'
+    view = bytearray(data)
+    end = len(view)
+    parts = []
+    start = 0
+    while end - start > budget:
+        cut = start + budget
+        space = view.rfind(b' ', start + budget // 2, cut + 1)
+        if space != -1:
+            parts.append(bytes(view[start:space]))
+            start = space + 1
+            continue
+        if utf8:
+            while cut > start and view[cut] & 0xC0 == 0x80:
+                cut -= 1
+        else:
+            cut = _char_start(view, start, cut, encoding)
+        if cut == start:
+            cut = start + budget
+        parts.append(bytes(view[start:cut]))
+        start = cut
+    if start < end:
+        parts.append(bytes(view[start:]))
+    return parts
+
+
+def _char_start(view, start, cut, encoding):
+    """
+    Moves a cut back to the start of the character it falls in, -
+        for encodings other than UTF-8.
+    Required arguments:
+    * view - Encoded message.
+    * start - Where the part starts.
+    * cut - Where the part would be cut.
+    * encoding - Encoding of the message.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    text = decoder.decode(bytes(view[start:cut]))
+    return start + len(text.encode(encoding, 'replace'))
 
 
 class _Sending(object):
     """ Defines PRIVMSG and NOTICE methods. """
-    def privmsg(self, target, message):
+    def privmsg(self, target, message, wait_away=False):
         """
         Sends a PRIVMSG to someone.
+        Messages that are too long for one line are split -
+            and the parts are queued with enqueue.
+        Returns right after sending, unless wait_away is set; -
+            an RPL_AWAY reply then arrives like any other message, -
+            as an on_unknown event.
         Required arguments:
         * target - Who to send the message to.
         * message - Message to send.
+        Optional arguments:
+        * wait_away=False - Hold the reader lock and wait for -
+            an RPL_AWAY reply; if they're away, returns a tuple -
+            of 'AWAY' and their away message.
         """
+        if not wait_away:
+            self._send_message('PRIVMSG', target, message)
+            return
         with self.lock:
-            self.send('PRIVMSG ' + target + ' :' + message)
-            if self.readable():
-                msg = self._recv(expected_replies=('301',))
-                if msg[0] == '301':
-                    return 'AWAY', msg[2].split(None, 1)[1].replace(':', '', 1)
+            self._send_message('PRIVMSG', target, message)
+            return self._away_reply()
 
-    def notice(self, target, message):
+    def notice(self, target, message, wait_away=False):
         """
         Sends a NOTICE to someone.
+        Messages that are too long for one line are split -
+            and the parts are queued with enqueue.
+        Returns right after sending, unless wait_away is set; -
+            an RPL_AWAY reply then arrives like any other message, -
+            as an on_unknown event.
         Required arguments:
         * target - Who to send the message to.
         * message - Message to send.
+        Optional arguments:
+        * wait_away=False - Hold the reader lock and wait for -
+            an RPL_AWAY reply; if they're away, returns a tuple -
+            of 'AWAY' and their away message.
         """
+        if not wait_away:
+            self._send_message('NOTICE', target, message)
+            return
         with self.lock:
-            self.send('NOTICE ' + target + ' :' + message)
-            if self.readable():
-                msg = self._recv(expected_replies=('301',))
-                if msg[0] == '301':
-                    return 'AWAY', msg[2].split(None, 1)[1].replace(':', '', 1)
+            self._send_message('NOTICE', target, message)
+            return self._away_reply()
+
+    def broadcast(self, targets, message, command='PRIVMSG'):
+        """
+        Sends the same message to many targets, -
+            packing as many comma-separated targets into each line -
+            as TARGMAX/MAXTARGETS and the 512 byte limit allow.
+        The lines are queued with enqueue.
+        Returns the amount of lines queued.
+        Required arguments:
+        * targets - Channels/nicks to send the message to.
+        * message - Message to send.
+        Optional arguments:
+        * command='PRIVMSG' - PRIVMSG or NOTICE.
+        """
+        seen = set()
+        unique = []
+        for target in targets:
+            if target.lower() not in seen:
+                seen.add(target.lower())
+                unique.append(target)
+        if not unique:
+            return 0
+        limit = self._target_limit(command)
+        lines = []
+        for part in self._message_parts(command, max(unique, key=len), \
+                                        message):
+            room = 512 - len(self._crlf) - len(command) - 3 - len(part)
+            batch = []
+            used = 0
+            for target in unique:
+                size = self._encoded_len(target)
+                if batch and (used + 1 + size > room or len(batch) == limit):
+                    lines.append(self._encode_line('%s %s :' % (command, \
+                                 ','.join(batch))) + part)
+                    batch = []
+                    used = 0
+                if batch:
+                    used += 1
+                batch.append(target)
+                used += size
+            lines.append(self._encode_line('%s %s :' % (command, \
+                         ','.join(batch))) + part)
+        for line in lines:
+            self._enqueue_data(line)
+        return len(lines)
+
+    def _target_limit(self, command, unlisted=1):
+        """
+        Returns how many targets the server accepts in one command, -
+            according to TARGMAX or else MAXTARGETS; None means no limit.
+        Required arguments:
+        * command - Command name.
+        Optional arguments:
+        * unlisted=1 - Limit to assume when TARGMAX doesn't list -
+            the command.
+        """
+        targmax = self.version.get('TARGMAX')
+        if targmax and targmax is not True:
+            for entry in targmax.split(','):
+                name, sep, limit = entry.partition(':')
+                if name.upper() == command:
+                    if limit:
+                        return int(limit)
+                    return None
+            return unlisted
+        maxtargets = self.version.get('MAXTARGETS')
+        if maxtargets and maxtargets is not True:
+            return int(maxtargets)
+        return 1
+
+    def _away_reply(self):
+        """
+        Checks for an RPL_AWAY reply to a message that was just sent.
+        Returns 'AWAY' and the away message, or None.
+        """
+        if self.readable():
+            msg = self._recv(expected_replies=('301',))
+            if msg[0] == '301':
+                return 'AWAY', msg[2].split(None, 1)[1].replace(':', '', 1)
+
+    def _send_message(self, command, target, message):
+        """
+        Sends a PRIVMSG/NOTICE, split into as many lines as needed.
+        A message that fits on one line is sent right away, -
+            unless messages are already queued.
+        Required arguments:
+        * command - PRIVMSG or NOTICE.
+        * target - Who to send the message to.
+        * message - Message to send.
+        """
+        header = self._encode_line('%s %s :' % (command, target))
+        parts = self._message_parts(command, target, message)
+        if len(parts) == 1 and not self._outbox:
+            self._write(header + parts[0])
+        else:
+            for part in parts:
+                self._enqueue_data(header + part)
+
+    def _message_parts(self, command, target, message):
+        """
+        Splits a message into encoded parts that each fit in one line -
+            of 512 bytes as the server relays it.
+        CTCP messages are never split.
+        Required arguments:
+        * command - PRIVMSG or NOTICE.
+        * target - Who the message is sent to.
+        * message - Message to split.
+        """
+        message = message.replace('\r', '\\r').replace('\n', '\\n')
+        encoding = self.encoding
+        try:
+            data = message.encode(encoding)
+        except UnicodeEncodeError:
+            encoding = self.fallback_encoding
+            data = message.encode(encoding)
+        if message[:1] == '\001':
+            return [data]
+        budget = self._message_budget('%s %s :' % (command, target))
+        return split_message(data, budget, encoding)
+
+    def _encoded_len(self, text):
+        """
+        Returns the length of text once encoded for sending.
+        Required arguments:
+        * text - Text to measure.
+        """
+        try:
+            return len(text.encode(self.encoding))
+        except UnicodeEncodeError:
+            return len(text.encode(self.fallback_encoding))
+
+    def _message_budget(self, header):
+        """
+        Returns how many bytes of text fit after a header, -
+            once the server prefixed it with our nick!user@host.
+        Until our user@host is known, the longest allowed one is assumed.
+        Required arguments:
+        * header - Command, target and the colon, e.g. 'PRIVMSG #a :'.
+        """
+        userhost = self._own_userhost
+        if userhost is None:
+            userhost = '%s@%s' % ('x' * (int(self.version.get( \
+                                            'USERLEN', 10)) + 1), \
+                                  'x' * int(self.version.get('HOSTLEN', 63)))
+        prefix = ':%s!%s %s' % (self.current_nick, userhost, header)
+        return 512 - len(self._crlf) - len(prefix.encode(self.encoding))
+
+    def _track_userhost(self, msg):
+        """
+        Remembers our user@host, used for the message length budget, -
+            from our own JOIN or from a RPL_HOSTHIDDEN.
+        Required arguments:
+        * msg - Message split into at most 4 parts, prefix included.
+        """
+        if msg[1] == 'JOIN':
+            nick, user, host = self._from_(msg[0][1:])
+            if host and self.compare(nick, self.current_nick):
+                self._own_userhost = '%s@%s' % (user, host)
+        elif self._own_userhost is not None and len(msg) > 3:
+            self._own_userhost = '%s@%s' % ( \
+                self._own_userhost.split('@', 1)[0], msg[3].split(None, 1)[0])
@@ -17,10 +17,12 @@
 """ Server related queries. """
 
 from __future__ import with_statement
+from .metrics import timed_query
 
 
 class _ServerQueries(object):
     """ Defines server related queries. """
+    @timed_query
     def get_motd(self, server=None):
         """
         Gets the server's MOTD.
@@ -47,6 +49,7 @@ class _ServerQueries(object):
             self.motd = tuple(motd)
             return self.motd
 
+    @timed_query
     def get_lusers(self, mask=None, target=None):
         """
         Get the LUSERS information.
@@ -93,6 +96,7 @@ class _ServerQueries(object):
                     break
             return self.lusers
 
+    @timed_query
     def get_version(self, target=None):
         """
         Get the servers VERSION information.
@@ -123,6 +127,7 @@ class _ServerQueries(object):
 
             return self.version
 
+    @timed_query
     def stats(self, query=None, target=None):
         """
         Get the server's STATS information.
@@ -146,6 +151,7 @@ class _ServerQueries(object):
                     stat_lines.append(msg[3].replace(':', '', 1))
             return stat_lines
 
+    @timed_query
     def links(self, r_server=None, mask=None):
         """
         Get LINKS information.
@@ -172,6 +178,7 @@ class _ServerQueries(object):
                     break
             return links
 
+    @timed_query
     def time(self, target=None):
         """
         Get server time.
@@ -209,6 +216,7 @@ class _ServerQueries(object):
         """ Not implemented. """
         raise self.NotImplemented('LurklibError: NotImplemented')
 
+    @timed_query
     def admin(self, server=None):
         """
         Get the admin information.
@@ -232,6 +240,7 @@ class _ServerQueries(object):
 
             return rvalue
 
+    @timed_query
     def s_info(self, server=None):
         """
         Runs the INFO command on a server.
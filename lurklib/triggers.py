@@ -0,0 +1,334 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Keyword and regex triggers matched in one pass over a message. """
+
+import re
+
+# Numbered backreferences break once the pattern is wrapped in a group.
+_BACKREFERENCE = re.compile(r'\\[1-9]')
+_VERBOSE = re.compile(r'\(\?[a-zA-Z]*x')
+# Alphanumeric escapes that take an argument: \xhh, \uhhhh, \Uhhhhhhhh,
+# \N{name} and octal escapes/backreferences with up to three digits.
+_ESCAPE_ARGUMENT = re.compile(r'x[0-9a-fA-F]{0,2}|u[0-9a-fA-F]{0,4}|'
+                              r'U[0-9a-fA-F]{0,8}|N\{[^}]*\}?|[0-9]{1,3}')
+
+
+def required_literal(pattern, flags=0):
+    """
+    Returns the longest lowercased text every match of a regex contains, -
+        or None if none of at least 3 characters can be found.
+    Only literal text outside groups and character classes counts, -
+        and patterns with a top-level alternation have none.
+    Alphanumeric escapes such as \\d or \\x41 end a run of literal text.
+    Required arguments:
+    * pattern - Regular expression.
+    Optional arguments:
+    * flags=0 - Regex flags.
+    """
+    if flags & re.VERBOSE or _VERBOSE.search(pattern):
+        return None
+    runs = []
+    run = []
+    depth = 0
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        index += 1
+        literal = None
+        if char == '\\' and index < len(pattern):
+            if not pattern[index].isalnum():
+                literal = pattern[index]
+                index += 1
+            else:
+                argument = _ESCAPE_ARGUMENT.match(pattern, index)
+                if argument is None:
+                    index += 1
+                else:
+                    index = argument.end()
+        elif char == '[':
+            if pattern[index:index + 1] == ']':
+                index += 1
+            index = pattern.find(']', index + 1) + 1 or len(pattern)
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return None
+        elif char == '{':
+            index = pattern.find('}', index) + 1 or len(pattern)
+        elif char not in '*?+.^$':
+            literal = char
+        if literal is not None and depth == 0 and \
+           pattern[index:index + 1] not in ('*', '?', '{'):
+            run.append(literal)
+        else:
+            if run:
+                runs.append(''.join(run))
+            run = []
+    if run:
+        runs.append(''.join(run))
+    if not runs:
+        return None
+    longest = max(runs, key=len)
+    if len(longest) < 3:
+        return None
+    return longest.lower()
+
+
+class _Automaton(object):
+    """
+    Aho-Corasick automaton over lowercased keywords.
+    The failure links are folded into the transition dictionaries, -
+        so matching takes one dictionary lookup per character.
+    """
+    def __init__(self, keywords):
+        """
+        Required arguments:
+        * keywords - Dictionary mapping keywords to lists of trigger names.
+        """
+        goto = [{}]
+        outputs = [[]]
+        for keyword, names in keywords.items():
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].extend((keyword, name) for name in names)
+
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = goto[0]
+        queue = list(goto[0].values())
+        for state in queue:
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            for char, next_state in goto[state].items():
+                fail[next_state] = delta[fail[state]].get(char, 0)
+                if fail[next_state] == next_state:
+                    fail[next_state] = 0
+                queue.append(next_state)
+        self.delta = delta
+        self.outputs = outputs
+
+    def search(self, text):
+        """
+        Yields (end, keyword, name) for every keyword occurrence in text.
+        Required arguments:
+        * text - Lowercased text to search.
+        """
+        delta = self.delta
+        outputs = self.outputs
+        root = delta[0]
+        state = 0
+        for end, char in enumerate(text):
+            state = delta[state].get(char)
+            if state is None:
+                state = root.get(char, 0)
+            if outputs[state]:
+                for keyword, name in outputs[state]:
+                    yield end + 1, keyword, name
+
+
+class Triggers(object):
+    """
+    A set of named keyword and regex triggers.
+    One pass of an Aho-Corasick automaton over the lowercased message -
+        finds the keywords as well as the literal text each regex -
+        requires, so only regexes whose literal occurs are run.
+    Regexes without such a literal are matched by one combined -
+        alternation of named groups.
+    The automaton and the alternation are rebuilt lazily -
+        after triggers are added/removed.
+    The alternation only tells whether any of its regexes matches; -
+        if one does, each of them is searched on its own, so -
+        overlapping matches are all reported with their own match objects.
+    Patterns that can't be combined, e.g. ones with numbered -
+        backreferences, always run on their own.
+    """
+    def __init__(self):
+        self._keywords = {}
+        self._regexes = {}
+        self._handlers = {}
+        self._automaton = None
+        self._combined = None
+        self._separate = []
+        self._added = 0
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def __contains__(self, name):
+        return name in self._handlers
+
+    def add_keyword(self, name, keyword, handler=None, whole_word=True):
+        """
+        Adds a keyword trigger.
+        Required arguments:
+        * name - Trigger name, unique among all triggers.
+        * keyword - Text to look for.
+        Optional arguments:
+        * handler=None - Called by Client with the client, the sender, -
+            where to reply to, the trigger name and the matched text.
+        * whole_word=True - Only match the keyword as a whole word.
+        """
+        self.remove(name)
+        self._keywords[name] = keyword.lower(), whole_word
+        self._handlers[name] = handler
+        self._automaton = None
+
+    def add_regex(self, name, pattern, handler=None, flags=re.IGNORECASE):
+        """
+        Adds a regex trigger.
+        Required arguments:
+        * name - Trigger name, unique among all triggers.
+        * pattern - Regular expression to search for.
+        Optional arguments:
+        * handler=None - Called by Client with the client, the sender, -
+            where to reply to, the trigger name and the match object.
+        * flags=re.IGNORECASE - Regex flags.
+        """
+        regex = re.compile(pattern, flags)
+        self.remove(name)
+        self._added += 1
+        literal = required_literal(pattern, flags)
+        self._regexes[name] = self._added, regex, literal
+        self._handlers[name] = handler
+        if literal is None:
+            self._combined = None
+        else:
+            self._automaton = None
+
+    def remove(self, name):
+        """
+        Removes a trigger; unknown names are ignored.
+        Required arguments:
+        * name - Trigger name.
+        """
+        if self._handlers.pop(name, False) is False:
+            return
+        if self._keywords.pop(name, None) is not None:
+            self._automaton = None
+        regex = self._regexes.pop(name, None)
+        if regex is not None:
+            if regex[2] is None:
+                self._combined = None
+            else:
+                self._automaton = None
+
+    def _build(self):
+        """ Rebuilds the automaton and the combined regex if needed. """
+        if self._automaton is None:
+            keywords = {}
+            for name, (keyword, whole_word) in self._keywords.items():
+                keywords.setdefault(keyword, []).append(name)
+            for name, (added, regex, literal) in self._regexes.items():
+                if literal is not None:
+                    keywords.setdefault(literal, []).append(name)
+            self._automaton = _Automaton(keywords)
+        if self._combined is None:
+            combined = {}
+            separate = []
+            regexes = sorted((added, name, regex) for name, \
+                             (added, regex, literal) in self._regexes.items() \
+                             if literal is None)
+            for added, name, regex in regexes:
+                group = 't%d' % added
+                try:
+                    if _BACKREFERENCE.search(regex.pattern):
+                        raise re.error('numbered backreference')
+                    re.compile('(?P<%s>%s)' % (group, regex.pattern))
+                except re.error:
+                    separate.append((name, regex))
+                    continue
+                combined.setdefault(regex.flags, []).append( \
+                                    ('(?P<%s>%s)' % (group, regex.pattern), \
+                                     name, regex))
+            self._combined = []
+            for flags, members in combined.items():
+                patterns = [member[0] for member in members]
+                members = [member[1:] for member in members]
+                try:
+                    self._combined.append((re.compile('|'.join(patterns), \
+                                                      flags), members))
+                except re.error:
+                    separate.extend(members)
+            separate.sort(key=lambda member: self._regexes[member[0]][0])
+            self._separate = separate
+
+    def match(self, text):
+        """
+        Returns the triggers matching text, as a list of -
+            (name, matched keyword or regex match object) tuples, -
+            each trigger at most once.
+        Required arguments:
+        * text - Text to match.
+        """
+        self._build()
+        matches = []
+        seen = set()
+        candidates = []
+        if self._automaton.outputs[0] or len(self._automaton.delta) > 1:
+            lowered = text.lower()
+            for end, keyword, name in self._automaton.search(lowered):
+                if name in seen:
+                    continue
+                if name in self._regexes:
+                    seen.add(name)
+                    candidates.append((self._regexes[name][0], name))
+                    continue
+                start = end - len(keyword)
+                if self._keywords[name][1] and \
+                   (lowered[start - 1:start].isalnum() or \
+                    lowered[end:end + 1].isalnum()):
+                    continue
+                seen.add(name)
+                matches.append((name, text[start:end]))
+        for added, name in sorted(candidates):
+            match = self._regexes[name][1].search(text)
+            if match:
+                matches.append((name, match))
+        for combined, members in self._combined:
+            if combined.search(text):
+                for name, regex in members:
+                    match = regex.search(text)
+                    if match:
+                        matches.append((name, match))
+        for name, regex in self._separate:
+            match = regex.search(text)
+            if match:
+                matches.append((name, match))
+        return matches
+
+    def dispatch(self, client, from_, target, text):
+        """
+        Calls the handlers of the triggers matching a message.
+        Required arguments:
+        * client - Client the message was received by.
+        * from_ - Sender, as a (nick, user, host) tuple.
+        * target - Where to reply to.
+        * text - Message text.
+        """
+        for name, match in self.match(text):
+            handler = self._handlers.get(name)
+            if handler is not None:
+                handler(client, from_, target, name, match)
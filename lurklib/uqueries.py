@@ -16,10 +16,12 @@
 """ User queries and such. """
 
 from __future__ import with_statement
+from .metrics import timed_query
 
 
 class _UserQueries(object):
     """ Defines user queries and such. """
+    @timed_query
     def who(self, target):
         """
         Runs a WHO on a target
@@ -66,6 +68,7 @@ class _UserQueries(object):
                 elif msg[0] == '315':
                     return who_lst
 
+    @timed_query
     def whois(self, nick):
         """
         Runs a WHOIS on someone.
@@ -116,6 +119,7 @@ class _UserQueries(object):
 
             return whois_r
 
+    @timed_query
     def whowas(self, nick):
         """
         Runs a WHOWAS on someone.
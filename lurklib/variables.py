@@ -20,7 +20,8 @@ import time
 import ssl as tls
 import tempfile
 from select import select
-from threading import RLock
+from threading import RLock, Lock
+from collections import deque
 try:
     import socks
 except ImportError:
@@ -41,11 +42,22 @@ class _Variables(object):
 
     _crlf = '\r\n'
     priv_types = ('~', '&', '@', '%', '+')
+    history_batches = ('chathistory', 'znc.in/playback')
 
     def __init__(self):
         """ Set instance-specific variables/objects. """
         self._buffer = []
         self._index = 0
+        self._tag_buffer = {}
+        self._msg_tags = None
+        self._msg_tags_obj = None
+        self._batches = {}
+        self._rbuf = bytearray()
+        self._raw_lines = deque()
+        self.raw_mode = False
+        self.decode_fallback = 'latin-1'
+        self.channel_encodings = {}
+        self.decode_fallbacks = 0
 
         self._socket = self._m_socket.socket()
 
@@ -63,7 +75,38 @@ class _Variables(object):
         self.umodes = ''
         self.cmodes = ''
         self.server = ''
+        self._own_userhost = None
+        self._mode_types = None, None
+        self.caps = set()
+        self.metrics = None
+        self.handler_stats = None
+        self.executor = None
+        self.process_pool = None
+        self.router = None
+        self.triggers = None
+        self.recorder = None
+        self.sinks = []
+        self.keepalive = None
+        self.keepalive_misses = 3
+        self.missed_pongs = 0
+        self._ping_count = 0
+        self._ping_tokens = {}
+        self._rtts = deque(maxlen=256)
+        self._last_recv = time.time()
+        self._reconnect_at = None
+        self._reconnect_delay = None
+        self._rejoin = []
+        # self.lock guards the inbound buffer and the IRC state,
+        # _send_lock only the writes to the socket.
         self.lock = RLock()
+        self._send_lock = Lock()
+        self._schedule_lock = Lock()
+        self._outbox = deque()
+        self._flood_tokens = self.flood_burst
+        self._flood_time = time.time()
+        self._timers = []
+        self._timer_count = 0
+        self._wakeup_pair = None
 
         self._ca_bundle = \
 """
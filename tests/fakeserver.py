@@ -0,0 +1,844 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A scriptable, in-process fake IRC server for tests and benchmarks.
+It implements registration, ISUPPORT, JOIN, PART, NAMES, WHO, WHOIS, -
+    MODE, LIST, TOPIC, PRIVMSG/NOTICE and QUIT; channels can be filled -
+    with synthetic users that chat at a given rate.
+Needs Python 3.7 or later (asyncio), so it lives with the tests -
+    rather than in the lurklib package.
+Example:
+    server = FakeServer()
+    server.add_channel('#big', users=5000)
+    host, port = server.start()
+    client = lurklib.Client(host, port, tls=False)
+    client.join_('#big')
+    server.chatter('#big', rate=1000)
+"""
+
+import asyncio
+import threading
+import time
+
+_ISUPPORT = (('CHANTYPES', '#&'), ('PREFIX', '(ov)@+'), \
+             ('CHANMODES', 'beI,k,l,imnpst'), ('MODES', '4'), \
+             ('NICKLEN', '30'), ('CHANNELLEN', '50'), \
+             ('TOPICLEN', '390'), ('CASEMAPPING', 'ascii'), \
+             ('TARGMAX', 'JOIN:,PRIVMSG:4,NOTICE:4'), \
+             ('CHANLIMIT', '#&:'), ('NETWORK', 'FakeNet'))
+
+
+class _User(object):
+    """ A user: a connected client or a synthetic one. """
+    def __init__(self, nick, user='fake', host='fake.host', \
+                 real_name='Fake User', connection=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.real_name = real_name
+        self.connection = connection
+        self.channels = {}
+        self.away = None
+        self.signon = int(time.time())
+
+    @property
+    def prefix(self):
+        return '%s!%s@%s' % (self.nick, self.user, self.host)
+
+
+class _Channel(object):
+    """ A channel; members maps lowercase nicks to (user, modes). """
+    def __init__(self, name):
+        self.name = name
+        self.members = {}
+        self.topic = ''
+        self.topic_by = ''
+        self.topic_time = 0
+        self.modes = set('nt')
+        self.params = {}
+        self.lists = {}
+        self.created = int(time.time())
+
+
+class _Connection(object):
+    """ A client connection and the user it registered as. """
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        peer = writer.get_extra_info('peername') or ('localhost',)
+        self.user = _User('*', host=peer[0], connection=self)
+        self.registered = False
+        self.caps = set()
+        self.quit_reason = 'Connection closed'
+
+    def write(self, lines):
+        """ Queues lines, without their CR-LF, to the client. """
+        self.writer.write(('\r\n'.join(lines) + '\r\n') \
+                          .encode('utf-8', 'replace'))
+
+
+class FakeServer(object):
+    """
+    The fake IRC server.
+    Run it in a background thread with start, or in one's own -
+        asyncio event loop with serve.
+    Once started with start, its methods may be called from any thread.
+    """
+    def __init__(self, name='fake.server', isupport=(), latency=0, \
+                 caps=(), motd=('Welcome to the fake server.',)):
+        """
+        Optional arguments:
+        * name='fake.server' - Server name.
+        * isupport=() - ISUPPORT tokens, as (name, value) pairs, -
+            added to/overriding the defaults; a value of None removes it.
+        * latency=0 - Seconds to wait before answering each command.
+        * caps=() - IRCv3 capabilities to offer.
+        * motd=('Welcome to the fake server.',) - MOTD lines.
+        """
+        self.name = name
+        self.latency = latency
+        self.caps = tuple(caps)
+        self.motd = tuple(motd)
+        self.isupport = dict(_ISUPPORT)
+        self.isupport.update(isupport)
+        self.isupport = dict((token, value) for token, value in \
+                             self.isupport.items() if value is not None)
+        self.users = {}
+        self.channels = {}
+        self.connections = []
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._tasks = []
+
+    def start(self, host='127.0.0.1', port=0):
+        """
+        Starts the server in a background thread.
+        Returns the (host, port) it listens on.
+        Optional arguments:
+        * host='127.0.0.1' - Address to listen on.
+        * port=0 - Port to listen on; 0 picks a free one.
+        """
+        ready = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.serve(host, port))
+            ready.set()
+            loop.run_forever()
+            loop.close()
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+        return self.address
+
+    async def serve(self, host='127.0.0.1', port=0):
+        """
+        Starts listening in the running event loop.
+        Optional arguments:
+        * host='127.0.0.1' - Address to listen on.
+        * port=0 - Port to listen on; 0 picks a free one.
+        """
+        self._loop = asyncio.get_event_loop()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.address = self._server.sockets[0].getsockname()[:2]
+
+    def stop(self):
+        """
+        Disconnects everyone and stops the server.
+        When it was started with serve, returns a task to await.
+        """
+        async def stop():
+            self._server.close()
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._thread is not None:
+                self._loop.stop()
+        if self._thread is None:
+            return self._loop.create_task(stop())
+        asyncio.run_coroutine_threadsafe(stop(), self._loop)
+        self._thread.join()
+        self._thread = None
+
+    def _call(self, function, *args):
+        """
+        Calls a function in the server's event loop and returns -
+            its result, waiting for it if called from another thread.
+        """
+        if self._loop is None or self._thread is None or \
+           threading.current_thread() is self._thread:
+            return function(*args)
+        done = threading.Event()
+        result = []
+
+        def call():
+            try:
+                result.append(function(*args))
+            finally:
+                done.set()
+        self._loop.call_soon_threadsafe(call)
+        done.wait()
+        return result[0]
+
+    def add_channel(self, name, users=0, topic='', ops=0):
+        """
+        Creates a channel with synthetic members.
+        Synthetic users are named user0, user1 and so on and -
+            are shared between channels.
+        Required arguments:
+        * name - Channel name.
+        Optional arguments:
+        * users=0 - Amount of synthetic members.
+        * topic='' - Channel topic.
+        * ops=0 - How many of the members are opped.
+        """
+        def add():
+            channel = self._channel(name, create=True)
+            channel.topic = topic
+            channel.topic_by = self.name
+            channel.topic_time = int(time.time())
+            for index in range(users):
+                user = self.synthetic_user(index)
+                modes = ''
+                if index < ops:
+                    modes = 'o'
+                channel.members[user.nick.lower()] = user, modes
+                user.channels[channel.name.lower()] = channel
+            return channel
+        return self._call(add)
+
+    def synthetic_user(self, index):
+        """
+        Returns synthetic user number index, creating it if needed.
+        Required arguments:
+        * index - User number.
+        """
+        nick = 'user%d' % index
+        user = self.users.get(nick)
+        if user is None:
+            user = self.users[nick] = _User(nick, 'u%d' % index, \
+                                            'synthetic%d.fake' % index)
+        return user
+
+    def inject(self, line, nick=None):
+        """
+        Sends a raw line to connected clients.
+        Required arguments:
+        * line - IRC line, without the CR-LF.
+        Optional arguments:
+        * nick=None - Client to send it to; None sends it to all of them.
+        """
+        def inject():
+            for connection in self.connections:
+                if nick is None or connection.user.nick.lower() == \
+                   nick.lower():
+                    connection.write([line])
+        self._call(inject)
+
+    def quit_user(self, nick, reason='Quit'):
+        """
+        Makes a user quit, telling everyone sharing a channel with it.
+        Required arguments:
+        * nick - User's nick.
+        Optional arguments:
+        * reason='Quit' - Quit message.
+        """
+        def quit_():
+            user = self.users.get(nick.lower())
+            if user is not None:
+                self._quit(user, reason)
+        self._call(quit_)
+
+    def chatter(self, channel, rate=100, lines=None, message='chat %d'):
+        """
+        Makes the channel's synthetic members talk, in turns.
+        Returns the asyncio task generating the traffic; -
+            see cancel for stopping it.
+        Required arguments:
+        * channel - Channel name.
+        Optional arguments:
+        * rate=100 - Lines per second; None sends them as fast -
+            as the clients read them.
+        * lines=None - Stop after this many lines; None never stops.
+        * message='chat %d' - Message, formatted with the line number.
+        """
+        def start():
+            task = self._loop.create_task(self._chatter(channel, rate, \
+                                                        lines, message))
+            self._tasks.append(task)
+            task.add_done_callback(self._tasks.remove)
+            return task
+        return self._call(start)
+
+    def cancel(self, task):
+        """
+        Cancels a task returned by chatter.
+        Required arguments:
+        * task - Task to cancel.
+        """
+        self._call(task.cancel)
+
+    async def _chatter(self, name, rate, lines, message):
+        channel = self._channel(name)
+        speakers = [user for user, modes in channel.members.values() \
+                    if user.connection is None]
+        if not speakers:
+            return
+        start = self._loop.time()
+        sent = 0
+        while lines is None or sent < lines:
+            if rate is None:
+                due = sent + 100
+            else:
+                await asyncio.sleep(0.01)
+                due = int((self._loop.time() - start) * rate)
+            if lines is not None:
+                due = min(due, lines)
+            batch = []
+            while sent < due:
+                user = speakers[sent % len(speakers)]
+                batch.append(':%s PRIVMSG %s :%s' % \
+                             (user.prefix, channel.name, message % sent))
+                sent += 1
+            if not batch:
+                continue
+            for user, modes in list(channel.members.values()):
+                if user.connection is not None:
+                    user.connection.write(batch)
+                    await user.connection.writer.drain()
+
+    async def _handle(self, reader, writer):
+        """ Serves one client connection. """
+        connection = _Connection(self, reader, writer)
+        self.connections.append(connection)
+        self._tasks.append(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                if not line:
+                    continue
+                replies = self._command(connection, line)
+                if replies is None:
+                    break
+                if replies:
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    connection.write(replies)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.remove(connection)
+            self._tasks.remove(asyncio.current_task())
+            if connection.registered:
+                self._quit(connection.user, connection.quit_reason)
+            writer.close()
+
+    def _channel(self, name, create=False):
+        """ Returns a channel, optionally creating it; else None. """
+        channel = self.channels.get(name.lower())
+        if channel is None and create:
+            channel = self.channels[name.lower()] = _Channel(name)
+        return channel
+
+    def _send(self, channel, line, exclude=None):
+        """ Sends a line to a channel's connected members. """
+        for user, modes in channel.members.values():
+            if user.connection is not None and user is not exclude:
+                user.connection.write([line])
+
+    def _common(self, user, line):
+        """ Sends a line to everyone sharing a channel with user. """
+        connections = set()
+        for channel in user.channels.values():
+            for member, modes in channel.members.values():
+                if member.connection is not None and member is not user:
+                    connections.add(member.connection)
+        for connection in connections:
+            connection.write([line])
+
+    def _quit(self, user, reason):
+        self._common(user, ':%s QUIT :%s' % (user.prefix, reason))
+        for channel in list(user.channels.values()):
+            self._leave(user, channel)
+        self.users.pop(user.nick.lower(), None)
+
+    def _leave(self, user, channel):
+        channel.members.pop(user.nick.lower(), None)
+        user.channels.pop(channel.name.lower(), None)
+        if not channel.members:
+            self.channels.pop(channel.name.lower(), None)
+
+    def _symbols(self, modes):
+        """ Returns the prefix symbols for a member's modes. """
+        letters, symbols = self.isupport['PREFIX'][1:].split(')')
+        return ''.join([symbol for letter, symbol in \
+                        zip(letters, symbols) if letter in modes])
+
+    def _command(self, connection, line):
+        """
+        Handles a line from a client.
+        Returns the lines to answer with, or None to disconnect.
+        """
+        if line[0] == ':':
+            line = line.split(' ', 1)[-1]
+        if ' :' in line:
+            line, trailing = line.split(' :', 1)
+            params = line.split()
+            params.append(trailing)
+        else:
+            params = line.split()
+        if not params:
+            return []
+        command = params.pop(0).upper()
+        user = connection.user
+        if command == 'QUIT':
+            connection.quit_reason = ' '.join(params[:1]) or 'Quit'
+            return None
+        handler = getattr(self, '_on_%s' % command.lower(), None)
+        if not connection.registered and command not in \
+           ('NICK', 'USER', 'PASS', 'CAP', 'PING', 'PONG'):
+            return [self._numeric(user, '451', ':You have not registered')]
+        if handler is None:
+            return [self._numeric(user, '421', \
+                                  '%s :Unknown command' % command)]
+        if len(params) < getattr(handler, 'params', 0):
+            return [self._numeric(user, '461', \
+                                  '%s :Not enough parameters' % command)]
+        return handler(connection, user, params)
+
+    def _numeric(self, user, numeric, text):
+        return ':%s %s %s %s' % (self.name, numeric, user.nick, text)
+
+    def _welcome(self, connection, user):
+        """ Completes registration once NICK and USER were received. """
+        if connection.registered or user.nick == '*' or \
+           not hasattr(connection, 'user_name') or \
+           'CAP' in connection.caps:
+            return []
+        connection.registered = True
+        user.user = connection.user_name
+        self.users[user.nick.lower()] = user
+        replies = [ \
+            self._numeric(user, '001', ':Welcome to %s %s' % \
+                          (self.isupport.get('NETWORK', 'IRC'), user.prefix)),
+            self._numeric(user, '002', ':Your host is %s' % self.name),
+            self._numeric(user, '003', ':This server is fake'),
+            self._numeric(user, '004', '%s fakeircd-1.0 iow %s' % \
+                          (self.name, 'beIklimnpstov'))]
+        tokens = sorted(['%s=%s' % (token, value) if value is not True \
+                         else token for token, value in \
+                         self.isupport.items()])
+        for start in range(0, len(tokens), 12):
+            replies.append(self._numeric(user, '005', '%s :are supported' \
+                     ' by this server' % ' '.join(tokens[start:start + 12])))
+        if self.motd:
+            replies.append(self._numeric(user, '375', \
+                                         ':- %s Message of the day -' % \
+                                         self.name))
+            for line in self.motd:
+                replies.append(self._numeric(user, '372', ':- %s' % line))
+            replies.append(self._numeric(user, '376', ':End of /MOTD'))
+        else:
+            replies.append(self._numeric(user, '422', ':MOTD is missing'))
+        return replies
+
+    def _on_pass(self, connection, user, params):
+        return []
+
+    def _on_pong(self, connection, user, params):
+        return []
+
+    def _on_ping(self, connection, user, params):
+        return [':%s PONG %s :%s' % (self.name, self.name, params[-1])]
+    _on_ping.params = 1
+
+    def _on_cap(self, connection, user, params):
+        subcommand = params[0].upper()
+        if subcommand == 'LS':
+            connection.caps.add('CAP')
+            return [':%s CAP %s LS :%s' % (self.name, user.nick, \
+                                           ' '.join(self.caps))]
+        elif subcommand == 'REQ' and len(params) > 1:
+            connection.caps.add('CAP')
+            requested = params[1].split()
+            if [cap for cap in requested if cap.lstrip('-') not in \
+                self.caps]:
+                return [':%s CAP %s NAK :%s' % (self.name, user.nick, \
+                                                params[1])]
+            for cap in requested:
+                if cap[0] == '-':
+                    connection.caps.discard(cap[1:])
+                else:
+                    connection.caps.add(cap)
+            return [':%s CAP %s ACK :%s' % (self.name, user.nick, \
+                                            params[1])]
+        elif subcommand == 'END':
+            connection.caps.discard('CAP')
+            return self._welcome(connection, user)
+        return []
+    _on_cap.params = 1
+
+    def _on_nick(self, connection, user, params):
+        nick = params[0]
+        if nick.lower() in self.users and \
+           self.users[nick.lower()] is not user:
+            return [self._numeric(user, '433', \
+                                  '%s :Nickname is already in use' % nick)]
+        if not connection.registered:
+            user.nick = nick
+            return self._welcome(connection, user)
+        line = ':%s NICK :%s' % (user.prefix, nick)
+        self._common(user, line)
+        old = user.nick.lower()
+        del self.users[old]
+        user.nick = nick
+        self.users[nick.lower()] = user
+        for channel in user.channels.values():
+            channel.members[nick.lower()] = channel.members.pop(old)
+        return [line]
+    _on_nick.params = 1
+
+    def _on_user(self, connection, user, params):
+        if connection.registered:
+            return [self._numeric(user, '462', ':You may not reregister')]
+        connection.user_name = params[0]
+        user.real_name = params[-1]
+        return self._welcome(connection, user)
+    _on_user.params = 4
+
+    def _on_join(self, connection, user, params):
+        replies = []
+        if params[0] == '0':
+            for channel in list(user.channels.values()):
+                replies.extend(self._on_part(connection, user, \
+                                             [channel.name]))
+            return replies
+        for name in params[0].split(','):
+            if name[:1] not in self.isupport.get('CHANTYPES', '#'):
+                replies.append(self._numeric(user, '403', \
+                                             '%s :No such channel' % name))
+                continue
+            channel = self._channel(name, create=True)
+            if user.nick.lower() in channel.members:
+                continue
+            modes = ''
+            if not channel.members:
+                modes = 'o'
+            channel.members[user.nick.lower()] = user, modes
+            user.channels[name.lower()] = channel
+            line = ':%s JOIN :%s' % (user.prefix, channel.name)
+            self._send(channel, line, user)
+            replies.append(line)
+            if channel.topic:
+                replies.append(self._numeric(user, '332', '%s :%s' % \
+                                             (channel.name, channel.topic)))
+                replies.append(self._numeric(user, '333', '%s %s %d' % \
+                               (channel.name, channel.topic_by, \
+                                channel.topic_time)))
+            replies.extend(self._names(user, channel))
+        return replies
+    _on_join.params = 1
+
+    def _names(self, user, channel):
+        """ Returns the 353 and 366 replies for a channel. """
+        replies = []
+        head = self._numeric(user, '353', '= %s :' % channel.name)
+        room = 510 - len(head.encode('utf-8'))
+        names = []
+        size = 0
+        for member, modes in channel.members.values():
+            name = self._symbols(modes)[:1] + member.nick
+            if names and size + len(name) + 1 > room:
+                replies.append(head + ' '.join(names))
+                names = []
+                size = 0
+            names.append(name)
+            size += len(name) + 1
+        if names:
+            replies.append(head + ' '.join(names))
+        replies.append(self._numeric(user, '366', \
+                                     '%s :End of /NAMES list.' % \
+                                     channel.name))
+        return replies
+
+    def _on_names(self, connection, user, params):
+        replies = []
+        for name in params[0].split(','):
+            channel = self._channel(name)
+            if channel is None:
+                replies.append(self._numeric(user, '366', \
+                               '%s :End of /NAMES list.' % name))
+            else:
+                replies.extend(self._names(user, channel))
+        return replies
+    _on_names.params = 1
+
+    def _on_part(self, connection, user, params):
+        replies = []
+        reason = ''
+        if len(params) > 1:
+            reason = ' :%s' % params[1]
+        for name in params[0].split(','):
+            channel = self._channel(name)
+            if channel is None or user.nick.lower() not in channel.members:
+                replies.append(self._numeric(user, '442', \
+                               "%s :You're not on that channel" % name))
+                continue
+            line = ':%s PART %s%s' % (user.prefix, channel.name, reason)
+            self._send(channel, line, user)
+            replies.append(line)
+            self._leave(user, channel)
+        return replies
+    _on_part.params = 1
+
+    def _on_topic(self, connection, user, params):
+        channel = self._channel(params[0])
+        if channel is None:
+            return [self._numeric(user, '403', '%s :No such channel' % \
+                                  params[0])]
+        if len(params) == 1:
+            if not channel.topic:
+                return [self._numeric(user, '331', '%s :No topic is set' % \
+                                      channel.name)]
+            return [self._numeric(user, '332', '%s :%s' % \
+                                  (channel.name, channel.topic)),
+                    self._numeric(user, '333', '%s %s %d' % \
+                                  (channel.name, channel.topic_by, \
+                                   channel.topic_time))]
+        channel.topic = params[1]
+        channel.topic_by = user.prefix
+        channel.topic_time = int(time.time())
+        line = ':%s TOPIC %s :%s' % (user.prefix, channel.name, params[1])
+        self._send(channel, line, user)
+        return [line]
+    _on_topic.params = 1
+
+    def _on_privmsg(self, connection, user, params, command='PRIVMSG'):
+        replies = []
+        for target in params[0].split(','):
+            line = ':%s %s %s :%s' % (user.prefix, command, target, params[1])
+            channel = self._channel(target)
+            recipient = self.users.get(target.lower())
+            if channel is not None:
+                self._send(channel, line, user)
+            elif recipient is not None:
+                if recipient.connection is not None:
+                    recipient.connection.write([line])
+                if recipient.away is not None and command == 'PRIVMSG':
+                    replies.append(self._numeric(user, '301', '%s :%s' % \
+                                   (recipient.nick, recipient.away)))
+            elif command == 'PRIVMSG':
+                replies.append(self._numeric(user, '401', \
+                               '%s :No such nick/channel' % target))
+        return replies
+    _on_privmsg.params = 2
+
+    def _on_notice(self, connection, user, params):
+        return self._on_privmsg(connection, user, params, 'NOTICE')
+    _on_notice.params = 2
+
+    def _on_away(self, connection, user, params):
+        if params and params[0]:
+            user.away = params[0]
+            return [self._numeric(user, '306', \
+                    ':You have been marked as being away')]
+        user.away = None
+        return [self._numeric(user, '305', \
+                ':You are no longer marked as being away')]
+
+    def _on_who(self, connection, user, params):
+        target = params[0]
+        channel = self._channel(target)
+        if channel is not None:
+            members = [(channel.name, member, modes) for member, modes in \
+                       channel.members.values()]
+        elif target.lower() in self.users:
+            member = self.users[target.lower()]
+            name = '*'
+            modes = ''
+            if member.channels:
+                channel = list(member.channels.values())[0]
+                name = channel.name
+                modes = channel.members[member.nick.lower()][1]
+            members = [(name, member, modes)]
+        else:
+            members = []
+        replies = []
+        for name, member, modes in members:
+            flags = 'H'
+            if member.away is not None:
+                flags = 'G'
+            replies.append(self._numeric(user, '352', \
+                           '%s %s %s %s %s %s%s :0 %s' % \
+                           (name, member.user, member.host, self.name, \
+                            member.nick, flags, self._symbols(modes)[:1], \
+                            member.real_name)))
+        replies.append(self._numeric(user, '315', '%s :End of /WHO list.' % \
+                                     target))
+        return replies
+    _on_who.params = 1
+
+    def _on_whois(self, connection, user, params):
+        nick = params[-1]
+        member = self.users.get(nick.lower())
+        if member is None:
+            return [self._numeric(user, '401', '%s :No such nick/channel' % \
+                                  nick),
+                    self._numeric(user, '318', '%s :End of /WHOIS list.' % \
+                                  nick)]
+        replies = [self._numeric(user, '311', '%s %s %s * :%s' % \
+                   (member.nick, member.user, member.host, member.real_name))]
+        if member.channels:
+            replies.append(self._numeric(user, '319', '%s :%s' % \
+                           (member.nick, ' '.join([self._symbols( \
+                            channel.members[member.nick.lower()][1])[:1] + \
+                            channel.name for channel in \
+                            member.channels.values()]))))
+        replies.append(self._numeric(user, '312', '%s %s :Fake server' % \
+                                     (member.nick, self.name)))
+        if member.away is not None:
+            replies.append(self._numeric(user, '301', '%s :%s' % \
+                                         (member.nick, member.away)))
+        replies.append(self._numeric(user, '317', \
+                       '%s 0 %d :seconds idle, signon time' % \
+                       (member.nick, member.signon)))
+        replies.append(self._numeric(user, '318', '%s :End of /WHOIS list.' % \
+                                     member.nick))
+        return replies
+    _on_whois.params = 1
+
+    def _on_list(self, connection, user, params):
+        names = None
+        if params:
+            names = set(name.lower() for name in params[0].split(','))
+        replies = [self._numeric(user, '321', 'Channel :Users  Name')]
+        for key, channel in sorted(self.channels.items()):
+            if names is None or key in names:
+                replies.append(self._numeric(user, '322', '%s %d :[+%s] %s' \
+                               % (channel.name, len(channel.members), \
+                                  ''.join(sorted(channel.modes)), \
+                                  channel.topic)))
+        replies.append(self._numeric(user, '323', ':End of /LIST'))
+        return replies
+
+    def _on_mode(self, connection, user, params):
+        target = params[0]
+        channel = self._channel(target)
+        if channel is None:
+            if target.lower() != user.nick.lower():
+                return [self._numeric(user, '403', '%s :No such channel' % \
+                                      target)]
+            if len(params) == 1:
+                return [self._numeric(user, '221', '+i')]
+            return [':%s MODE %s :%s' % (user.prefix, user.nick, params[1])]
+        if len(params) == 1:
+            modes = ''.join(sorted(channel.modes))
+            args = [channel.params[mode] for mode in sorted(channel.params)]
+            return [self._numeric(user, '324', '%s +%s%s' % \
+                    (channel.name, modes + ''.join(sorted(channel.params)), \
+                     ''.join([' ' + arg for arg in args]))),
+                    self._numeric(user, '329', '%s %d' % \
+                                  (channel.name, channel.created))]
+        return self._channel_mode(user, channel, params[1], params[2:])
+    _on_mode.params = 1
+
+    def _channel_mode(self, user, channel, modes, args):
+        """ Applies a channel mode change or lists a list mode. """
+        lists, keyed, limited, flags = \
+               (self.isupport['CHANMODES'].split(',') + ['', '', '', ''])[:4]
+        letters = self.isupport['PREFIX'][1:].split(')')[0]
+        args = list(args)
+        list_modes = [mode for mode in modes if mode in lists]
+        if list_modes and not args and modes.lstrip('+') in lists:
+            return self._mode_list(user, channel, modes.lstrip('+'))
+        plus = True
+        changes = []
+        for mode in modes:
+            if mode in '+-':
+                plus = mode == '+'
+                continue
+            arg = None
+            if mode in letters or mode in lists or mode in keyed or \
+               mode in limited and plus:
+                if not args:
+                    continue
+                arg = args.pop(0)
+            if mode in letters:
+                member = channel.members.get(arg.lower())
+                if member is None:
+                    continue
+                if plus and mode not in member[1]:
+                    channel.members[arg.lower()] = member[0], member[1] + mode
+                elif not plus:
+                    channel.members[arg.lower()] = member[0], \
+                                                   member[1].replace(mode, '')
+            elif mode in lists:
+                entries = channel.lists.setdefault(mode, {})
+                if plus:
+                    entries[arg] = user.prefix, int(time.time())
+                else:
+                    entries.pop(arg, None)
+            elif mode in keyed or mode in limited:
+                if plus:
+                    channel.params[mode] = arg
+                else:
+                    channel.params.pop(mode, None)
+            elif mode in flags:
+                if plus:
+                    channel.modes.add(mode)
+                else:
+                    channel.modes.discard(mode)
+            else:
+                continue
+            changes.append(('+' if plus else '-', mode, arg))
+        if not changes:
+            return []
+        text = ''
+        sign = None
+        for change_sign, mode, arg in changes:
+            if change_sign != sign:
+                text += change_sign
+                sign = change_sign
+            text += mode
+        text += ''.join([' ' + arg for sign, mode, arg in changes \
+                         if arg is not None])
+        line = ':%s MODE %s %s' % (user.prefix, channel.name, text)
+        self._send(channel, line, user)
+        return [line]
+
+    def _mode_list(self, user, channel, mode):
+        """ Returns a ban, except or invite list. """
+        numerics = {'b': ('367', '368', 'ban'), \
+                    'e': ('348', '349', 'exception'), \
+                    'I': ('346', '347', 'invite')}
+        entry, end, name = numerics.get(mode, ('367', '368', 'ban'))
+        replies = []
+        for mask, (setter, when) in channel.lists.get(mode, {}).items():
+            replies.append(self._numeric(user, entry, '%s %s %s %d' % \
+                                         (channel.name, mask, setter, when)))
+        replies.append(self._numeric(user, end, '%s :End of channel %s list' \
+                                     % (channel.name, name)))
+        return replies
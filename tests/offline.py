@@ -0,0 +1,85 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A registered client on an in-memory socket, -
+    shared by the tests and the benchmarks.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import lurklib
+
+
+class MemorySocket(object):
+    """ A socket that reads fed lines and records what's sent. """
+    def __init__(self):
+        self.inbox = bytearray()
+        self.sent = []
+        self.closed = False
+
+    def feed(self, *lines):
+        for line in lines:
+            self.inbox += (line + '\r\n').encode('UTF-8')
+
+    def pending(self):
+        return len(self.inbox) > 0
+
+    def recv(self, size):
+        data = bytes(self.inbox[:size])
+        del self.inbox[:size]
+        return data
+
+    def sendall(self, data):
+        self.sent.append(data.decode('UTF-8').rstrip('\r\n'))
+
+    def fileno(self):
+        if self.closed:
+            return -1
+        return 0
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def memory_select(readable, writable, errors, timeout=None):
+    return [sock for sock in readable \
+            if hasattr(sock, 'pending') and sock.pending()], [], []
+
+
+class OfflineClient(lurklib.Client):
+    """ A client that registers without connecting. """
+    def _init(self, server, nick, *args):
+        self._connection_args = (server, nick) + args
+        self.current_nick = nick
+        self.connected = True
+        self.keep_going = True
+
+
+def offline_client(cls=OfflineClient, **kwargs):
+    """ Returns a registered client of cls on a MemorySocket. """
+    if not issubclass(cls, OfflineClient):
+        cls = type(cls.__name__, (OfflineClient, cls), {})
+    kwargs.setdefault('nick', 'me')
+    kwargs.setdefault('tls', False)
+    client = cls('offline', **kwargs)
+    client._socket = MemorySocket()
+    client._select = memory_select
+    return client
@@ -0,0 +1,134 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from conftest import offline_client
+
+
+def joined(channel, names, nick='me'):
+    return [':%s!u@h JOIN :%s' % (nick, channel), \
+            ':srv 353 %s = %s :%s' % (nick, channel, names), \
+            ':srv 366 %s %s :End of /NAMES list.' % (nick, channel)]
+
+
+def test_join_many_keeps_unrelated_lines_in_order(client):
+    client._socket.feed(*(['@msgid=1 :a!u@h PRIVMSG #x :first'] + \
+                          joined('#a', '@me bob') + \
+                          ['@msgid=2 :a!u@h PRIVMSG #x :second'] + \
+                          joined('#b', 'me +carol') + \
+                          ['@msgid=3 :a!u@h PRIVMSG #x :third']))
+    results = client.join_many(['#a', '#b'])
+    assert client._socket.sent == ['JOIN #a,#b']
+    assert sorted(results['#a'][0]) == ['@me', 'bob']
+    for number, text in enumerate(('first', 'second', 'third')):
+        event = client.recv()
+        assert event[1][2] == text
+        assert client.tags['msgid'] == str(number + 1)
+
+
+def test_join_many_shown_own_join_keeps_names_prefixes():
+    client = offline_client(hide_called_events=False)
+    client._socket.feed(*joined('#a', '@me bob'))
+    client.join_many(['#a'])
+    event = client.recv()
+    assert event[0] == 'JOIN'
+    assert event[1][1] == '#a'
+    assert client.channels['#a']['USERS']['me'][2] == '@'
+    assert set(client.channels['#a']['USERS']) == set(['me', 'bob'])
+
+
+def test_join_lines_are_sized_in_bytes(client):
+    channels = ['#%s%d' % (u'\xe9' * 20, number) for number in range(60)]
+    lines = client._join_lines(channels, {})
+    assert len(lines) > 1
+    for line in lines:
+        assert len(line.encode('UTF-8')) <= 510
+    assert sum(line.count('#') for line in lines) == 60
+
+
+def queued(client):
+    return client._socket.sent + [data.decode('UTF-8') \
+                                  for data in client._outbox]
+
+
+def test_mode_batch_empty_modes_means_unlimited(client):
+    client.version['MODES'] = ''
+    changes = [('+', 'v', 'nick%d' % number) for number in range(10)]
+    assert client.mode_batch('#a', changes) == 1
+    assert queued(client)[0].split()[2] == '+' + 'v' * 10
+
+
+def test_mode_batch_rejects_changes_missing_their_argument(client):
+    for change in (('+', 'b', None), ('+', 'o', None), ('-', 'k', None), \
+                   ('+', 'l', None)):
+        with pytest.raises(ValueError):
+            client.mode_batch('#a', [change, ('+', 'v', 'alice')])
+    assert queued(client) == []
+    assert client.mode_batch('#a', [('-', 'l', None), ('+', 'm', None), \
+                                    ('+', 'v', 'alice')]) == 1
+    assert queued(client) == ['MODE #a -l+mv alice']
+
+
+def test_mode_batch_budgets_encoded_bytes(client):
+    client.version['MODES'] = '100'
+    client._own_userhost = 'u@h'
+    changes = [('+', 'v', u'\xe9' * 20 + str(number)) \
+               for number in range(60)]
+    client.mode_batch('#a', changes)
+    lines = queued(client)
+    assert len(lines) > 1
+    for line in lines:
+        assert len((':me!u@h ' + line).encode('UTF-8')) <= 510
+    assert sum(len(line.split()) - 3 for line in lines) == 60
+
+
+class ZoneTime(object):
+    """ Tells local time from UTC apart. """
+    def time(self):
+        return 0.0
+
+    def localtime(self, seconds=None):
+        return 'local', seconds
+
+    def gmtime(self, seconds=None):
+        return 'utc', seconds
+
+
+def test_cmode_echo_updates_the_list_cache(client):
+    client.channels['#a'] = {'USERS': {'me': [''] * 5}, 'LISTS': {'b': {}}}
+    client._socket.feed(':me!u@h MODE #a +b :*!*@x')
+    client.cmode('#a', '+b *!*@x')
+    assert client.is_listed('#a', '*!*@x')
+
+
+def test_list_cache_times_follow_utc():
+    client = offline_client(UTC=True)
+    client._m_time = ZoneTime()
+    client.channels['#a'] = {'USERS': {'me': [''] * 5}}
+    client._socket.feed(':srv 367 me #a *!*@x op 1300000000', \
+                        ':srv 368 me #a :End of list')
+    assert client.banlist('#a')[0][2] == ('utc', 1300000000)
+    client.parse_cmode_string('+b *!*@y', '#a', 'op')
+    assert client.channels['#a']['LISTS']['b']['*!*@y'][2][0] == 'utc'
+
+
+def test_join_lines_without_a_targmax_join_entry(client):
+    client.version['TARGMAX'] = 'NAMES:1,LIST:1,KICK:1,WHOIS:1,' \
+                                'PRIVMSG:4,NOTICE:4,ACCEPT:,MONITOR:'
+    assert client._join_lines(['#a', '#b', '#c'], {}) == ['JOIN #a,#b,#c']
+    client.version['TARGMAX'] = 'JOIN:2'
+    assert client._join_lines(['#a', '#b', '#c'], {}) == \
+        ['JOIN #a,#b', 'JOIN #c']
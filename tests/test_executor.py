@@ -0,0 +1,57 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from lurklib.executor import KeyedExecutor
+
+
+def test_blocking_submit_survives_drained_queue():
+    executor = KeyedExecutor(4, max_pending=1)
+    lock = threading.Lock()
+    calls = []
+
+    def call(number):
+        with lock:
+            calls.append(number)
+    for number in range(5000):
+        executor.submit('#chan', call, number)
+    executor.shutdown(True)
+    assert calls == list(range(5000))
+    assert not executor._running
+    assert not executor._queues
+
+
+def test_same_key_runs_in_order_different_keys_in_parallel():
+    executor = KeyedExecutor(2)
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        order.append('slow')
+    executor.submit('#a', slow)
+    executor.submit('#a', order.append, 'after slow')
+    started.wait(5)
+    executor.submit('#b', order.append, 'other key')
+    for attempt in range(100):
+        if order:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    executor.shutdown(True)
+    assert order == ['other key', 'slow', 'after slow']
@@ -0,0 +1,51 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import pytest
+import lurklib
+
+if sys.version_info < (3, 7):
+    pytest.skip('FakeServer needs Python 3.7', allow_module_level=True)
+
+from fakeserver import FakeServer
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    server.add_channel('#c', users=3)
+    yield server
+    server.stop()
+
+
+def test_other_users_join_is_relayed(server):
+    host, port = server.start()
+    first = lurklib.Client(host, port, nick='first', tls=False)
+    second = lurklib.Client(host, port, nick='second', tls=False)
+    try:
+        users = first.join_('#c')[0]
+        assert '@first' not in users
+        assert len(users) == 4
+        second.join_('#c')
+        event = first.recv(5)
+        assert event[0] == 'JOIN'
+        assert event[1][0][0] == 'second'
+        assert event[1][1] == '#c'
+        assert 'second' in first.channels['#c']['USERS']
+    finally:
+        first.quit()
+        second.quit()
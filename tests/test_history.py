@@ -0,0 +1,82 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import threading
+import time
+import pytest
+from lurklib.history import HistoryStore
+
+
+class FlakyDatabase(object):
+    """ Wraps a connection whose first executemany fails. """
+    def __init__(self, db):
+        self.db = db
+        self.failures = 1
+
+    def executemany(self, *args):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError('database is locked')
+        return self.db.executemany(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def test_failed_write_is_logged_and_retried(tmpdir, caplog):
+    store = HistoryStore(os.path.join(str(tmpdir), 'history.db'), \
+                         flush_interval=0.01)
+    store._db = FlakyDatabase(store._db)
+    store.add('Nick', 'PRIVMSG', '#chan', 'hello', 'u@h', 1.0)
+    deadline = time.time() + 5
+    while store.seen('nick') is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert store.seen('nick').text == 'hello'
+    assert store._thread.is_alive()
+    assert 'Writing 1 rows' in caplog.text
+    store.close()
+
+
+def test_close_closes_reader_connections(tmpdir):
+    store = HistoryStore(os.path.join(str(tmpdir), 'history.db'))
+    store.add('Nick', 'JOIN', '#chan', when=1.0)
+    store.flush()
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(store.seen('nick')))
+    thread.start()
+    thread.join()
+    assert seen[0].kind == 'JOIN'
+    assert store.history('#chan')[0].nick == 'Nick'
+    readers = list(store._readers)
+    assert len(readers) == 2
+    store.close()
+    for db in readers:
+        with pytest.raises(sqlite3.ProgrammingError):
+            db.execute('SELECT 1')
+
+
+def test_kick_is_found_by_the_kicked_nick(tmpdir):
+    store = HistoryStore(os.path.join(str(tmpdir), 'history.db'))
+    store.event(None, 'on_kick', (('Op', 'o', 'h'), '#chan', 'Bob', 'bye'))
+    store.flush()
+    assert store.seen('op').kind == 'KICK'
+    row = store.seen('bob')
+    assert (row.kind, row.channel, row.text) == ('KICKED', '#chan', 'bye')
+    assert sorted(row.kind for row in store.history('#chan')) == \
+        ['KICK', 'KICKED']
+    store.close()
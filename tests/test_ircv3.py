@@ -0,0 +1,51 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import types
+
+
+def test_chathistory_collects_the_batch_and_keeps_other_lines(client):
+    client._socket.feed( \
+        '@msgid=live1 :a!u@h PRIVMSG #chan :live first', \
+        ':srv BATCH +h1 chathistory #chan', \
+        '@batch=h1;msgid=old1 :b!u@h PRIVMSG #chan :old first', \
+        ':srv FAIL JOIN UNKNOWN_ERROR :unrelated', \
+        '@batch=h1;msgid=old2 :c!u@h PRIVMSG #chan :old second', \
+        ':srv BATCH -h1', \
+        '@msgid=live2 :a!u@h PRIVMSG #chan :live second')
+    messages = client.chathistory('#chan')
+    assert not isinstance(messages, types.GeneratorType)
+    assert [message[1][2] for message in messages] == \
+        ['old first', 'old second']
+    assert messages[1][2]['msgid'] == 'old2'
+    assert client.lock.acquire(blocking=False)
+    client.lock.release()
+
+    event = client.recv()
+    assert event[1][2] == 'live first'
+    assert client.tags['msgid'] == 'live1'
+    assert client.recv()[0] == 'UNKNOWN'
+    event = client.recv()
+    assert event[1][2] == 'live second'
+    assert client.tags['msgid'] == 'live2'
+
+
+def test_chathistory_stops_on_its_own_fail_only(client):
+    client._socket.feed( \
+        ':srv FAIL CHATHISTORY INVALID_TARGET #chan :No such channel', \
+        ':a!u@h PRIVMSG #chan :after')
+    assert client.chathistory('#chan') == []
+    assert client.recv()[1][2] == 'after'
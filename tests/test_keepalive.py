@@ -0,0 +1,114 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+from conftest import MemorySocket, OfflineClient, offline_client
+
+
+class ChunkSocket(MemorySocket):
+    """ A MemorySocket that returns one fed chunk per recv. """
+    def __init__(self, *chunks):
+        MemorySocket.__init__(self)
+        self.chunks = [(chunk + '\r\n').encode('UTF-8') for chunk in chunks]
+
+    def pending(self):
+        return bool(self.chunks)
+
+    def recv(self, size):
+        return self.chunks.pop(0)
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_pong_only_chunk_is_consumed():
+    client = offline_client()
+    token = client._send_ping()
+    client._socket = ChunkSocket( \
+        '@time=2011-01-01T00:00:00.000Z :srv PONG srv :%s' % token, \
+        ':nick!user@host PRIVMSG me :hello')
+    event = client.recv()
+    assert event[0] == 'PRIVMSG'
+    assert event[1][2] == 'hello'
+    assert client._msg_tags is None
+    assert len(client._rtts) == 1
+
+
+def test_ping_is_answered_and_its_tags_dropped():
+    client = offline_client()
+    client._socket = ChunkSocket('@time=x PING :srv', \
+                                 ':nick!user@host PRIVMSG me :hello')
+    event = client.recv()
+    assert event[1][2] == 'hello'
+    assert client._msg_tags is None
+    assert client._socket.sent == ['PONG :srv']
+
+
+def test_latency_measures_every_call():
+    client = offline_client()
+    client._rtts.append(99.0)
+    client._m_time = FakeTime()
+
+    class Socket(MemorySocket):
+        def sendall(self, data):
+            MemorySocket.sendall(self, data)
+            line = data.decode('UTF-8').rstrip('\r\n')
+            if line.startswith('PING :'):
+                client._m_time.now += 0.25
+                self.feed(':srv PONG srv :%s' % line[6:])
+    client._socket = Socket()
+    assert client.latency() == 0.25
+    assert client.latency_stats()['LAST'] == 0.25
+
+
+class FlakyClient(OfflineClient):
+    failures = 0
+
+    def _init(self, *args):
+        if self.failures:
+            self.failures -= 1
+            raise socket.error('Connection refused')
+        OfflineClient._init(self, *args)
+        self._socket = MemorySocket()
+
+
+def test_failed_reconnect_backs_off_and_rejoins_at_once():
+    client = offline_client(FlakyClient, keepalive=60)
+    client._m_time = FakeTime()
+    client.failures = 2
+    client.channels = {'#a': {}, '#b': {}}
+    joined = []
+    client.join_many = lambda channels: joined.append(list(channels))
+    client.missed_pongs = client.keepalive_misses
+
+    client._keepalive()
+    assert client._reconnect_at == 1001.0
+    client._m_time.now = 1001.0
+    client._keepalive()
+    assert client._reconnect_at == 1003.0
+    client._m_time.now = 1002.0
+    client._keepalive()
+    assert not joined
+    client._m_time.now = 1003.0
+    client._keepalive()
+    assert client._reconnect_at is None
+    assert client.connected
+    assert joined == [['#a', '#b']]
@@ -0,0 +1,78 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import select
+import socket
+import threading
+import time
+from conftest import OfflineClient, offline_client
+
+
+class LoopClient(OfflineClient):
+    def __init__(self, *args, **kwargs):
+        self.messages = []
+        self.errors = []
+        OfflineClient.__init__(self, *args, **kwargs)
+
+    def on_privmsg(self, from_, message):
+        self.messages.append(message)
+
+    def run(self):
+        try:
+            self.mainloop()
+        except Exception as exception:
+            self.errors.append(exception)
+
+
+def socket_client():
+    client = offline_client(LoopClient)
+    client._socket, server = socket.socketpair()
+    client._select = select.select
+    return client, server
+
+
+def test_quit_from_another_thread_ends_mainloop():
+    client, server = socket_client()
+    thread = threading.Thread(target=client.run)
+    thread.start()
+    server.sendall(b':a!u@h PRIVMSG me :hello\r\n')
+    deadline = time.time() + 5
+    while not client.messages and time.time() < deadline:
+        time.sleep(0.01)
+    client.quit('bye')
+    thread.join(5)
+    assert not thread.is_alive()
+    assert client.errors == []
+    assert client.messages == ['hello']
+    assert server.recv(4096) == b'QUIT :bye\r\n'
+    server.close()
+
+
+def test_wait_on_a_closed_socket_returns_false():
+    client, server = socket_client()
+    client._socket.close()
+    start = time.time()
+    assert client._wait(0.05) is False
+    assert time.time() - start >= 0.04
+    server.close()
+
+
+def test_recv_raw_reads_data_already_decrypted_by_tls(client):
+    client._select = lambda *args: ([], [], [])
+    client._socket.feed(':a!u@h PRIVMSG me :buffered')
+    message = client.recv_raw(0.01)
+    assert message is not None
+    assert message.command == b'PRIVMSG'
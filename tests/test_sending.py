@@ -0,0 +1,62 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+from lurklib.sending import split_message
+
+
+def test_split_message_keeps_multibyte_characters_whole():
+    text = u'日本語' * 200
+    for encoding in ('UTF-8', 'shift_jis', 'gbk'):
+        data = text.encode(encoding)
+        parts = split_message(data, 101, encoding)
+        assert b''.join(parts) == data
+        for part in parts:
+            assert len(part) <= 101
+            part.decode(encoding)
+
+
+def test_long_message_is_sent_in_parts(client):
+    client.flood_burst = 100
+    client._own_userhost = 'u@h'
+    message = u'\xe9\xe8 ' * 300
+    client.privmsg('#a', message)
+    sent = client._socket.sent
+    assert len(sent) > 1
+    for line in sent:
+        assert line.startswith('PRIVMSG #a :')
+        assert len((':me!u@h ' + line).encode('UTF-8')) <= 510
+    assert ' '.join(line[12:] for line in sent) == message
+
+
+def test_userhost_query_is_not_shadowed(client):
+    client._socket.feed(':srv 302 me :bob=+bob@b.example')
+    assert client.userhost('bob') == ['bob=+bob@b.example']
+    assert client._socket.sent == ['USERHOST :bob']
+
+
+def test_hidden_host_is_tracked_by_process_once(client):
+    client._own_userhost = 'u@real.example.net'
+    client._socket.feed(':srv 396 me cloak/me :is now your hidden host')
+    client.process_once()
+    assert client._own_userhost == 'u@cloak/me'
+
+
+def test_away_reply_is_returned_only_when_asked_for(client):
+    client._socket.feed(':srv 301 me bob :gone fishing')
+    assert client.privmsg('bob', 'hi') is None
+    assert client.notice('bob', 'hi', wait_away=True) == \
+        ('AWAY', 'gone fishing')
+    assert client._socket.sent == ['PRIVMSG bob :hi', 'NOTICE bob :hi']
@@ -0,0 +1,48 @@
+#    This file is part of Lurklib.
+#    Copyright (C) 2011  LK-
+#
+#    Lurklib is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Lurklib is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Lurklib.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from lurklib.triggers import Triggers, required_literal
+
+
+def test_required_literal_is_in_every_match():
+    cases = [(r'abc\x41def', 'abcAdef'), (r'abécdef', u'ab\xe9cdef'), \
+             (r'ab\N{BULLET}cdef', u'ab•cdef'), \
+             (r'hi\0123456', 'hi\n3456'), (r'ab\d12345', 'ab712345'), \
+             (r'(ab)c\1defg', 'abcabdefg'), (r'x\.yzw', 'x.yzw')]
+    for pattern, text in cases:
+        assert re.search(pattern, text)
+        literal = required_literal(pattern)
+        assert literal is not None
+        assert literal in text.lower(), pattern
+
+
+def test_required_literal_skips_escape_arguments():
+    assert required_literal(r'abc\x41def') == 'abc'
+    assert required_literal(r'\N{BULLET}xy') is None
+
+
+def test_overlapping_regex_triggers_all_match():
+    triggers = Triggers()
+    triggers.add_regex('digits', r'\d+')
+    triggers.add_regex('number', r'(\d)\d*')
+    triggers.add_regex('tail', r'\d\w')
+    triggers.add_regex('never', r'\d{9}')
+    matches = dict(triggers.match('ab 42x'))
+    assert sorted(matches) == ['digits', 'number', 'tail']
+    assert matches['number'].group(1) == '4'
+    assert matches['tail'].group() == '42'
+    assert triggers.match('no digits here') == []